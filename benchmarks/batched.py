@@ -0,0 +1,140 @@
+'''Seconds of training the clients of a round sequentially (Model.solve_inner
+per client) and in one batched graph (BatchedModel.solve_inner), and the
+largest difference between their solutions
+
+Both paths train synthetic mclr clients of uneven sizes on the same
+minibatches. The batched matmuls sum in another order than the sequential
+ones, so the solutions are only equal up to float rounding; with --check the
+largest absolute difference is asserted to be below --atol (1e-4, the
+measured difference is about 6e-08). Run from the repository root:
+
+    python -m benchmarks.batched --num_clients 20 100 --num_epochs 20 --batch_size 10 --check
+
+--check also trains a few rounds of FedProx with stragglers (drop_percent >
+0) sequentially and client-batched, and asserts that both paths give every
+client the same number of epochs and end with the same model up to --atol.
+'''
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow.compat.v1 as tf
+tf.disable_v2_behavior()
+
+from flearn.models.synthetic.mclr import Model, BatchedModel
+from flearn.trainers import fedprox
+
+
+def make_datas(num_clients, num_classes, seed=0):
+    '''Train data of num_clients clients with 10 to 200 samples each'''
+    rng = np.random.RandomState(seed)
+    datas = []
+    for _ in range(num_clients):
+        n = rng.randint(10, 200)
+        datas.append({'x': rng.randn(n, 60).astype(np.float32), 'y': rng.randint(num_classes, size=n)})
+    return datas
+
+
+def copy(datas):
+    # Model.solve_inner() shuffles the data in place
+    return [{k: v.copy() for k, v in data.items()} for data in datas]
+
+
+def fedprox_epochs(client_batched, num_classes, num_rounds=3, num_clients=12, drop_percent=0.5):
+    '''Trains FedProx on synthetic mclr clients, returns the (round, client,
+    epochs) of every trained client and the final model
+    '''
+    datas = make_datas(num_clients, num_classes)
+    users = ['f_{:02d}'.format(k) for k in range(num_clients)]
+    dataset = (users, [], dict(zip(users, copy(datas))), dict(zip(users, copy(datas))))
+    params = {'dataset': 'synthetic_batched_check', 'export_filename': 'fedprox.csv', 'model_params': (num_classes,),
+        'num_rounds': num_rounds, 'eval_every': num_rounds, 'clients_per_round': num_clients // 2,
+        'batch_size': 10, 'num_epochs': 5, 'learning_rate': 0.01, 'mu': 0.1, 'seed': 0,
+        'drop_percent': drop_percent, 'no_flops': True, 'flops_cache': '', 'client_batched': client_batched}
+
+    chosen = []
+    solve_clients = fedprox.solve_clients
+    def recording_solve_clients(clients, model, get_epochs, *args):
+        def record(c):
+            epochs = get_epochs(c)
+            chosen.append((len(chosen) // params['clients_per_round'], c.id, epochs))
+            return epochs
+        return solve_clients(clients, model, record, *args)
+
+    tf.reset_default_graph()
+    np.random.seed(12)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp) # results/ of the CSVWriter
+        fedprox.solve_clients = recording_solve_clients
+        try:
+            server = fedprox.Server(params, Model, dataset)
+            server.train()
+            server.writer.close()
+        finally:
+            fedprox.solve_clients = solve_clients
+            os.chdir(cwd)
+    return chosen, server.latest_model.flat
+
+
+def check_fedprox(num_classes, atol):
+    '''Asserts that sequential and client-batched FedProx choose the same
+    straggler epochs and train the same model
+    '''
+    seq_epochs, seq_model = fedprox_epochs(False, num_classes)
+    batched_epochs, batched_model = fedprox_epochs(True, num_classes)
+    assert any(epochs < 5 for _, _, epochs in seq_epochs), 'no straggler was drawn'
+    assert seq_epochs == batched_epochs, 'epochs differ: {} != {}'.format(seq_epochs, batched_epochs)
+    diff = np.abs(seq_model - batched_model).max()
+    assert diff < atol, 'FedProx models differ by {} >= {}'.format(diff, atol)
+    print('fedprox: same epochs for {} clients, max diff {:.2e}'.format(len(seq_epochs), diff))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_clients', type=int, nargs='+', default=[20, 100])
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--num_epochs', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=10)
+    parser.add_argument('--learning_rate', type=float, default=0.01)
+    parser.add_argument('--atol', help='largest allowed difference of the solutions, with --check;',
+        type=float, default=1e-4)
+    parser.add_argument('--check', help='assert that the solutions differ by less than --atol;',
+        action='store_true')
+    args = parser.parse_args()
+
+    print('{:>7} {:>12} {:>12} {:>8} {:>10}'.format('clients', 'sequential s', 'batched s', 'speedup', 'max diff'))
+    for num_clients in args.num_clients:
+        datas = make_datas(num_clients, args.num_classes)
+        model = Model(args.num_classes, tf.train.GradientDescentOptimizer(args.learning_rate))
+        start_model = model.get_params()
+
+        seq_solns = []
+        start = time.time()
+        for data in copy(datas):
+            model.set_params(start_model)
+            soln, _ = model.solve_inner(data, args.num_epochs, args.batch_size)
+            seq_solns.append(soln.flat)
+        seq_time = time.time() - start
+        model.close()
+
+        batched = BatchedModel(num_clients, args.num_classes, False, args.learning_rate, 0.)
+        start = time.time()
+        solns = batched.solve_inner(datas, [args.num_epochs] * num_clients, args.batch_size, start_model)
+        batched_time = time.time() - start
+        batched.close()
+
+        diff = max(np.abs(s.flat - f).max() for s, f in zip(solns, seq_solns))
+        print('{:>7} {:>12.2f} {:>12.2f} {:>7.1f}x {:>10.2e}'.format(
+            num_clients, seq_time, batched_time, seq_time / batched_time, diff))
+        if args.check:
+            assert diff < args.atol, 'solutions differ by {} >= {}'.format(diff, args.atol)
+    if args.check:
+        check_fedprox(args.num_classes, args.atol)
+        print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''Time, peak memory and accuracy of the clustering backends (measure x
+algorithm, see flearn/utils/clustering.py) over a sweep of federations
+
+The updates of num_clients clients are drawn around num_groups directions
+and streamed into each backend as in clustering_clients (peak MB traces
+the Python heap, not the memory-mapped updates). Accuracy: the
+adjusted rand index (ARI) of the clustering against the true groups. The
+MADC backends are only run up to --madc_max clients. Run from the
+repository root:
+
+    python -m benchmarks.clustering --num_clients 100 400 1000 --num_params 10000 100000 --num_groups 3 5
+'''
+import argparse
+import itertools
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from flearn.utils.clustering import ClusteringBackend, ALGORITHMS
+
+
+def updates(num_clients, num_params, num_groups, noise, seed=0):
+    '''Yields the updates of the clients and their groups'''
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(num_groups, num_params).astype(np.float32)
+    for _ in range(num_clients):
+        g = rng.randint(num_groups)
+        w = centers[g] + noise * rng.randn(num_params).astype(np.float32)
+        yield w * np.float32(rng.uniform(0.5, 2)), g
+
+
+def run(backend, num_clients, num_params, num_groups, noise):
+    '''Returns the labels, the true groups, the seconds and the peak traced
+    bytes of streaming the updates into the backend and clustering them
+    '''
+    groups = []
+    tracemalloc.start()
+    start = time.time()
+    backend.start(num_params, num_clients)
+    for w, g in updates(num_clients, num_params, num_groups, noise):
+        backend.add(w)
+        groups.append(g)
+    labels = backend.fit()
+    backend.close()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return labels, groups, elapsed, peak
+
+
+def backends(args, num_groups):
+    '''Yields the name and the backend of each measure x algorithm'''
+    for algorithm in ALGORITHMS:
+        yield 'EDC/' + algorithm, ClusteringBackend(num_groups, 'EDC', algorithm, seed=0)
+        yield 'EDC-sketch/' + algorithm, ClusteringBackend(num_groups, 'EDC', algorithm,
+            sketch_size=args.sketch_size, seed=0)
+        yield 'MADC/' + algorithm, ClusteringBackend(num_groups, 'MADC', algorithm, seed=0,
+            madc_budget=int(args.madc_budget * 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_clients', type=int, nargs='+', default=[100, 400, 1000])
+    parser.add_argument('--num_params', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--num_groups', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--noise', help='scale of the per-client noise of the updates;', type=float, default=2.)
+    parser.add_argument('--sketch_size', type=int, default=4096)
+    parser.add_argument('--madc_budget', help='MB of a block of the MADC computation;', type=float, default=256)
+    parser.add_argument('--madc_max', help='largest number of clients of the MADC backends;', type=int, default=1000)
+    parser.add_argument('--backends', help='names of the backends to run, e.g. EDC/kmeans (all by default);',
+        type=str, nargs='*', default=None)
+    args = parser.parse_args()
+
+    print('{:>7} {:>9} {:>6}  {:<26} {:>9} {:>11} {:>7}'.format(
+        'clients', 'params', 'groups', 'backend', 'seconds', 'peak MB', 'ARI'))
+    for n, p, k in itertools.product(args.num_clients, args.num_params, args.num_groups):
+        for name, backend in backends(args, k):
+            if args.backends and name not in args.backends:
+                continue
+            if backend.measure == 'MADC' and n > args.madc_max:
+                continue
+            labels, groups, elapsed, peak = run(backend, n, p, k, args.noise)
+            print('{:>7} {:>9} {:>6}  {:<26} {:>9.2f} {:>11.1f} {:>7.4f}'.format(
+                n, p, k, name, elapsed, peak / 2**20, adjusted_rand_score(groups, labels)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''Accuracy, time and peak memory of the decomposed cosine measure (EDC):
+TruncatedSVD of the stacked updates vs the single-pass SketchedSVD
+
+The updates of num_clients clients are drawn one at a time around
+num_groups directions. Accuracy: the smallest cosine of the principal
+angles between the two EDC subspaces, and the adjusted rand index between
+the KMeans clusterings of the two matrices (and of each against the true
+groups). Run from the repository root:
+
+    python -m benchmarks.edc --num_clients 100 --num_params 1000000
+
+Measured with 100 clients and 5 groups (see flearn/utils/sketch.py for
+why a CountSketch and not a Gaussian range finder):
+
+    1M params, noise 2: TruncatedSVD 10.8 s / 1.2 GB, SketchedSVD 5.2 s /
+        69 MB, subspace cosine 0.994, same clustering
+    noise 4: subspace cosine 0.94, ARI sketched vs TruncatedSVD 0.85
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import adjusted_rand_score
+from sklearn.metrics.pairwise import cosine_similarity
+
+from flearn.utils.sketch import SketchedSVD
+
+
+def updates(args):
+    '''Yields the updates of the clients and their groups'''
+    rng = np.random.RandomState(0)
+    centers = rng.randn(args.num_groups, args.num_params).astype(np.float32)
+    for _ in range(args.num_clients):
+        g = rng.randint(args.num_groups)
+        w = centers[g] + args.noise * rng.randn(args.num_params).astype(np.float32)
+        yield w * np.float32(rng.uniform(0.5, 2)), g
+
+
+def truncated_svd_edc(args):
+    '''The former clustering_clients path'''
+    update_array = [w for w, _ in updates(args)]
+    delta_w = np.vstack(update_array)
+    svd = TruncatedSVD(n_components=args.num_groups, random_state=0)
+    decomp_updates = svd.fit_transform(delta_w.T)
+    return cosine_similarity(delta_w, decomp_updates.T)
+
+
+def sketched_edc(args):
+    sketch = SketchedSVD(args.num_params, args.num_groups, args.sketch_size, seed=0)
+    for w, _ in updates(args):
+        sketch.add(w)
+    return sketch.decomposed_cosine()
+
+
+def run(edc, args):
+    '''Returns the result, the seconds and the peak traced bytes of edc()'''
+    tracemalloc.start()
+    start = time.time()
+    result = edc(args)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_clients', type=int, default=100)
+    parser.add_argument('--num_params', type=int, default=200000)
+    parser.add_argument('--num_groups', type=int, default=5)
+    parser.add_argument('--noise', help='scale of the per-client noise of the updates;', type=float, default=2.)
+    parser.add_argument('--sketch_size', type=int, default=4096)
+    args = parser.parse_args()
+
+    groups = np.array([g for _, g in updates(args)])
+    results = {}
+    for name, edc in [('TruncatedSVD', truncated_svd_edc), ('SketchedSVD', sketched_edc)]:
+        results[name], elapsed, peak = run(edc, args)
+        print('{:>12}: {:8.2f} s, peak {:10.1f} MB'.format(name, elapsed, peak / 2**20))
+
+    ref, sketched = results['TruncatedSVD'], results['SketchedSVD']
+    cosines = np.linalg.svd(np.linalg.qr(ref)[0].T.dot(np.linalg.qr(sketched)[0]), compute_uv=False)
+    labels = {name: KMeans(args.num_groups, random_state=0, max_iter=20).fit(m).labels_ for name, m in results.items()}
+    print('subspace cosine (min): {:.4f}'.format(cosines.min()))
+    print('ARI sketched vs TruncatedSVD: {:.4f}'.format(adjusted_rand_score(labels['TruncatedSVD'], labels['SketchedSVD'])))
+    for name in results:
+        print('ARI {} vs groups: {:.4f}'.format(name, adjusted_rand_score(groups, labels[name])))
+
+
+if __name__ == '__main__':
+    main()
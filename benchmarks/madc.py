@@ -0,0 +1,80 @@
+'''Time and peak memory of the MADC matrix, dense and in blocks of rows
+
+The dense computation (the former grouprox implementation) is only run up
+to --dense_max clients, and the blocked matrix is checked to be exactly
+equal to it. Run from the repository root:
+
+    python -m benchmarks.madc --num_clients 100 200 400 1000 --budget 64
+
+With --check, only the regression check runs: data_driven_measure() must
+equal dense_measure() for uneven blocks, 0 and 2 workers, float32 and
+float64 and both corrections, a mismatch raises an AssertionError:
+
+    python -m benchmarks.madc --check
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from flearn.utils.madc import dense_measure, data_driven_measure
+
+
+def run(measure, *args, **kwargs):
+    '''Returns the result, the seconds and the peak traced bytes of measure()'''
+    tracemalloc.start()
+    start = time.time()
+    result = measure(*args, **kwargs)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check():
+    '''Asserts that the blocked matrix equals the dense one'''
+    rng = np.random.RandomState(0)
+    n_clients = 37 # Rows of the blocks below do not divide n_clients
+    for dtype in (np.float32, np.float64):
+        square = cosine_similarity(rng.randn(n_clients, 50).astype(dtype)).astype(dtype) # As MADC
+        edc = rng.uniform(-1, 1, (n_clients, 5)).astype(dtype) # As EDC, without correction only
+        for pm, correction in ((square, False), (square, True), (edc, False)):
+            dense = np.asarray(dense_measure(pm, correction))
+            for rows in (1, 5, 8, n_clients):
+                budget = rows * n_clients * pm.shape[1] * pm.itemsize
+                for num_workers in (0, 2):
+                    dm = data_driven_measure(pm, correction, budget=budget, num_workers=num_workers)
+                    assert dm.dtype == dense.dtype and np.array_equal(dm, dense), \
+                        'dtype={} correction={} rows={} num_workers={}'.format(dtype.__name__, correction, rows, num_workers)
+    print('data_driven_measure equals dense_measure')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_clients', type=int, nargs='+', default=[100, 200, 400, 1000])
+    parser.add_argument('--num_params', type=int, default=7850)
+    parser.add_argument('--budget', help='MB of a block;', type=float, default=256)
+    parser.add_argument('--num_workers', type=int, default=0)
+    parser.add_argument('--dense_max', help='largest number of clients of the dense computation;', type=int, default=400)
+    parser.add_argument('--check', help='only run the regression check against the dense computation;', action='store_true')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return
+
+    rng = np.random.RandomState(0)
+    for n in args.num_clients:
+        delta_w = rng.randn(n, args.num_params).astype(np.float32)
+        pm = cosine_similarity(delta_w)
+        dm, elapsed, peak = run(data_driven_measure, pm, True, budget=int(args.budget * 2**20), num_workers=args.num_workers)
+        print('{:>7} clients   blocked: {:8.2f} s, peak {:10.1f} MB'.format(n, elapsed, peak / 2**20))
+        if n <= args.dense_max:
+            dense, elapsed, peak = run(dense_measure, pm, True)
+            print('{:>7} clients     dense: {:8.2f} s, peak {:10.1f} MB, equal: {}'.format(
+                n, elapsed, peak / 2**20, np.array_equal(np.asarray(dense), dm)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''Time and peak memory of the in-place minibatch generators and of Batcher
+
+Only the minibatches are drawn, no model is trained. Run from the
+repository root:
+
+    python -m benchmarks.minibatch --num_samples 20000 --batch_size 32
+'''
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from flearn.utils.model_utils import batch_data, batch_data_multiple_iters, Batcher
+
+
+def run(generator, data, *args):
+    '''Returns the seconds and the peak traced bytes of one pass over generator'''
+    tracemalloc.start()
+    start = time.time()
+    for X, y in generator(data, *args):
+        pass
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_samples', type=int, default=20000)
+    parser.add_argument('--num_features', type=int, default=60)
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_epochs', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    data = {'x': rng.randn(args.num_samples, args.num_features).astype(np.float32),
+        'y': rng.randint(10, size=args.num_samples)}
+    num_iters = args.num_epochs * int(np.ceil(args.num_samples / args.batch_size))
+    batcher = Batcher(0)
+    cases = [('batch_data', batch_data, batcher.batch_data, (args.batch_size,)),
+        ('batch_data_multiple_iters', batch_data_multiple_iters, batcher.batch_data_multiple_iters,
+            (args.batch_size, num_iters))]
+    for name, inplace, buffered, gen_args in cases:
+        for label, generator in [('inplace', inplace), ('buffered', buffered)]:
+            run(generator, data, *gen_args) # Warm up, Batcher allocates its buffers once
+            elapsed, peak = run(generator, data, *gen_args)
+            print('{:>26} {:>8}: {:8.1f} ms, peak {:8.1f} KB'.format(name, label, elapsed * 1000, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
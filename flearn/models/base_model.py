@@ -0,0 +1,199 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+tf.disable_v2_behavior()
+
+from flearn.optimizer.pgd import PerturbedGradientDescent
+from flearn.utils.model_utils import epoch_orders, shuffle_data
+from flearn.utils.param_vector import ParamVector, as_param_vector
+
+
+class BaseModel(object):
+    '''Parameter I/O shared by all models
+
+    Subclasses call build_param_ops() inside their graph right after
+    create_model(). Loading or reading the whole model is then a single
+    sess.run instead of one call per trainable variable, and parameters
+    travel as one flat ParamVector.
+
+    Models that build their loss in create_loss(features, labels) can also
+    run all epochs of solve_inner() in one sess.run, see build_epoch_loop(),
+    and score several models on the same data in one sess.run, see
+    build_heads().
+
+    Minibatches come from batches(), from the Python generators, and
+    train_batches() trains on them. Models whose raw data needs
+    preprocessing override prepare(), applied once when a client loads its
+    data (e.g. tokenization), or preprocess(), applied to every batch (e.g.
+    image decoding).
+    '''
+
+    epoch_train_op = None # Built by build_epoch_loop()
+    batcher = None # Batcher of the client being trained, None for the in-place generators
+    vstar_assign_op = None # Loads params_ph into the vstar slots of PGD, built by PerturbedGradientDescent.set_params()
+
+    def build_param_ops(self):
+        '''Builds the flat parameter placeholder, the grouped assign op
+        and the flat fetch op, must be called inside self.graph
+        '''
+        self.trainable_vars = tf.trainable_variables()
+        self.param_shapes = [v.shape.as_list() for v in self.trainable_vars]
+        self.param_sizes = [int(np.prod(shape)) for shape in self.param_shapes]
+        self.params_ph = tf.placeholder(tf.float32, shape=[sum(self.param_sizes)], name='flat_params')
+        flat_values = tf.split(self.params_ph, self.param_sizes)
+        # The values fed through params_ph, also assigned to the vstar slots of PGD
+        self.param_values = [tf.reshape(value, shape) for value, shape in zip(flat_values, self.param_shapes)]
+        self.assign_params_op = tf.group(*[tf.assign(v, value) for v, value in zip(self.trainable_vars, self.param_values)])
+        self.flat_params_op = tf.concat([tf.reshape(v, [-1]) for v in self.trainable_vars], axis=0)
+
+    def set_params(self, model_params=None):
+        if model_params is not None:
+            flat_params = as_param_vector(model_params).flat
+            self.sess.run(self.assign_params_op, feed_dict={self.params_ph: flat_params})
+
+    def get_params(self):
+        model_params = ParamVector(self.sess.run(self.flat_params_op), self.param_shapes)
+        return model_params
+
+    def prepare(self, X, y):
+        '''Turns the raw data of a client into the arrays the model trains on'''
+        return X, y
+
+    def preprocess(self, X, y):
+        '''Turns a batch of prepared data into the arrays fed to the model'''
+        return X, y
+
+    def batches(self, generator, data, *args):
+        '''Yields the preprocessed batches of generator(data, *args), e.g.
+        batches(batch_data, data, batch_size)
+        '''
+        if self.batcher is not None:
+            # Same method names as the module generators
+            generator = getattr(self.batcher, generator.__name__)
+        return (self.preprocess(X, y) for X, y in generator(data, *args))
+
+    def train_batches(self, generator, data, *args):
+        '''Runs train_op on every batch of generator(data, *args)'''
+        for X, y in self.batches(generator, data, *args):
+            with self.graph.as_default():
+                self.sess.run(self.train_op, feed_dict={self.features: X, self.labels: y})
+
+    def preprocess_data(self, data):
+        '''Preprocesses all of data, e.g. for test()'''
+        return self.preprocess(data['x'], data['y'])
+
+    def build_heads(self, num_heads):
+        '''Builds the losses of num_heads models on the features and labels
+        of this model, so that test_heads() scores them all in one sess.run
+        (e.g. the group models of IFCA on a client's data)
+
+        The heads are non-trainable copies of the trainable variables, one
+        row per head, and their losses are create_loss() with exactly the
+        ops of self.loss. Variables that create_loss() makes non-trainable
+        (e.g. batch norm statistics) are created again for each head.
+        '''
+        if not hasattr(self, 'create_loss'):
+            raise ValueError('{} builds its loss only in create_model(), the heads need '
+                'create_loss()'.format(type(self).__module__))
+        with self.graph.as_default():
+            created = set(v.name for v in tf.global_variables())
+            self.heads_vars = [tf.Variable(tf.zeros([num_heads] + shape), trainable=False, name='heads')
+                for shape in self.param_shapes]
+            losses = []
+            for k in range(num_heads):
+                next_value = iter([v[k] for v in self.heads_vars]).__next__
+                def head_getter(getter, *args, next_value=next_value, **kwargs):
+                    if kwargs.get('trainable', True) == False:
+                        return getter(*args, **kwargs)
+                    return next_value()
+                with tf.variable_scope('head_{}'.format(k), custom_getter=head_getter):
+                    _, loss = self.create_loss(self.features, self.labels)
+                losses.append(loss)
+            self.heads_losses = tf.stack(losses)
+            # Assign the flat parameters of one head
+            self.head_ph = tf.placeholder(tf.float32, shape=[sum(self.param_sizes)], name='flat_head')
+            self.head_index = tf.placeholder(tf.int32, shape=[], name='head_index')
+            head_values = tf.split(self.head_ph, self.param_sizes)
+            self.assign_head_op = tf.group(*[tf.scatter_update(v, [self.head_index], tf.reshape(value, [1] + shape))
+                for v, value, shape in zip(self.heads_vars, head_values, self.param_shapes)])
+            self.sess.run(tf.variables_initializer([v for v in tf.global_variables() if v.name not in created]))
+
+    def set_row(self, k, model):
+        '''Sets the model (ParamVector or list of arrays) of the k-th head'''
+        self.sess.run(self.assign_head_op, feed_dict={self.head_ph: as_param_vector(model).flat, self.head_index: k})
+
+    def test_heads(self, data):
+        '''Returns the loss of every head on data, same as test() with the
+        model of each head
+        '''
+        X, y = self.preprocess_data(data)
+        return np.array(self.sess.run(self.heads_losses, feed_dict={self.features: X, self.labels: y}))
+
+    def build_epoch_loop(self, optimizer):
+        '''Builds self.epoch_train_op, a tf.while_loop over all minibatches
+        of all epochs of a client, so solve_inner() makes one sess.run
+        instead of one per minibatch.
+
+        The client's data is fed once, with the rows of every minibatch in
+        the order of batch_data(). The loop body rebuilds the loss of the
+        model with create_loss() on loop variables instead of the trainable
+        variables, steps them with optimizer (gradient descent or PGD) and
+        the result is assigned back after the loop. Call it after the FLOPs
+        of the model were profiled, the FLOP accounting stays per-minibatch.
+        '''
+        if not hasattr(self, 'create_loss'):
+            raise ValueError('{} builds its loss only in create_model(), the in-graph training loop needs '
+                'create_loss()'.format(type(self).__module__))
+        if not isinstance(optimizer, (PerturbedGradientDescent, tf.train.GradientDescentOptimizer)):
+            raise ValueError('The in-graph training loop only supports gradient descent and PGD')
+
+        with self.graph.as_default():
+            self.epoch_x = tf.placeholder(self.features.dtype, shape=self.features.shape, name='epoch_x')
+            self.epoch_y = tf.placeholder(self.labels.dtype, shape=self.labels.shape, name='epoch_y')
+            self.epoch_rows = tf.placeholder(tf.int32, shape=[None], name='epoch_rows') # Rows of all minibatches
+            self.epoch_bounds = tf.placeholder(tf.int32, shape=[None], name='epoch_bounds') # Minibatch i is rows[bounds[i]:bounds[i+1]]
+
+            def body(step, values):
+                rows = self.epoch_rows[self.epoch_bounds[step]:self.epoch_bounds[step+1]]
+                # create_loss() gets the loop variables in place of the trainable variables
+                next_value = iter(values).__next__
+                def loop_getter(getter, *args, **kwargs):
+                    if kwargs.get('trainable', True) == False:
+                        raise ValueError('{} creates non-trainable variables in create_loss() (e.g. batch norm '
+                            'statistics), they can not be created in the in-graph training loop'.format(type(self).__module__))
+                    return next_value()
+                with tf.variable_scope('epoch_loop', custom_getter=loop_getter):
+                    _, loss = self.create_loss(tf.gather(self.epoch_x, rows), tf.gather(self.epoch_y, rows))
+                grads = tf.gradients(loss, values)
+                new_values = []
+                for grad, var, value in zip(grads, self.trainable_vars, values):
+                    if isinstance(grad, tf.IndexedSlices):
+                        # A trainable embedding: gradient descent adds the same
+                        # rows densely, PGD's sparse update also rewrites vstar
+                        if isinstance(optimizer, PerturbedGradientDescent):
+                            raise ValueError('{} has a sparse gradient (embedding), the in-graph training loop '
+                                'can not reproduce the sparse update of PGD'.format(type(self).__module__))
+                        grad = tf.convert_to_tensor(grad)
+                    if isinstance(optimizer, PerturbedGradientDescent):
+                        new_values.append(optimizer.step_value(grad, var, value))
+                    else:
+                        new_values.append(value - optimizer._learning_rate*grad)
+                return step+1, new_values
+
+            num_steps = tf.size(self.epoch_bounds) - 1
+            _, values = tf.while_loop(lambda step, values: step < num_steps, body,
+                [tf.constant(0), [v.read_value() for v in self.trainable_vars]])
+            self.epoch_train_op = tf.group(*[tf.assign(v, value) for v, value in zip(self.trainable_vars, values)])
+
+    def run_epoch_loop(self, data, num_epochs, batch_size):
+        '''Trains num_epochs on data with epoch_train_op, and shuffles data in
+        place like batch_data() would'''
+        num_samples = len(data['y'])
+        orders = epoch_orders(num_samples, num_epochs)
+        rows = np.concatenate(orders) if num_epochs > 0 else np.zeros(0, dtype=np.int32)
+        bounds = [e*num_samples + i for e in range(num_epochs) for i in range(0, num_samples, batch_size)]
+        bounds.append(num_epochs*num_samples)
+        with self.graph.as_default():
+            self.sess.run(self.epoch_train_op, feed_dict={self.epoch_x: data['x'], self.epoch_y: data['y'],
+                self.epoch_rows: rows, self.epoch_bounds: bounds})
+        for _ in range(num_epochs):
+            shuffle_data(data)
@@ -0,0 +1,190 @@
+import numpy as np
+import tensorflow.compat.v1 as tf
+tf.disable_v2_behavior()
+
+from flearn.utils.client_data import DATA_CACHE
+from flearn.utils.model_utils import epoch_orders, shuffle_order
+from flearn.utils.param_vector import ParamVector, as_param_vector
+
+
+def masked_mean(values, mask):
+    '''Mean of values, shape=(num_clients, batch_size), over the rows where mask is 1'''
+    return tf.reduce_sum(values * mask, axis=1) / tf.maximum(tf.reduce_sum(mask, axis=1), 1.)
+
+
+class BaseBatchedModel(object):
+    '''Trains up to num_clients clients of a linear model in one graph
+
+    Every trainable variable has a leading client dimension, the slice k is
+    the model of the k-th client of a batch. The minibatches of all clients
+    are padded to batch_size and stacked, shape=(num_clients, batch_size,
+    ...), and the losses of all clients are batched matmuls averaged over the
+    rows of self.mask (the padding is 0). One sess.run then makes a gradient
+    step for all clients, clients without a minibatch left are masked out of
+    the update.
+
+    The minibatches follow the fixed-seed shuffles of batch_data(), and the
+    clients' train_data and the global numpy RNG end in the same state as
+    after sequential Client.solve_inner() calls. The batched ops sum in
+    another order, so the solutions are not bit-identical to the sequential
+    ones: they differ by less than 1e-4, the tolerance asserted by
+    benchmarks/batched.py --check (5.96e-08 measured on synthetic mclr).
+
+    Subclasses set self.param_shapes (shapes of the sequential Model's
+    trainable variables) before calling BaseBatchedModel.__init__(), and
+    define
+        create_batched_model(params, mask): the (features, labels, losses) of
+            all clients, the stacked minibatch placeholders, shape=(num_clients,
+            None, ...), and the loss of each client, shape=(num_clients,)
+        create_client_model(params): the (features, labels, loss) of one
+            client, params are the slices of self.params that hold its model
+        create_client_loss(params, features, labels): the loss of one client
+            on the given placeholders
+
+    With shared_input, the num_clients models are heads evaluated on the
+    same features/labels (e.g. the group models of IFCA on one client's
+    data) with exactly the ops of the sequential Model, see test_heads();
+    no train op is built.
+    '''
+
+    def __init__(self, num_clients, prox, learning_rate, mu, seed=1, shared_input=False):
+        self.num_clients = num_clients
+        self.param_sizes = [int(np.prod(shape)) for shape in self.param_shapes]
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.set_random_seed(123+seed)
+            self.params = [tf.Variable(tf.zeros([num_clients] + shape)) for shape in self.param_shapes]
+            self.vstar = [tf.Variable(tf.zeros_like(v), trainable=False) for v in self.params] if prox else None
+            if shared_input:
+                params = [[v[k] for v in self.params] for k in range(num_clients)]
+                features, labels, loss = self.create_client_model(params[0])
+                self.features, self.labels = [features], [labels]
+                self.losses = [loss] + [self.create_client_loss(p, features, labels) for p in params[1:]]
+                self.train_op = None
+            else:
+                self.mask = tf.placeholder(tf.float32, shape=[num_clients, None], name='mask')
+                self.features, self.labels, losses = self.create_batched_model(self.params, self.mask)
+                self.train_op = self.create_train_op(losses, learning_rate, mu)
+            self.build_param_ops()
+        self.sess = tf.Session(graph=self.graph)
+        with self.graph.as_default():
+            self.sess.run(tf.global_variables_initializer())
+
+    def create_train_op(self, losses, learning_rate, mu):
+        '''Gradient descent (or FedProx's PGD if self.vstar) on the clients
+        with a minibatch, the losses of the clients are independent so the
+        gradient of their sum holds the gradient of each client
+        '''
+        grads = tf.gradients(tf.reduce_sum(losses), self.params)
+        active = tf.reduce_sum(self.mask, axis=1) > 0
+        updates = []
+        for grad, var, vstar in zip(grads, self.params, self.vstar or [None] * len(self.params)):
+            delta = learning_rate * grad
+            if vstar is not None:
+                delta = learning_rate * (grad + mu * (var - vstar))
+            updates.append(tf.assign_sub(var, tf.where(active, delta, tf.zeros_like(delta))))
+        return tf.group(*updates)
+
+    def build_param_ops(self):
+        '''One row of flat parameters per client, see BaseModel.build_param_ops()'''
+        self.params_ph = tf.placeholder(tf.float32, shape=[self.num_clients, sum(self.param_sizes)], name='flat_params')
+        flat_values = tf.split(self.params_ph, self.param_sizes, axis=1)
+        values = [tf.reshape(value, [self.num_clients] + shape) for value, shape in zip(flat_values, self.param_shapes)]
+        assigns = [tf.assign(v, value) for v, value in zip(self.params, values)]
+        if self.vstar is not None:
+            assigns += [tf.assign(v, value) for v, value in zip(self.vstar, values)]
+        self.assign_params_op = tf.group(*assigns)
+        # Assign the flat parameters of one client (row)
+        self.row_ph = tf.placeholder(tf.float32, shape=[sum(self.param_sizes)], name='flat_row')
+        self.row_index = tf.placeholder(tf.int32, shape=[], name='row_index')
+        row_values = tf.split(self.row_ph, self.param_sizes)
+        self.assign_row_op = tf.group(*[tf.scatter_update(v, [self.row_index], tf.reshape(value, [1] + shape))
+            for v, value, shape in zip(self.params, row_values, self.param_shapes)])
+        self.flat_params_op = tf.concat([tf.reshape(v, [self.num_clients, -1]) for v in self.params], axis=1)
+
+    def set_row(self, k, model):
+        '''Sets the model (ParamVector or list of arrays) of the k-th client'''
+        self.sess.run(self.assign_row_op, feed_dict={self.row_ph: as_param_vector(model).flat, self.row_index: k})
+
+    def test_heads(self, data):
+        '''Returns the loss of every model on data (shared_input only), same as
+        Model.test() of each model
+        '''
+        return np.array(self.sess.run(self.losses, feed_dict={self.features[0]: data['x'], self.labels[0]: data['y']}))
+
+    def solve_inner(self, datas, num_epochs, batch_size, model, row_orders=None):
+        '''Trains len(datas) <= num_clients clients from model
+
+        Args:
+            datas: list of train_data dicts, the minibatches are the rows of
+                the sequential batch_data() shuffles, datas are not modified
+            num_epochs: list of the number of epochs of each client
+            model: the start model (ParamVector), also the proximal center
+            row_orders: list of the rows of each data in the order training
+                starts from (None for the order of data), e.g. the order
+                before the shuffles of skip_inner()
+        Return:
+            list of solutions (ParamVector)
+        '''
+        self.sess.run(self.assign_params_op,
+            feed_dict={self.params_ph: np.tile(as_param_vector(model).flat, (self.num_clients, 1))})
+
+        # Minibatch schedule of each client, [rows, ...]
+        schedules = []
+        for data, epochs, rows in zip(datas, num_epochs, row_orders or [None] * len(datas)):
+            schedule = []
+            for order in epoch_orders(len(data['y']), epochs):
+                if rows is not None:
+                    order = rows[order]
+                schedule += [order[i:i+batch_size] for i in range(0, len(order), batch_size)]
+            schedules.append(schedule)
+
+        # The stacked minibatches, padded rows are 0 and masked out
+        x, y = np.asarray(datas[0]['x']), np.asarray(datas[0]['y'])
+        X = np.zeros((self.num_clients, batch_size) + x.shape[1:], dtype=x.dtype)
+        Y = np.zeros((self.num_clients, batch_size) + y.shape[1:], dtype=y.dtype)
+        mask = np.zeros((self.num_clients, batch_size), dtype=np.float32)
+        for step in range(max([len(s) for s in schedules])):
+            mask[:] = 0
+            for k, (data, schedule) in enumerate(zip(datas, schedules)):
+                if step < len(schedule):
+                    rows = schedule[step]
+                    X[k, :len(rows)] = data['x'][rows]
+                    Y[k, :len(rows)] = data['y'][rows]
+                    mask[k, :len(rows)] = 1
+            self.sess.run(self.train_op, feed_dict={self.features: X, self.labels: Y, self.mask: mask})
+
+        flat_params = self.sess.run(self.flat_params_op)
+        return [ParamVector(flat_params[k], self.param_shapes) for k in range(len(datas))]
+
+    def solve(self, clients, model, get_epochs, batch_size):
+        '''Trains clients from model, num_clients at a time
+
+        Yields:
+            (client, soln, stats) in the order of clients, same as Client.solve_inner()
+        '''
+        for i in range(0, len(clients), self.num_clients):
+            batch = clients[i:i+self.num_clients]
+            datas, num_epochs, row_orders = [], [], []
+            for c in batch:
+                # Same order of get_epochs() and shuffles as the sequential
+                # training, get_epochs() may draw from the global RNG that
+                # the shuffles reseed
+                data = c.train_data
+                resident = c.train_key in DATA_CACHE
+                num_epochs.append(get_epochs(c))
+                c.skip_inner(num_epochs[-1]) # Shuffle train_data as solve_inner() does
+                rows = None
+                if resident and num_epochs[-1] > 0:
+                    # data was shuffled in place, train from its rows in the former order
+                    rows = np.argsort(shuffle_order(c.num_samples, num_epochs[-1]))
+                datas.append(data)
+                row_orders.append(rows)
+            solns = self.solve_inner(datas, num_epochs, batch_size, model, row_orders)
+            for c, epochs, soln in zip(batch, num_epochs, solns):
+                comp = epochs * (c.num_samples//batch_size) * batch_size * c.model.flops
+                yield c, (c.num_samples, soln), (c.model.size, comp, c.model.size)
+
+    def close(self):
+        self.sess.close()
@@ -5,14 +5,16 @@ tf.disable_v2_behavior()
 from tqdm import trange
 
 
-from flearn.utils.tf_utils import graph_size, process_grad
+from flearn.models.base_model import BaseModel
+from flearn.utils.tf_utils import graph_size, process_grad, graph_flops
 from flearn.utils.model_utils import process_x, process_y
+from flearn.utils.image_cache import load_image_cache
 
 IMAGE_SIZE = 84
 IMAGES_DIR = os.path.join('..', 'data', 'celeba', 'data', 'raw', 'img_align_celeba')
 
 
-class Model(object):
+class Model(BaseModel):
     def __init__(self, num_classes, q, optimizer, seed=1):
         # params
         self.num_classes = num_classes
@@ -23,6 +25,7 @@ class Model(object):
             tf.set_random_seed(123 + seed)
             self.features, self.labels, self.output2, self.train_op, self.grads, self.kl_grads, self.eval_metric_ops, \
                 self.loss, self.kl_loss, self.soft_max, self.predictions = self.create_model(q, optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
 
         config = tf.ConfigProto()
@@ -33,21 +36,12 @@ class Model(object):
         self.size = graph_size(self.graph)
         with self.graph.as_default():
             self.sess.run(tf.global_variables_initializer())
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.flops = graph_flops(self.graph, __name__)
 
     def create_model(self, q, optimizer):
         input_ph = tf.placeholder(tf.float32, shape=(None, IMAGE_SIZE, IMAGE_SIZE, 3))
         output2 = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='output2')
-        out = input_ph
-        for _ in range(4):
-            out = tf.layers.conv2d(out, 32, 3, padding='same')
-            out = tf.layers.batch_normalization(out, training=True)
-            out = tf.layers.max_pooling2d(out, 2, 2, padding='same')
-            out = tf.nn.relu(out)
-        out = tf.reshape(out, (-1, int(np.prod(out.get_shape()[1:]))))
-        logits = tf.layers.dense(out, self.num_classes)
+        logits = self.create_logits(input_ph)
         label_ph = tf.placeholder(tf.int64, shape=(None,))
         loss = tf.losses.sparse_softmax_cross_entropy(labels=label_ph, logits=logits)
         predictions = {
@@ -69,17 +63,32 @@ class Model(object):
 
 
 
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
+    def create_logits(self, features):
+        out = features
+        for _ in range(4):
+            out = tf.layers.conv2d(out, 32, 3, padding='same')
+            out = tf.layers.batch_normalization(out, training=True)
+            out = tf.layers.max_pooling2d(out, 2, 2, padding='same')
+            out = tf.nn.relu(out)
+        out = tf.reshape(out, (-1, int(np.prod(out.get_shape()[1:]))))
+        return tf.layers.dense(out, self.num_classes)
 
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+    def create_loss(self, features, labels):
+        logits = self.create_logits(features)
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+        return logits, loss
+
+    def prepare(self, X, y):
+        '''Image file names to rows of the image cache, if it has been built'''
+        image_cache = load_image_cache()
+        if image_cache is None:
+            return X, y
+        return image_cache.rows(X), y
+
+    def preprocess(self, X, y):
+        if np.issubdtype(X.dtype, np.integer):
+            return load_image_cache().images[X], process_y(y)
+        return process_x(X), process_y(y)
 
     def get_gradients(self, data):
 
@@ -90,18 +99,17 @@ class Model(object):
         return grads
 
     def get_kl_gradients(self, data, output2):
+        X, y = self.preprocess_data(data)
         with self.graph.as_default():
             kl_grads = self.sess.run(self.kl_grads,
-                                    feed_dict={self.features: process_x(data['x']),
-                                               self.labels: process_y(data['y']),
-                                               self.output2: output2})
+                                    feed_dict={self.features: X, self.labels: y, self.output2: output2})
 
         return kl_grads
 
     def get_softmax(self, data):
+        X, y = self.preprocess_data(data)
         with self.graph.as_default():
-            soft_max = self.sess.run(self.soft_max, feed_dict={self.features: process_x(data['x']),
-                                                               self.labels: process_y(data['y'])})
+            soft_max = self.sess.run(self.soft_max, feed_dict={self.features: X, self.labels: y})
         return soft_max
 
     def solve_sgd(self, mini_batch_data):
@@ -117,16 +125,16 @@ class Model(object):
         Args:
             data: dict of the form {'x': [list], 'y': [list]}
         '''
+        X, y = self.preprocess_data(data)
         with self.graph.as_default():
             tot_correct, loss = self.sess.run([self.eval_metric_ops, self.loss],
-                                              feed_dict={self.features: process_x(data['x']),
-                                                         self.labels: process_y(data['y'])})
+                                              feed_dict={self.features: X, self.labels: y})
         return tot_correct, loss
 
     def get_loss(self, data):
+        X, y = self.preprocess_data(data)
         with self.graph.as_default():
-            loss = self.sess.run(self.loss, feed_dict={self.features: process_x(data['x']),
-                                                       self.labels: process_y(data['y'])})
+            loss = self.sess.run(self.loss, feed_dict={self.features: X, self.labels: y})
         return loss
 
     def close(self):
@@ -1,23 +1,62 @@
 import numpy as np
 
+from flearn.utils.model_utils import shuffle_data, shuffle_order, Batcher
+from flearn.utils.client_data import DATA_CACHE
+
 class Client(object):
     
-    def __init__(self, id, group=None, train_data={'x':[],'y':[]}, eval_data={'x':[],'y':[]}, model=None):
+    def __init__(self, id, group=None, train_data={'x':[],'y':[]}, eval_data={'x':[],'y':[]}, model=None, batch_seed=None,
+            initial_params=None):
         self.model = model
         
         # The local model params and updates of this client,
         # local_model and local_update only can be fresh by train() function of Group, pre-train will no change it
-        self.local_model = model.get_params() # Init, the local model and local update will change during training
-        self.local_update = model.get_params()
+        # Both are flat ParamVector instances, they are replaced and never modified in place:
+        # until the client is trained, both are initial_params, a read-only ParamVector
+        # shared by all clients (or the params of model if not given)
+        if initial_params is None:
+            initial_params = model.get_params()
+        self.local_model = initial_params # Init, the local model and local update will change during training
+        self.local_update = initial_params
 
         self.id = id # string
         self.group = group # Group() instant
-        self.train_data = {k: np.array(v) for k, v in train_data.items()}
-        self.eval_data = {k: np.array(v) for k, v in eval_data.items()}
-        self.num_samples = len(self.train_data['y'])
-        self.test_samples = len(self.eval_data['y'])
+        # Handles to the data, the arrays are loaded on first use into DATA_CACHE
+        self.train_source, self.eval_source = train_data, eval_data
+        self.train_key, self.eval_key = DATA_CACHE.new_key(), DATA_CACHE.new_key()
+        self.num_samples = len(train_data['y'])
+        self.test_samples = len(eval_data['y'])
         self.difference = [] # tuple of (group, diff)
         self.clustering = False # Is the client join the clustering proceudre.(FedGroup only)
+        self.data_version = 0 # Number of in-place shuffles applied to train_data by solve_inner()
+        # With a batch_seed, the minibatches are drawn by a Batcher of this client,
+        # train_data is never shuffled and data_version counts the Batcher's draws
+        self.batcher = Batcher(batch_seed) if batch_seed is not None else None
+
+    @property
+    def train_data(self):
+        '''dict of numpy arrays, in the order of data_version shuffles'''
+        return DATA_CACHE.get(self.train_key, self._load_train_data)
+
+    @property
+    def eval_data(self):
+        return DATA_CACHE.get(self.eval_key, lambda: self._prepare(self.eval_source))
+
+    def _prepare(self, source):
+        x, y = self.model.prepare(np.array(source['x']), np.array(source['y']))
+        return {'x': x, 'y': y}
+
+    def _load_train_data(self):
+        data = self._prepare(self.train_source)
+        if self.data_version > 0 and self.batcher is None:
+            # Replay the shuffles applied before the data was evicted
+            order = shuffle_order(self.num_samples, self.data_version)
+            data = {k: v[order] for k, v in data.items()}
+        return data
+
+    def __del__(self):
+        DATA_CACHE.discard(self.train_key)
+        DATA_CACHE.discard(self.eval_key)
 
     def set_params(self, model_params):
         '''set model parameters'''
@@ -61,10 +100,31 @@ class Client(object):
         '''
 
         bytes_w = self.model.size
+        self.model.batcher = self.batcher
         soln, comp = self.model.solve_inner(self.train_data, num_epochs, batch_size)
+        self.model.batcher = None
         bytes_r = self.model.size
+        self.data_version += num_epochs # Each epoch shuffles train_data once (or draws once)
         return (self.num_samples, soln), (bytes_w, comp, bytes_r)
 
+    def skip_inner(self, num_epochs=1):
+        '''Replays the data shuffles of solve_inner() without training
+
+        Keeps this copy of train_data (and the global numpy RNG) in step
+        with a copy that is trained in a worker process.
+        '''
+        if self.batcher is not None:
+            self.batcher.skip(num_epochs, self.num_samples)
+        elif self.train_key in DATA_CACHE:
+            for _ in range(num_epochs):
+                shuffle_data(self.train_data)
+        elif num_epochs > 0:
+            # The data is not resident, it is shuffled when loaded again, only
+            # leave the global RNG as shuffle_data() would (it depends on
+            # the number of samples only)
+            shuffle_data({'x': np.arange(self.num_samples), 'y': np.arange(self.num_samples)})
+        self.data_version += num_epochs
+
     def solve_iters(self, num_iters=1, batch_size=10):
         '''Solves local optimization problem
 
@@ -77,8 +137,12 @@ class Client(object):
         '''
 
         bytes_w = self.model.size
+        self.model.batcher = self.batcher
         soln, comp = self.model.solve_iters(self.train_data, num_iters, batch_size)
+        self.model.batcher = None
         bytes_r = self.model.size
+        if self.batcher is not None:
+            self.data_version = self.batcher.draws
         return (self.num_samples, soln), (bytes_w, comp, bytes_r)
 
     def train_error_and_loss(self):
@@ -3,12 +3,13 @@ import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 from tqdm import trange
 
+from flearn.models.base_model import BaseModel
 from flearn.utils.model_utils import batch_data, batch_data_multiple_iters
-from flearn.utils.tf_utils import graph_size
+from flearn.utils.tf_utils import graph_size, graph_flops
 from flearn.utils.tf_utils import process_grad
 
 
-class Model(object):
+class Model(BaseModel):
     def __init__(self, num_classes, optimizer, seed=1):
         # params
         self.num_classes = num_classes
@@ -18,6 +19,7 @@ class Model(object):
         with self.graph.as_default():
             tf.set_random_seed(123 + seed)
             self.features, self.labels, self.train_op, self.grads, self.eval_metric_ops, self.loss = self.create_model(optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
 
         config = tf.ConfigProto()
@@ -28,15 +30,31 @@ class Model(object):
         self.size = graph_size(self.graph)
         with self.graph.as_default():
             self.sess.run(tf.global_variables_initializer())
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.flops = graph_flops(self.graph, __name__)
 
     def create_model(self, optimizer):
         """Model function for CNN."""
         features = tf.placeholder(tf.float32, shape=[None, 784], name='features')
         labels = tf.placeholder(tf.int64, shape=[None, ], name='labels')
         output2 = tf.placeholder(tf.float32, shape=[None, self.num_classes], name='output2')
+        logits, loss = self.create_loss(features, labels)
+        predictions = {
+          "classes": tf.argmax(input=logits, axis=1),
+          "probabilities": tf.nn.softmax(logits, name="softmax_tensor")
+        }
+        grads_and_vars = optimizer.compute_gradients(loss)
+        grads, _ = zip(*grads_and_vars)
+        train_op = optimizer.apply_gradients(grads_and_vars, global_step=tf.train.get_global_step())
+        eval_metric_ops = tf.count_nonzero(tf.equal(labels, predictions["classes"]))
+
+
+        kl_loss = tf.keras.losses.KLD(predictions['probabilities'], output2) + tf.keras.losses.KLD(output2, predictions['probabilities'])
+        kl_grads_and_vars = optimizer.compute_gradients(kl_loss)
+        kl_grads, _ = zip(*kl_grads_and_vars)
+
+        return features, labels, train_op, grads, eval_metric_ops, loss
+
+    def create_loss(self, features, labels):
         input_layer = tf.reshape(features, [-1, 28, 28, 1])
         conv1 = tf.layers.conv2d(
           inputs=input_layer,
@@ -56,34 +74,8 @@ class Model(object):
         dense = tf.layers.dense(inputs=pool2_flat, units=1024, activation=tf.nn.relu)
 
         logits = tf.layers.dense(inputs=dense, units=self.num_classes)
-        predictions = {
-          "classes": tf.argmax(input=logits, axis=1),
-          "probabilities": tf.nn.softmax(logits, name="softmax_tensor")
-        }
         loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
-        grads_and_vars = optimizer.compute_gradients(loss)
-        grads, _ = zip(*grads_and_vars)
-        train_op = optimizer.apply_gradients(grads_and_vars, global_step=tf.train.get_global_step())
-        eval_metric_ops = tf.count_nonzero(tf.equal(labels, predictions["classes"]))
-
-
-        kl_loss = tf.keras.losses.KLD(predictions['probabilities'], output2) + tf.keras.losses.KLD(output2, predictions['probabilities'])
-        kl_grads_and_vars = optimizer.compute_gradients(kl_loss)
-        kl_grads, _ = zip(*kl_grads_and_vars)
-
-        return features, labels, train_op, grads, eval_metric_ops, loss
-
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
-
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+        return logits, loss
 
     def get_gradients(self, data, model_len):
 
@@ -99,11 +91,11 @@ class Model(object):
     
     def solve_inner(self, data, num_epochs=1, batch_size=32):
         '''Solves local optimization problem'''
-        for _ in trange(num_epochs, desc='Epoch: ', leave=False, ncols=120):
-            for X, y in batch_data(data, batch_size):
-                with self.graph.as_default():
-                    self.sess.run(self.train_op,
-                        feed_dict={self.features: X, self.labels: y})
+        if self.epoch_train_op is not None:
+            self.run_epoch_loop(data, num_epochs, batch_size)
+        else:
+            for _ in trange(num_epochs, desc='Epoch: ', leave=False, ncols=120):
+                self.train_batches(batch_data, data, batch_size)
         soln = self.get_params()
         comp = num_epochs * (len(data['y'])//batch_size) * batch_size * self.flops
         return soln, comp
@@ -111,9 +103,7 @@ class Model(object):
     def solve_iters(self, data, num_iters=1, batch_size=32):
         '''Solves local optimization problem'''
 
-        for X, y in batch_data_multiple_iters(data, batch_size, num_iters):
-            with self.graph.as_default():
-                self.sess.run(self.train_op, feed_dict={self.features: X, self.labels: y})
+        self.train_batches(batch_data_multiple_iters, data, batch_size, num_iters)
         soln = self.get_params()
         comp = 0
         return soln, comp
@@ -5,10 +5,12 @@ from collections import OrderedDict
 from flearn.models.client import Client
 from flearn.optimizer.pgd import PerturbedGradientDescent
 from flearn.utils.tf_utils import process_grad, process_sparse_grad
+from flearn.utils.aggregator import Aggregator, weighted_average
+from flearn.utils.client_pool import solve_clients
 import random
 
 class Group(object):
-    def __init__(self, gid, model=None):
+    def __init__(self, gid, model=None, agg_precision='float64', client_pool=None):
         self.client_model = model
         self.latest_model = model.get_params()
         self.latest_update = model.get_params()
@@ -22,6 +24,8 @@ class Group(object):
         self.max_clients = 1e4 # Init to a large number
         self.min_clients = 0
         self.latest_diff = 0.0 # Latest discrepancy
+        self.agg_precision = agg_precision # Accumulator of Aggregator, 'float64' or 'kahan'
+        self.client_pool = client_pool # Train clients in worker processes if not None
 
         #debug
         self.grads = None
@@ -75,14 +79,8 @@ class Group(object):
 
     """ Aggregate the models of this group """
     def aggregate(self, wsolns):
-        total_weight = 0.0
-        base = [0]*len(wsolns[0][1]) # wsolns ->[(n_k, soln), ...]
-        for (w, soln) in wsolns:  # w is the number of local samples
-            total_weight += w
-            for i, v in enumerate(soln): # for each w_i in w
-                base[i] += w*v.astype(np.float64)
-
-        averaged_soln = [v / total_weight for v in base]
+        # wsolns ->[(n_k, soln), ...], w is the number of local samples
+        averaged_soln = weighted_average(wsolns, self.agg_precision)
 
         return averaged_soln
 
@@ -115,36 +113,28 @@ class Group(object):
         # Actually ,the trainig procedure didn't refresh the training model
         start_model = self.client_model.get_params()
 
-        csolns = [] # buffer for receiving client solutions
+        # IFCA and FeSEM use model averaging, others use weighted averaging
+        # We implement model averaging version of IFCA
+        # TODO: gradient averaging version of IFCA
+        uniform = run_mode in ['IFCA', 'FeSEM']
+        aggregator = Aggregator(precision=self.agg_precision) # client solutions are folded as they arrive
         cupdates_dict = {} # dict buffer for send back clients' updates to server
         cmodels_dict = {} # dict buffer for send back clients' models to server
-        for c in self.clients.values():
-            # communicate the latest group model
-            c.set_params(self.latest_model)
-            soln, stats = c.solve_inner(num_epochs=self.num_epochs, batch_size=self.batch_size)
+        # communicate the latest group model, then train clients sequentially or in the client pool
+        for c, soln, stats in solve_clients(list(self.clients.values()), self.latest_model,
+                self.num_epochs, self.batch_size, self.client_pool):
             
             # fresh the local model and local update of client
             c.local_model = soln[1]
-            c.local_update = [w1-w0 for w0, w1 in zip(self.latest_model, soln[1])]
+            c.local_update = soln[1] - self.latest_model
 
-            csolns.append(soln) # ->[(self.num_samples, soln), ...]
+            aggregator.add(soln[1], 1.0 if uniform else soln[0]) # soln ->(self.num_samples, soln)
             cmodels_dict[c] = c.local_model # {Client:models}
             cupdates_dict[c] = c.local_update # {Client:updates}
 
-        if run_mode == 'FedGroup':
-            new_model = self.aggregate(csolns)
-        elif run_mode == 'IFCA':
-            # We implement model averaging version of IFCA
-            new_model = self.average_aggregate(csolns)
-            # TODO: gradient averaging version of IFCA
-            pass
-        elif run_mode == 'FeSEM':
-            new_model = self.average_aggregate(csolns)
-        else:
-            # Default use weighted averaging
-            new_model = self.aggregate(csolns)
+        new_model = aggregator.result()[0]
 
-        self.latest_update = [w1-w0 for w0, w1 in zip(self.latest_model, new_model)]
+        self.latest_update = new_model - self.latest_model
         self.latest_model = new_model
 
         self.client_model.set_params(start_model) # Recovery the training model
@@ -1,4 +1,4 @@
-import json
+import os
 import numpy as np
 from tqdm import trange
 
@@ -8,20 +8,18 @@ import tensorflow.compat.v1 as tf
 #tf.disable_v2_behavior()
 import tensorflow.compat.v1.nn.rnn_cell as rnn
 
+from flearn.models.base_model import BaseModel
 from flearn.utils.model_utils import batch_data, batch_data_multiple_iters
-from flearn.utils.language_utils import line_to_indices
-from flearn.utils.tf_utils import graph_size, process_grad
+from flearn.utils.language_utils import line_to_indices, load_word_embeddings
+from flearn.utils.tf_utils import graph_size, process_grad, graph_flops
 
-with open('flearn/models/sent140/embs.json', 'r') as inf:
-    embs = json.load(inf)
-id2word = embs['vocab']
-word2id = {v: k for k,v in enumerate(id2word)}
-word_emb = np.array(embs['emba'])
+EMBS_DIR = os.path.join('flearn', 'models', 'sent140') # embs.npy and embs_vocab.json, see get_embs.py
 
 def process_x(raw_x_batch, max_words=25):
+    word2id, _ = load_word_embeddings(EMBS_DIR)
     x_batch = [e[4] for e in raw_x_batch]
     x_batch = [line_to_indices(e, word2id, max_words) for e in x_batch]
-    x_batch = np.array(x_batch)
+    x_batch = np.array(x_batch, dtype=np.int32).reshape(-1, max_words)
     return x_batch
 
 def process_y(raw_y_batch):
@@ -30,36 +28,37 @@ def process_y(raw_y_batch):
 
     return y_batch
 
-class Model(object):
+class Model(BaseModel):
 
     def __init__(self, seq_len, num_classes, n_hidden, optimizer, seed):
         #params
         self.seq_len = seq_len
         self.num_classes = num_classes
         self.n_hidden = n_hidden
-        self.emb_arr = word_emb
+        _, self.emb_arr = load_word_embeddings(EMBS_DIR)
 
         # create computation graph
         self.graph = tf.Graph()
         with self.graph.as_default():
             tf.set_random_seed(123+seed)
             self.features, self.labels, self.train_op, self.grads, self.eval_metric_ops, self.loss = self.create_model(optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
         self.sess = tf.Session(graph=self.graph)
 
         # find memory footprint and compute cost of the model
         self.size = graph_size(self.graph)
         with self.graph.as_default():
-            self.sess.run(tf.global_variables_initializer())
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.sess.run(tf.global_variables_initializer(), feed_dict={self.emb_ph: self.emb_arr})
+            self.flops = graph_flops(self.graph, __name__)
     
     def create_model(self, optimizer):
         features = tf.placeholder(tf.int32, [None, self.seq_len], name='features')
         labels = tf.placeholder(tf.int64, [None,], name='labels')
 
-        embs = tf.Variable(self.emb_arr, dtype=tf.float32, trainable=False)
+        # The table is fed to the initializer, so that it is not a constant of the graph
+        self.emb_ph = tf.placeholder(tf.float32, self.emb_arr.shape, name='emb_arr')
+        embs = tf.Variable(self.emb_ph, trainable=False)
         x = tf.nn.embedding_lookup(embs, features)
         
         forward_cell1, backward_cell1  = rnn.BasicGRUCell(64), rnn.BasicGRUCell(64)
@@ -83,17 +82,8 @@ class Model(object):
         
         return features, labels, train_op, grads, eval_metric_ops, loss
 
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
-
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+    def prepare(self, X, y):
+        return process_x(X, self.seq_len), process_y(y)
 
     def get_gradients(self, data, model_len):
         
@@ -102,8 +92,7 @@ class Model(object):
         processed_samples = 0
 
         if num_samples < 50:
-            input_data = process_x(data['x'])
-            target_data = process_y(data['y'])
+            input_data, target_data = data['x'], data['y']
             with self.graph.as_default():
                 model_grads = self.sess.run(self.grads, 
                     feed_dict={self.features: input_data, self.labels: target_data})
@@ -112,8 +101,7 @@ class Model(object):
 
         else:  # calculate the grads in a batch size of 50
             for i in range(min(int(num_samples / 50), 4)):
-                input_data = process_x(data['x'][50*i:50*(i+1)])
-                target_data = process_y(data['y'][50*i:50*(i+1)])
+                input_data, target_data = data['x'][50*i:50*(i+1)], data['y'][50*i:50*(i+1)]
                 with self.graph.as_default():
                     model_grads = self.sess.run(self.grads,
                     feed_dict={self.features: input_data, self.labels: target_data})
@@ -137,9 +125,7 @@ class Model(object):
         '''
         
         for _ in trange(num_epochs, desc='Epoch: ', leave=False):
-            for X,y in batch_data(data, batch_size):
-                input_data = process_x(X, self.seq_len)
-                target_data = process_y(y)
+            for input_data, target_data in self.batches(batch_data, data, batch_size):
                 with self.graph.as_default():
                     self.sess.run(self.train_op,
                         feed_dict={self.features: input_data, self.labels: target_data})
@@ -150,9 +136,7 @@ class Model(object):
     def solve_iters(self, data, num_iters=1, batch_size=32):
         '''Solves local optimization problem'''
 
-        for X, y in batch_data_multiple_iters(data, batch_size, num_iters):
-            input_data = process_x(X, self.seq_len)
-            target_data = process_y(y)
+        for input_data, target_data in self.batches(batch_data_multiple_iters, data, batch_size, num_iters):
             with self.graph.as_default():
                 self.sess.run(self.train_op, feed_dict={self.features: input_data, self.labels: target_data})
         soln = self.get_params()
@@ -164,8 +148,7 @@ class Model(object):
         Args:
             data: dict of the form {'x': [list], 'y': [list]}
         '''
-        x_vecs = process_x(data['x'], self.seq_len)
-        labels = process_y(data['y'])
+        x_vecs, labels = data['x'], data['y']
         with self.graph.as_default():
             tot_correct, loss = self.sess.run([self.eval_metric_ops, self.loss],
                 feed_dict={self.features: x_vecs, self.labels: labels})
@@ -177,7 +160,7 @@ class Model(object):
     def reinitialize_params(self, seed):
         tf.set_random_seed(seed)
         with self.graph.as_default():
-            self.sess.run(tf.global_variables_initializer())
+            self.sess.run(tf.global_variables_initializer(), feed_dict={self.emb_ph: self.emb_arr})
             model_params = self.get_params()
         return model_params
 
@@ -1,22 +1,41 @@
 import argparse
 import json
 
+import numpy as np
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument('-f',
                 help='path to .txt file containing word embedding information;',
                 type=str,
                 default='glove.6B.300d.txt')
+parser.add_argument('--json',
+                help='convert an embs.json written by an older get_embs.py instead;',
+                type=str,
+                default=None)
 
 args = parser.parse_args()
 
-lines = []
-with open(args.f, 'r') as inf:
-    lines = inf.readlines()
-lines = [l.split() for l in lines]
-vocab = [l[0] for l in lines]
-emb_floats = [[float(n) for n in l[1:]] for l in lines]
-emb_floats.append([0.0 for _ in range(300)]) # for unknown word
-js = {'vocab': vocab, 'emba': emb_floats}
-with open('embs.json', 'w') as ouf:
-    json.dump(js, ouf)
+# Writes embs.npy, the float32 table with one extra zero row for unknown
+# words, and embs_vocab.json, the word of each row
+if args.json is not None:
+    with open(args.json, 'r') as inf:
+        js = json.load(inf)
+    vocab = js['vocab']
+    np.save('embs.npy', np.array(js['emba'], dtype=np.float32))
+else:
+    with open(args.f, 'r') as inf:
+        num_words = sum(1 for _ in inf)
+        inf.seek(0)
+        vocab = []
+        embs = None
+        for i, line in enumerate(inf):
+            l = line.split()
+            if embs is None:
+                embs = np.lib.format.open_memmap('embs.npy', mode='w+', dtype=np.float32, shape=(num_words+1, len(l)-1))
+            vocab.append(l[0])
+            embs[i] = np.array(l[1:], dtype=np.float32)
+        embs[num_words] = 0.0 # for unknown word
+        embs.flush()
+with open('embs_vocab.json', 'w') as ouf:
+    json.dump(vocab, ouf)
@@ -8,6 +8,6 @@ if [ ! -f 'glove.6B.300d.txt' ]; then
     rm glove.6B.50d.txt glove.6B.100d.txt glove.6B.200d.txt glove.6B.zip
 fi
 
-if [ ! -f embs.json ]; then
+if [ ! -f embs.npy ]; then
     python3 get_embs.py
 fi
\ No newline at end of file
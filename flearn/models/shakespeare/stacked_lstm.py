@@ -1,9 +1,5 @@
 import numpy as np
 from tqdm import trange
-import json
-
-import os
-import sys
 
 #from tensorflow.contrib import rnn
 # Migrate to TF2
@@ -11,25 +7,22 @@ import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 import tensorflow.compat.v1.nn.rnn_cell as rnn
 
-utils_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-utils_dir = os.path.join(utils_dir, 'utils')
-sys.path.append(utils_dir)
-
-from model_utils import batch_data, batch_data_multiple_iters
-from language_utils import letter_to_vec, word_to_indices
-from tf_utils import graph_size
-from tf_utils import process_sparse_grad
+from flearn.models.base_model import BaseModel
+from flearn.utils.model_utils import batch_data, batch_data_multiple_iters
+from flearn.utils.language_utils import letter_to_index, word_to_indices
+from flearn.utils.tf_utils import graph_size, graph_flops, process_sparse_grad
 
 def process_x(raw_x_batch):
     x_batch = [word_to_indices(word) for word in raw_x_batch]
-    x_batch = np.array(x_batch)
+    x_batch = np.array(x_batch, dtype=np.int32)
     return x_batch
 
 def process_y(raw_y_batch):
-    y_batch = [letter_to_vec(c) for c in raw_y_batch]
+    y_batch = [letter_to_index(c) for c in raw_y_batch]
+    y_batch = np.array(y_batch, dtype=np.int32)
     return y_batch
 
-class Model(object):
+class Model(BaseModel):
     def __init__(self, seq_len, num_classes, n_hidden, optimizer, seed):
         self.seq_len = seq_len
         self.num_classes = num_classes
@@ -39,6 +32,7 @@ class Model(object):
         with self.graph.as_default():
             tf.set_random_seed(123 + seed)
             self.features, self.labels, self.train_op, self.grads, self.eval_metric_ops, self.loss = self.create_model(optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
         self.sess = tf.Session(graph=self.graph)
 
@@ -47,45 +41,37 @@ class Model(object):
         with self.graph.as_default():
             self.sess.run(tf.global_variables_initializer())
 
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.flops = graph_flops(self.graph, __name__)
 
     def create_model(self, optimizer):
         features = tf.placeholder(tf.int32, [None, self.seq_len])
-        embedding = tf.get_variable("embedding", [self.num_classes, 8])
-        x = tf.nn.embedding_lookup(embedding, features)
-        labels = tf.placeholder(tf.int32, [None, self.num_classes])
-        
-        stacked_lstm = rnn.MultiRNNCell(
-            [rnn.BasicLSTMCell(self.n_hidden) for _ in range(2)])
-        outputs, _ = tf.nn.dynamic_rnn(stacked_lstm, x, dtype=tf.float32)
-        pred = tf.layers.dense(inputs=outputs[:,-1,:], units=self.num_classes)
-        
-        loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits_v2(logits=pred, labels=labels))
+        labels = tf.placeholder(tf.int32, [None,]) # letter indices
+        pred, loss = self.create_loss(features, labels)
 
         grads_and_vars = optimizer.compute_gradients(loss)
         grads, _ = zip(*grads_and_vars)
         train_op = optimizer.apply_gradients(grads_and_vars, global_step=tf.train.get_global_step())
 
 
-        correct_pred = tf.equal(tf.argmax(pred, 1), tf.argmax(labels, 1))
+        correct_pred = tf.equal(tf.argmax(pred, 1), tf.cast(labels, tf.int64))
         eval_metric_ops = tf.count_nonzero(correct_pred)
 
         return features, labels, train_op, grads, eval_metric_ops, loss
 
+    def create_loss(self, features, labels):
+        embedding = tf.get_variable("embedding", [self.num_classes, 8])
+        x = tf.nn.embedding_lookup(embedding, features)
+        
+        stacked_lstm = rnn.MultiRNNCell(
+            [rnn.BasicLSTMCell(self.n_hidden) for _ in range(2)])
+        outputs, _ = tf.nn.dynamic_rnn(stacked_lstm, x, dtype=tf.float32)
+        pred = tf.layers.dense(inputs=outputs[:,-1,:], units=self.num_classes)
+        
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=pred)
+        return pred, loss
 
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
-
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+    def prepare(self, X, y):
+        return process_x(X), process_y(y)
 
     def get_gradients(self, data, model_len):
         '''in order to avoid the OOM error, we need to calculate the gradients on each 
@@ -99,8 +85,7 @@ class Model(object):
         processed_samples = 0
 
         if num_samples < 50:
-            input_data = process_x(data['x'])
-            target_data = process_y(data['y'])
+            input_data, target_data = data['x'], data['y']
             with self.graph.as_default():
                 model_grads = self.sess.run(self.grads, 
                     feed_dict={self.features: input_data, self.labels: target_data})
@@ -109,8 +94,7 @@ class Model(object):
 
         else:  # in order to fit into memory, compute gradients in a batch of size 50, and subsample a subset of points to approximate
             for i in range(min(int(num_samples / 50), 4)):
-                input_data = process_x(data['x'][50*i:50*(i+1)])
-                target_data = process_y(data['y'][50*i:50*(i+1)])
+                input_data, target_data = data['x'][50*i:50*(i+1)], data['y'][50*i:50*(i+1)]
 
                 with self.graph.as_default():
                     model_grads = self.sess.run(self.grads,
@@ -132,13 +116,11 @@ class Model(object):
             soln: trainable variables of the lstm model
             comp: number of FLOPs computed while training given data
         '''
-        for _ in trange(num_epochs, desc='Epoch: ', leave=False):
-            for X,y in batch_data(data, batch_size):
-                input_data = process_x(X)
-                target_data = process_y(y)
-                with self.graph.as_default():
-                    self.sess.run(self.train_op,
-                        feed_dict={self.features: input_data, self.labels: target_data})
+        if self.epoch_train_op is not None:
+            self.run_epoch_loop(data, num_epochs, batch_size)
+        else:
+            for _ in trange(num_epochs, desc='Epoch: ', leave=False):
+                self.train_batches(batch_data, data, batch_size)
         soln = self.get_params()
         comp = num_epochs * (len(data['y'])//batch_size) * batch_size * self.flops
         return soln, comp
@@ -146,9 +128,7 @@ class Model(object):
     def solve_iters(self, data, num_iters=1, batch_size=32):
         '''Solves local optimization problem'''
 
-        for X, y in batch_data_multiple_iters(data, batch_size, num_iters):
-            input_data = process_x(X)
-            target_data = process_y(y)
+        for input_data, target_data in self.batches(batch_data_multiple_iters, data, batch_size, num_iters):
             with self.graph.as_default():
                 self.sess.run(self.train_op, feed_dict={self.features: input_data, self.labels: target_data})
         soln = self.get_params()
@@ -163,8 +143,7 @@ class Model(object):
             tot_correct: total #samples that are predicted correctly
             loss: loss value on `data`
         '''
-        x_vecs = process_x(data['x'])
-        labels = process_y(data['y'])
+        x_vecs, labels = data['x'], data['y']
         with self.graph.as_default():
             tot_correct, loss = self.sess.run([self.eval_metric_ops, self.loss],
                 feed_dict={self.features: x_vecs, self.labels: labels})
@@ -2,12 +2,14 @@ import numpy as np
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 
+from flearn.models.base_model import BaseModel
+from flearn.models.batched_model import BaseBatchedModel, masked_mean
 from flearn.utils.model_utils import batch_data, batch_data_multiple_iters
-from flearn.utils.tf_utils import graph_size
+from flearn.utils.tf_utils import graph_size, graph_flops
 from flearn.utils.tf_utils import process_grad
 
 
-class Model(object):
+class Model(BaseModel):
     '''
     Assumes that images are 28px by 28px
     '''
@@ -22,6 +24,7 @@ class Model(object):
         with self.graph.as_default():
             tf.set_random_seed(123+seed)
             self.features, self.labels, self.train_op, self.grads, self.eval_metric_ops, self.loss, self.pred = self.create_model(optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
         self.sess = tf.Session(graph=self.graph)
 
@@ -29,20 +32,17 @@ class Model(object):
         self.size = graph_size(self.graph)
         with self.graph.as_default():
             self.sess.run(tf.global_variables_initializer())
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.flops = graph_flops(self.graph, __name__)
     
     def create_model(self, optimizer):
         """Model function for Logistic Regression."""
         features = tf.placeholder(tf.float32, shape=[None, 60], name='features')
         labels = tf.placeholder(tf.int64, shape=[None,], name='labels')
-        logits = tf.layers.dense(inputs=features, units=self.num_classes, kernel_regularizer=tf.keras.regularizers.l2(0.001))
+        logits, loss = self.create_loss(features, labels)
         predictions = {
             "classes": tf.argmax(input=logits, axis=1),
             "probabilities": tf.nn.softmax(logits, name="softmax_tensor")
             }
-        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
 
         grads_and_vars = optimizer.compute_gradients(loss)
         grads, _ = zip(*grads_and_vars)
@@ -50,17 +50,10 @@ class Model(object):
         eval_metric_ops = tf.count_nonzero(tf.equal(labels, predictions["classes"]))
         return features, labels, train_op, grads, eval_metric_ops, loss, predictions["classes"]
 
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
-
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+    def create_loss(self, features, labels):
+        logits = tf.layers.dense(inputs=features, units=self.num_classes, kernel_regularizer=tf.keras.regularizers.l2(0.001))
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+        return logits, loss
 
     def get_gradients(self, data, model_len):
 
@@ -76,10 +69,11 @@ class Model(object):
     def solve_inner(self, data, num_epochs=1, batch_size=32):
         '''Solves local optimization problem'''
 
-        for _ in range(num_epochs):
-            for X, y in batch_data(data, batch_size):
-                with self.graph.as_default():
-                    self.sess.run(self.train_op, feed_dict={self.features: X, self.labels: y})
+        if self.epoch_train_op is not None:
+            self.run_epoch_loop(data, num_epochs, batch_size)
+        else:
+            for _ in range(num_epochs):
+                self.train_batches(batch_data, data, batch_size)
         soln = self.get_params()
         comp = num_epochs * (len(data['y'])//batch_size) * batch_size * self.flops
         return soln, comp
@@ -87,9 +81,7 @@ class Model(object):
     def solve_iters(self, data, num_iters=1, batch_size=32):
         '''Solves local optimization problem'''
 
-        for X, y in batch_data_multiple_iters(data, batch_size, num_iters):
-            with self.graph.as_default():
-                self.sess.run(self.train_op, feed_dict={self.features: X, self.labels: y})
+        self.train_batches(batch_data_multiple_iters, data, batch_size, num_iters)
         soln = self.get_params()
         comp = 0
         return soln, comp
@@ -113,3 +105,31 @@ class Model(object):
             self.sess.run(tf.global_variables_initializer())
             model_params = self.get_params()
         return model_params
+
+
+class BatchedModel(BaseBatchedModel):
+    '''Client-batched variant of Model, see BaseBatchedModel'''
+
+    def __init__(self, num_clients, num_classes, prox, learning_rate, mu, seed=1, shared_input=False):
+        self.num_classes = num_classes
+        self.param_shapes = [[60, num_classes], [num_classes]] # kernel, bias of the dense layer
+        super(BatchedModel, self).__init__(num_clients, prox, learning_rate, mu, seed, shared_input)
+
+    def create_batched_model(self, params, mask):
+        features = tf.placeholder(tf.float32, shape=[self.num_clients, None, 60])
+        labels = tf.placeholder(tf.int64, shape=[self.num_clients, None])
+        kernel, bias = params
+        logits = tf.matmul(features, kernel) + bias[:, tf.newaxis, :]
+        losses = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=logits)
+        return features, labels, masked_mean(losses, mask)
+
+    def create_client_model(self, params):
+        features = tf.placeholder(tf.float32, shape=[None, 60])
+        labels = tf.placeholder(tf.int64, shape=[None,])
+        return features, labels, self.create_client_loss(params, features, labels)
+
+    def create_client_loss(self, params, features, labels):
+        kernel, bias = params
+        logits = tf.nn.bias_add(tf.matmul(features, kernel), bias) # Same ops as tf.layers.dense
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+        return loss
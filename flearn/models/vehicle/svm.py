@@ -3,12 +3,14 @@ import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 from tqdm import trange
 
+from flearn.models.base_model import BaseModel
+from flearn.models.batched_model import BaseBatchedModel, masked_mean
 from flearn.utils.model_utils import batch_data, gen_batch
-from flearn.utils.tf_utils import graph_size
+from flearn.utils.tf_utils import graph_size, graph_flops
 from flearn.utils.tf_utils import process_grad
 
 
-class Model(object):    
+class Model(BaseModel):
     def __init__(self, num_classes, optimizer, seed=1):
 
         # params
@@ -19,6 +21,7 @@ class Model(object):
         with self.graph.as_default():
             tf.set_random_seed(123+seed)
             self.features, self.labels, self.train_op, self.grads, self.eval_metric_ops, self.loss, self.predictions = self.create_model(optimizer)
+            self.build_param_ops()
             self.saver = tf.train.Saver()
         self.sess = tf.Session(graph=self.graph)
 
@@ -26,20 +29,13 @@ class Model(object):
         self.size = graph_size(self.graph)
         with self.graph.as_default():
             self.sess.run(tf.global_variables_initializer())
-            metadata = tf.RunMetadata()
-            opts = tf.profiler.ProfileOptionBuilder.float_operation()
-            self.flops = tf.profiler.profile(self.graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+            self.flops = graph_flops(self.graph, __name__)
 
     def create_model(self, optimizer):
         """Model function for Logistic Regression."""
         features = tf.placeholder(tf.float32, shape=[None, 100], name='features')
         labels = tf.placeholder(tf.float32, shape=[None, 1], name='labels')
-        
-        W = tf.Variable(tf.zeros([100, 1]))
-        b = tf.Variable(tf.zeros([1]))
-        y_pred = tf.matmul(features, W) + b
-
-        loss = 0.01 * tf.reduce_sum(tf.square(W)) + tf.reduce_mean(tf.maximum(tf.zeros_like(labels), 1 - labels * y_pred))
+        y_pred, loss = self.create_loss(features, labels)
 
         grads_and_vars = optimizer.compute_gradients(loss)
         grads, _ = zip(*grads_and_vars)
@@ -47,17 +43,13 @@ class Model(object):
         eval_metric_ops = tf.count_nonzero(tf.equal(labels, tf.sign(y_pred)))
         return features, labels, train_op, grads, eval_metric_ops, loss, tf.sign(y_pred)
 
-    def set_params(self, model_params=None):
-        if model_params is not None:
-            with self.graph.as_default():
-                all_vars = tf.trainable_variables()
-                for variable, value in zip(all_vars, model_params):
-                    variable.load(value, self.sess)
+    def create_loss(self, features, labels):
+        W = tf.get_variable('W', initializer=tf.zeros([100, 1]))
+        b = tf.get_variable('b', initializer=tf.zeros([1]))
+        y_pred = tf.matmul(features, W) + b
 
-    def get_params(self):
-        with self.graph.as_default():
-            model_params = self.sess.run(tf.trainable_variables())
-        return model_params
+        loss = 0.01 * tf.reduce_sum(tf.square(W)) + tf.reduce_mean(tf.maximum(tf.zeros_like(labels), 1 - labels * y_pred))
+        return y_pred, loss
 
     def get_gradients(self, data, model_len):
 
@@ -78,11 +70,11 @@ class Model(object):
     
     def solve_inner(self, data, num_epochs=1, batch_size=32):
         '''Solves local optimization problem'''
-        for _ in range(num_epochs):
-            for X, y in batch_data(data, batch_size):
-                with self.graph.as_default():
-                    _, pred = self.sess.run([self.train_op, self.predictions],
-                        feed_dict={self.features: X, self.labels: y})
+        if self.epoch_train_op is not None:
+            self.run_epoch_loop(data, num_epochs, batch_size)
+        else:
+            for _ in range(num_epochs):
+                self.train_batches(batch_data, data, batch_size)
         soln = self.get_params()
         comp = num_epochs * (len(data['y'])//batch_size) * batch_size * self.flops
         return soln, comp
@@ -106,4 +98,33 @@ class Model(object):
         return tot_correct, loss
     
     def close(self):
-        self.sess.close()
\ No newline at end of file
+        self.sess.close()
+
+
+class BatchedModel(BaseBatchedModel):
+    '''Client-batched variant of Model, see BaseBatchedModel'''
+
+    def __init__(self, num_clients, num_classes, prox, learning_rate, mu, seed=1, shared_input=False):
+        self.num_classes = num_classes
+        self.param_shapes = [[100, 1], [1]] # W, b
+        super(BatchedModel, self).__init__(num_clients, prox, learning_rate, mu, seed, shared_input)
+
+    def create_batched_model(self, params, mask):
+        features = tf.placeholder(tf.float32, shape=[self.num_clients, None, 100])
+        labels = tf.placeholder(tf.float32, shape=[self.num_clients, None, 1])
+        W, b = params
+        y_pred = tf.matmul(features, W) + b[:, tf.newaxis, :]
+        hinge = tf.maximum(tf.zeros_like(labels), 1 - labels * y_pred)[:, :, 0]
+        losses = 0.01 * tf.reduce_sum(tf.square(W), axis=[1, 2]) + masked_mean(hinge, mask)
+        return features, labels, losses
+
+    def create_client_model(self, params):
+        features = tf.placeholder(tf.float32, shape=[None, 100])
+        labels = tf.placeholder(tf.float32, shape=[None, 1])
+        return features, labels, self.create_client_loss(params, features, labels)
+
+    def create_client_loss(self, params, features, labels):
+        W, b = params
+        y_pred = tf.matmul(features, W) + b
+        loss = 0.01 * tf.reduce_sum(tf.square(W)) + tf.reduce_mean(tf.maximum(tf.zeros_like(labels), 1 - labels * y_pred))
+        return loss
@@ -6,6 +6,8 @@ from tensorflow.python.training import optimizer
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 
+from flearn.utils.param_vector import as_param_vector
+
 
 class PerturbedGradientDescent(optimizer.Optimizer):
     """Implementation of Perturbed Gradient Descent, i.e., FedProx optimizer"""
@@ -42,6 +44,15 @@ class PerturbedGradientDescent(optimizer.Optimizer):
         return control_flow_ops.group(*[var_update,])
 
     
+    def step_value(self, grad, var, value):
+        """Returns value after one dense update of var, value holds the current
+        value of var as a tensor, e.g. a loop variable of an in-graph training loop"""
+        lr_t = math_ops.cast(ops.convert_to_tensor(self._lr), var.dtype.base_dtype)
+        mu_t = math_ops.cast(ops.convert_to_tensor(self._mu), var.dtype.base_dtype)
+        vstar = self.get_slot(var, "vstar")
+        with ops.name_scope(self._name): # Same op names as _apply_dense(), grappler orders rewritten sums by name
+            return value - lr_t*(grad + mu_t*(value-vstar))
+
     def _apply_sparse_shared(self, grad, var, indices, scatter_add):
 
         lr_t = math_ops.cast(self._lr_t, var.dtype.base_dtype)
@@ -63,8 +74,10 @@ class PerturbedGradientDescent(optimizer.Optimizer):
     
 
     def set_params(self, cog, client): # (self.latest_model, self.client_model)
-        with client.graph.as_default():
-            all_vars = tf.trainable_variables()
-            for variable, value in zip(all_vars, cog):
-                vstar = self.get_slot(variable, "vstar")
-                vstar.load(value, client.sess)
+        # One grouped assign of the flat params_ph of the model (see
+        # BaseModel.build_param_ops) instead of one load per variable
+        if client.vstar_assign_op is None:
+            with client.graph.as_default():
+                client.vstar_assign_op = tf.group(*[tf.assign(self.get_slot(variable, "vstar"), value)
+                    for variable, value in zip(client.trainable_vars, client.param_values)])
+        client.sess.run(client.vstar_assign_op, feed_dict={client.params_ph: as_param_vector(cog).flat})
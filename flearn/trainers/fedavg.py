@@ -4,6 +4,8 @@ import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 
 from .fedbase import BaseFedarated
+from flearn.utils.aggregator import Aggregator
+from flearn.utils.client_pool import solve_clients
 from flearn.utils.tf_utils import process_grad
 from utils.export_csv import CSVWriter
 
@@ -52,22 +54,24 @@ class Server(BaseFedarated):
                 self.writer.write_diffs(diffs)
                 tqdm.write('At round {} Discrepancy: {}'.format(i, diffs[0]))
 
+            # Solutions are folded into the aggregator as they arrive, they are
+            # buffered only if the discrepancy is evaluated in the next round
+            aggregator = Aggregator(precision=self.agg_precision)
+            track_diffs = (i + 1) % self.eval_every == 0
             csolns = [] # Reset the client solutions buffer
-            for idx, c in enumerate(active_clients.tolist()):  # simply drop the slow devices
-                # communicate the latest model
-                c.set_params(self.latest_model)
-
-                # solve minimization locally
-                soln, stats = c.solve_inner(num_epochs=self.num_epochs, batch_size=self.batch_size)
-
+            # communicate the latest model and solve minimization locally,
+            # sequentially or in the client pool. simply drop the slow devices
+            for c, soln, stats in solve_clients(active_clients.tolist(), self.latest_model,
+                    self.num_epochs, self.batch_size, self.client_pool):
                 # gather solutions from client
-                csolns.append(soln)
+                aggregator.add(soln[1], soln[0])
+                if track_diffs: csolns.append(soln)
 
                 # track communication cost
                 self.metrics.update(rnd=i, cid=c.id, stats=stats)
 
             # update models
-            self.latest_model = self.aggregate(csolns)
+            self.latest_model = aggregator.result()[0]
         self.writer.close()
 
         # final test model
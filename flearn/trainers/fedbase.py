@@ -1,22 +1,71 @@
+import importlib
 import numpy as np
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 from tqdm import tqdm
 
 from flearn.models.client import Client
-from flearn.utils.model_utils import Metrics
-from flearn.utils.tf_utils import process_grad
+from flearn.utils.model_utils import Metrics, batch_seed
+from flearn.utils.tf_utils import process_grad, set_flops_profiling, FLOPS_CACHE_DIR
+from flearn.utils.aggregator import weighted_average
+from flearn.utils.client_pool import ClientPool
+from flearn.utils.client_data import DATA_CACHE
+from flearn.utils.client_index import load_index, build_index
+from flearn.optimizer.pgd import PerturbedGradientDescent
 
 class BaseFedarated(object):
     def __init__(self, params, learner, dataset):
         # transfer parameters to self
         for key, val in params.items(): setattr(self, key, val)
+        self.agg_precision = params.get('agg_precision', 'float64') # Accumulator of Aggregator
+
+        # FLOPs of the models, cached on disk, 0 if no_flops
+        self.no_flops = params.get('no_flops', False)
+        self.flops_cache = params.get('flops_cache', FLOPS_CACHE_DIR) or None
+        set_flops_profiling(not self.no_flops, self.flops_cache)
 
         # create worker nodes
         tf.reset_default_graph()
         self.client_model = learner(*params['model_params'], self.inner_opt, self.seed)
+        self.in_graph_loop = params.get('in_graph_loop', False) # Run all local epochs in one sess.run
+        if self.in_graph_loop:
+            self.client_model.build_epoch_loop(self.inner_opt)
+        # Clients load their data on first use, the resident data is
+        # bounded by data_budget MB (0 for no limit)
+        self.data_budget = params.get('data_budget', 0)
+        DATA_CACHE.set_budget(int(self.data_budget * 2**20) if self.data_budget > 0 else None)
+        # 'inplace' shuffles the clients' data with the global RNG, 'buffered'
+        # draws allocation-free minibatches from a Batcher per client
+        self.batcher = params.get('batcher', 'inplace')
         self.clients = self.setup_clients(dataset, self.client_model)
         print('{} Clients in Total'.format(len(self.clients)))
+        # Sizes, label histograms and feature moments of the clients, loaded from
+        # the index.npz of the client_index_dir directory (e.g. the dataset cache)
+        # or computed from the clients' data on first use
+        index_dir = params.get('client_index_dir')
+        self._client_index = load_index(index_dir) if index_dir else None
+        self.weighted_selection = params.get('weighted_selection', False) # Select clients in proportion to their sizes
+
+        # Train clients in num_workers processes, 0 for sequential training,
+        # or clients_per_round clients at a time in one graph if client_batched
+        self.num_workers = params.get('num_workers', 0)
+        self.client_batched = params.get('client_batched', False)
+        self.client_pool = None
+        prox = isinstance(self.inner_opt, PerturbedGradientDescent)
+        if self.num_workers > 0 and self.client_batched:
+            raise ValueError('num_workers and client_batched can not be used together')
+        if self.batcher == 'buffered' and (self.client_batched or self.in_graph_loop):
+            raise ValueError('the buffered batcher can not be used with client_batched or in_graph_loop')
+        if self.num_workers > 0:
+            self.client_pool = ClientPool(self.num_workers, learner, params['model_params'], self.clients,
+                prox, params['learning_rate'], params.get('mu', 0), self.seed, self.in_graph_loop,
+                self.no_flops, self.flops_cache, self.data_budget, self.batcher)
+        elif self.client_batched:
+            batched_learner = getattr(importlib.import_module(learner.__module__), 'BatchedModel', None)
+            if batched_learner is None:
+                raise ValueError('{} has no client-batched variant'.format(learner.__module__))
+            self.client_pool = batched_learner(self.clients_per_round, *params['model_params'],
+                prox, params['learning_rate'], params.get('mu', 0), self.seed)
         self.latest_model = self.client_model.get_params()
 
         # initialize system metrics
@@ -28,6 +77,8 @@ class BaseFedarated(object):
 
     def __del__(self):
         self.client_model.close()
+        if self.client_pool is not None:
+            self.client_pool.close()
 
     def setup_clients(self, dataset, model=None):
         '''instantiates clients based on given train and test data directories
@@ -38,7 +89,11 @@ class BaseFedarated(object):
         users, groups, train_data, test_data = dataset
         if len(groups) == 0:
             groups = [None for _ in users]
-        all_clients = [Client(u, g, train_data[u], test_data[u], model) for u, g in zip(users, groups)]
+        # All clients start from the same (read-only) params
+        initial_params = model.get_params()
+        initial_params.flat.setflags(write=False)
+        all_clients = [Client(u, g, train_data[u], test_data[u], model,
+            batch_seed(self.seed, u) if self.batcher == 'buffered' else None, initial_params) for u, g in zip(users, groups)]
         return all_clients
 
     def train_error_and_loss(self, clients=None):
@@ -101,8 +156,17 @@ class BaseFedarated(object):
     def save(self):
         pass
 
+    @property
+    def client_index(self):
+        '''ClientIndex of self.clients'''
+        if self._client_index is None:
+            self._client_index = build_index([c.id for c in self.clients],
+                {c.id: c.train_source for c in self.clients}, {c.id: c.eval_source for c in self.clients})
+        return self._client_index
+
     def select_clients(self, round, num_clients=20):
-        '''selects num_clients clients weighted by number of samples from possible_clients
+        '''selects num_clients clients from possible_clients, uniformly or, if
+        weighted_selection, weighted by number of samples (from the client index)
         
         Args:
             num_clients: number of clients to select; default 20
@@ -114,19 +178,19 @@ class BaseFedarated(object):
         '''
 
         num_clients = min(num_clients, len(self.clients))
+        p = None
+        if self.weighted_selection:
+            index = self.client_index
+            sizes = index.num_train[index.rows_of([c.id for c in self.clients])]
+            p = sizes / sizes.sum()
+            num_clients = min(num_clients, np.count_nonzero(p))
         np.random.seed(round)  # make sure for each comparison, we are selecting the same clients each round
-        indices = np.random.choice(range(len(self.clients)), num_clients, replace=False)
+        indices = np.random.choice(range(len(self.clients)), num_clients, replace=False, p=p)
         return indices, np.asarray(self.clients)[indices]
 
     def aggregate(self, wsolns):
-        total_weight = 0.0
-        base = [0]*len(wsolns[0][1]) # wsolns ->(n_k, soln)
-        for (w, soln) in wsolns:  # w is the number of local samples
-            total_weight += w
-            for i, v in enumerate(soln): # for each w_i in w
-                base[i] += w*v.astype(np.float64)
-
-        averaged_soln = [v / total_weight for v in base]
+        # wsolns ->(n_k, soln), w is the number of local samples
+        averaged_soln = weighted_average(wsolns, self.agg_precision)
 
         return averaged_soln
 
@@ -5,6 +5,8 @@ tf.disable_v2_behavior()
 
 from .fedbase import BaseFedarated
 from flearn.optimizer.pgd import PerturbedGradientDescent
+from flearn.utils.aggregator import Aggregator
+from flearn.utils.client_pool import solve_clients
 from flearn.utils.tf_utils import process_grad, process_sparse_grad
 from utils.export_csv import CSVWriter
 
@@ -72,31 +74,34 @@ class Server(BaseFedarated):
             difference = difference * 1.0 / len(self.clients)
             tqdm.write('gradient difference: {}'.format(difference))
 
+            # Solutions are folded into the aggregator as they arrive, they are
+            # buffered only if the discrepancy is evaluated in the next round
+            aggregator = Aggregator(precision=self.agg_precision)
+            track_diffs = (i + 1) % self.eval_every == 0
             csolns = [] # buffer for receiving client solutions
             self.inner_opt.set_params(self.latest_model, self.client_model)
 
-            for idx, c in enumerate(selected_clients.tolist()):
-                # communicate the latest model
-                c.set_params(self.latest_model)
-
-                total_iters = int(self.num_epochs * c.num_samples / self.batch_size)+2 # randint(low,high)=[low,high)
-
-                # solve minimization locally
+            def client_epochs(c):
                 if c in active_clients:
-                    soln, stats = c.solve_inner(num_epochs=self.num_epochs, batch_size=self.batch_size)
+                    return self.num_epochs
                 else:
-                    #soln, stats = c.solve_iters(num_iters=np.random.randint(low=1, high=total_iters), batch_size=self.batch_size)
-                    soln, stats = c.solve_inner(num_epochs=np.random.randint(low=1, high=self.num_epochs), batch_size=self.batch_size)
+                    # stragglers, drawn right before the client is trained
+                    return np.random.randint(low=1, high=self.num_epochs)
 
+            # communicate the latest model and solve minimization locally,
+            # sequentially or in the client pool
+            for c, soln, stats in solve_clients(selected_clients.tolist(), self.latest_model,
+                    client_epochs, self.batch_size, self.client_pool):
                 # print(soln[0]) #DEBUG
                 # gather solutions from client
-                csolns.append(soln)
+                aggregator.add(soln[1], soln[0])
+                if track_diffs: csolns.append(soln)
         
                 # track communication cost
                 self.metrics.update(rnd=i, cid=c.id, stats=stats)
 
             # update models
-            self.latest_model = self.aggregate(csolns)
+            self.latest_model = aggregator.result()[0]
             self.client_model.set_params(self.latest_model)
 
         self.writer.close()
@@ -1,3 +1,4 @@
+import importlib
 import numpy as np
 from numpy.core.numeric import roll
 from sklearn.utils.validation import check_random_state
@@ -8,15 +9,22 @@ tf.disable_v2_behavior()
 from .fedbase import BaseFedarated
 from flearn.optimizer.pgd import PerturbedGradientDescent
 from flearn.utils.tf_utils import process_grad, process_sparse_grad
+from flearn.utils.aggregator import Aggregator
+from flearn.utils.param_vector import ParamVector
 from flearn.models.client import Client
 from flearn.utils.model_utils import Metrics
 from flearn.models.group import Group
+from flearn.utils.madc import data_driven_measure
+from flearn.utils.clustering import ClusteringBackend
+from flearn.utils.sketch import CountSketch
 import random
 from utils.export_csv import CSVWriter
 from sklearn.cluster import KMeans, SpectralClustering, AgglomerativeClustering
 from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances, nan_euclidean_distances
-from collections import Counter
+from collections import Counter, OrderedDict
+from scipy.optimize import linear_sum_assignment
+from scipy.stats import norm
 import time
 
 """ This Server class is customized for Group Prox """
@@ -39,8 +47,33 @@ class Server(BaseFedarated):
         self.RAC = params['RAC'] # Randomly Assign Clients
         self.RCC = params['RCC'] # Random Cluster Center
         self.MADC = params['MADC'] # Use Mean Absolute Difference of pairwise Cossim
+        # Compute MADC in blocks of at most madc_budget MB, in madc_workers processes (0 for this process)
+        self.madc_budget = params.get('madc_budget', 256)
+        self.madc_workers = params.get('madc_workers', 0)
+        # Decompose the updates with a single-pass sketch instead of TruncatedSVD, sketch_size columns
+        self.sketch_svd = params.get('sketch_svd', False)
+        self.sketch_size = params.get('sketch_size', 4096)
+        # The clustering is a measure ('EDC' or 'MADC') x an algorithm ('kmeans', 'agglomerative'
+        # or 'spectral'), None for KMeans on EDC or complete linkage on MADC (see MADC)
+        self.clustering_measure = params.get('clustering_measure')
+        self.clustering_algorithm = params.get('clustering_algorithm')
         self.recluster_epoch = params['recluster_epoch']
+        # Incremental recluster: reuse the cached update of a warm client while the
+        # global model moved less than recluster_tolerance (relative norm), warm-start the
+        # clustering from the groups, re-cold-start only the warm clients whose assignment
+        # margin (second best - best difference) to the refreshed groups is below
+        # recluster_margin on a reused update. The full updates of at most
+        # recluster_cache clients are cached (LRU, default: the clustering clients),
+        # the other warm clients keep a CountSketch of sketch_size of their update
+        self.incremental_recluster = params.get('incremental_recluster', False)
+        self.recluster_tolerance = params.get('recluster_tolerance', 0.1)
+        self.recluster_margin = params.get('recluster_margin', 0.05)
+        self.recluster_cache = params.get('recluster_cache', self.num_group*20)
+        self.update_cache = OrderedDict() # {client: (base model, update)}, least recently used first
+        self.sketch_cache = {} # {client: (base model, sketch, norm)} of the update of every warm client
+        self.update_sketch = None # CountSketch of the cached updates, built on first use
         self.max_temp = params['client_temp']
+        self.index_sampling = params.get('index_sampling', False) # Stratify the clustering clients by the client index
         self.temp_dict = {}
 
         """
@@ -67,6 +100,33 @@ class Server(BaseFedarated):
 
         self.create_groups()
 
+        # IFCA scores all group models on a client's data in one pass, the group
+        # models are the heads of a shared-input BatchedModel (linear models) or
+        # of the client model (models with create_loss, see BaseModel.build_heads)
+        self.ifca_heads, self.ifca_loaded = None, [None] * self.num_group
+        # Estimate the IFCA losses on growing random minibatches, stop when the best
+        # group leads with ifca_confidence after at least ifca_min_samples samples,
+        # compare with the full evaluation every ifca_audit reschedules (0 for never)
+        self.ifca_subsample = params.get('ifca_subsample', False)
+        self.ifca_confidence = params.get('ifca_confidence', 0.95)
+        self.ifca_min_samples = params.get('ifca_min_samples', 32)
+        self.ifca_audit = params.get('ifca_audit', 10)
+        self.ifca_rng = np.random.RandomState(self.seed)
+        self.ifca_rounds = 0
+        # FeSEM: the flat group models as a float32 matrix, rebuilt when a group model changes
+        self.fesem_models, self.fesem_matrix = None, None
+        if self.run_mode == 'IFCA':
+            batched_learner = getattr(importlib.import_module(learner.__module__), 'BatchedModel', None)
+            if batched_learner is not None:
+                self.ifca_heads = batched_learner(self.num_group, *params['model_params'], False, 0.0, 0.0,
+                    self.seed, shared_input=True)
+            elif hasattr(self.client_model, 'create_loss'):
+                self.client_model.build_heads(self.num_group)
+                self.ifca_heads = self.client_model
+            else:
+                print('Warning: {} has no create_loss(), the IFCA losses are evaluated one group model '
+                    'at a time'.format(learner.__module__))
+
         # Record the temperature of clients
         for c in self.clients: self.temp_dict[c] = self.max_temp
 
@@ -76,7 +136,7 @@ class Server(BaseFedarated):
     initialize the Group() instants
     """
     def create_groups(self):
-        self.group_list = [Group(gid, self.client_model) for gid in range(self.num_group)] # 0,1,...,num_group
+        self.group_list = [Group(gid, self.client_model, self.agg_precision, self.client_pool) for gid in range(self.num_group)] # 0,1,...,num_group
         self.group_ids = [g.get_group_id() for g in self.group_list]
         self.group_cold_start(self.RCC) # init the lastest_model of all groups
 
@@ -119,7 +179,7 @@ class Server(BaseFedarated):
 
     def get_ternary_cosine_similarity_matrix(self, w, V):
         #print(type(w), type(V))
-        print('Delta w shape:', w.shape, 'Matrix V shape:', V.shape)
+        #print('Delta w shape:', w.shape, 'Matrix V shape:', V.shape)
         w, V = w.astype(np.float32), V.astype(np.float32)
         left = np.matmul(w, V) # delta_w (dot) V
         scale = np.reciprocal(np.linalg.norm(w, axis=1, keepdims=True) * np.linalg.norm(V, axis=0, keepdims=True))
@@ -140,23 +200,35 @@ class Server(BaseFedarated):
         
 
     def client_cold_start(self, client, run_mode):
-        if client.group is not None:
-            print("Warning: Client already has a group: {:2d}.".format(client.group))
-        
+        self.clients_cold_start([client], run_mode)
+        return
+
+    """ Cold start clients in bulk, each client is pre-trained once,
+        then its update is compared with all group updates in one matmul
+    """
+    def clients_cold_start(self, clients, run_mode, chunk_size=64):
+        for client in clients:
+            if client.group is not None:
+                print("Warning: Client already has a group: {:2d}.".format(client.group))
+
         if run_mode == 'FedGroup':
             # Training is base on the global avg model
             start_model = self.client_model.get_params() # Backup the model first
             self.client_model.set_params(self.latest_model) # Set the training model to global avg model
-            
-            # client_model, client_update = self.pre_train_client(client) 
-            diff_list, assign_group = self.get_assign_group(client, run_mode)
 
-            # update(Init) the diff list of client
-            client.update_difference(diff_list)
-            
-            # Only set the group attr of client, do not actually add clients to the group
-            client.set_group(assign_group)
-            
+            # The group updates do not change during the cold start
+            V = np.vstack([process_grad(g.latest_update) for g in self.group_list]).T # shape=(n_params, n_groups)
+            for idx in range(0, len(clients), chunk_size):
+                chunk = clients[idx:idx+chunk_size]
+                # Pre-train the chunk of clients, shape=(n_clients, n_params)
+                w = np.vstack([process_grad(self.pre_train_client(c)[1]) for c in chunk])
+                diffs = self.get_ternary_cosine_similarity_matrix(w, V) # shape=(n_clients, n_groups)
+                for client, diff in zip(chunk, diffs):
+                    # update(Init) the diff list of client
+                    client.update_difference(list(zip(self.group_list, diff)))
+                    # Only set the group attr of client, do not actually add clients to the group
+                    client.set_group(self.group_list[np.argmin(diff)])
+
             # Recovery the training model
             self.client_model.set_params(start_model)
             return
@@ -181,7 +253,7 @@ class Server(BaseFedarated):
             # <FedGroup> and <FedGrouProx> use this strategy
             if random_centers == False:
                 alpha = 20 ######## Pre-train Scaler ###################
-                selected_clients = random.sample(self.clients, k=min(self.num_group*alpha, len(self.clients)))
+                selected_clients = self.sample_clustering_clients(self.clients, k=min(self.num_group*alpha, len(self.clients)))
 
                 for c in selected_clients: c.clustering = True # Mark these clients as clustering client
 
@@ -235,11 +307,14 @@ class Server(BaseFedarated):
         if self.RCC == True:
             print("Warning: The random cluster center strategy conflicts with dynamic clustering strategy.")
             return
+        if self.incremental_recluster == True:
+            self.group_recluster_incremental()
+            return
         
         # Select alpha*num_group warm clients for reclustering. 
         alpha = 20
         warm_clients = [c for c in self.clients if c.is_cold() == False ]
-        selected_clients = random.sample(warm_clients, k=min(self.num_group*alpha, len(warm_clients)))
+        selected_clients = self.sample_clustering_clients(warm_clients, k=min(self.num_group*alpha, len(warm_clients)))
         # Clear the clustering flage of warm clients
         for c in warm_clients: c.clustering, c.group = False, None
         for c in selected_clients: c.clustering = True
@@ -259,109 +334,185 @@ class Server(BaseFedarated):
         self.refresh_global_model(self.group_list)
 
         # *Cold start the original warm clients for evaluation
-        for c in warm_clients:
-            if c.is_cold() == True:
-                self.client_cold_start(c, run_mode='FedGroup')
+        self.clients_cold_start([c for c in warm_clients if c.is_cold() == True], run_mode='FedGroup')
+        return
+
+    """ Incremental recluster, the cost grows with the churn of the federation:
+        the clustering clients of the last clustering that are still warm are
+        kept (topped up with new ones), the cached updates of the warm clients
+        are reused while the global model has not moved much, and the
+        clustering starts from the current groups (kmeans on EDC). The labels
+        of the other backends are arbitrary, so every cluster is matched to the
+        group whose update is the closest (Hungarian matching). The other warm
+        clients are compared with the refreshed groups using their cached
+        updates, and only those whose group is then a close call are
+        pre-trained again.
+    """
+    def group_recluster_incremental(self):
+        alpha = 20
+        warm_clients = [c for c in self.clients if c.is_cold() == False]
+        k = min(self.num_group*alpha, len(warm_clients))
+        kept = [c for c in warm_clients if c.clustering == True][:k]
+        rest = [c for c in warm_clients if c.clustering == False]
+        selected_clients = kept
+        if k > len(kept):
+            selected_clients = kept + self.sample_clustering_clients(rest, k=k-len(kept))
+        for c in warm_clients: c.clustering = False
+        for c in selected_clients: c.clustering = True
+
+        cluster = self.clustering_clients(selected_clients, init_groups=self.group_list)
+        cluster_ids = list(cluster.keys())
+        # Cosine distance of the cluster updates to the current group updates
+        U = np.vstack([process_grad(cluster[id][1]) for id in cluster_ids])
+        V = np.vstack([process_grad(g.latest_update) for g in self.group_list]).T
+        rows, cols = linear_sum_assignment(self.get_ternary_cosine_similarity_matrix(U, V))
+        for row, col in zip(rows, cols):
+            soln, update, members = cluster[cluster_ids[row]]
+            g = self.group_list[col]
+            g.latest_update, g.latest_model = update, soln
+            for c in members: c.set_group(g)
+
+        self.refresh_global_model(self.group_list)
+
+        # The other warm clients keep the closest refreshed group unless it
+        # is a close call on a reused (cached) update. A reused update is only
+        # known by its sketch: the cosines to the groups are those of the
+        # sketches (E[y_w . y_v] = w . v) over the exact norms
+        others = [c for c in warm_clients if c.clustering == False]
+        uncertain = []
+        V = np.vstack([process_grad(g.latest_update) for g in self.group_list]).T # shape=(n_params, n_groups)
+        V_sketch = np.vstack([self.get_update_sketch().sketch(v) for v in V.T]).T # shape=(sketch_size, n_groups)
+        V_norms = np.linalg.norm(V.astype(np.float64), axis=0)
+        for c in others:
+            cached = self.sketch_cache.get(c)
+            hit = cached is not None and self.base_moved(cached[0]) < self.recluster_tolerance
+            if hit:
+                _, y, norm = cached
+                diff = (-y.dot(V_sketch) / np.maximum(norm * V_norms, 1e-12) + 1.) / 2.
+            else:
+                _, update = self.pre_train_client(c)
+                self.cache_update(c, update, full=False)
+                diff = self.get_ternary_cosine_similarity_matrix(process_grad(update)[np.newaxis, :], V)[0]
+            c.update_difference(list(zip(self.group_list, diff)))
+            best = np.sort(diff)
+            if hit and (len(best) < 2 or best[1] - best[0] < self.recluster_margin):
+                c.group = None
+                uncertain.append(c)
+            else:
+                c.set_group(self.group_list[np.argmin(diff)])
+        print('Recluster: {} clustering clients, {} re-cold-started of {} warm clients'.format(
+            len(selected_clients), len(uncertain), len(warm_clients)))
+        for c in uncertain: # Pre-trained again by the cold start
+            self.update_cache.pop(c, None)
+            self.sketch_cache.pop(c, None)
+        self.clients_cold_start(uncertain, run_mode='FedGroup')
+        warm = set(warm_clients)
+        self.update_cache = OrderedDict((c, v) for c, v in self.update_cache.items() if c in warm)
+        self.sketch_cache = {c: v for c, v in self.sketch_cache.items() if c in warm}
         return
 
+    """ Sample the clients to pre-train for clustering.
+        With index_sampling, the clients are divided into num_group strata by
+        KMeans on the label distributions and feature means of the client
+        index (no client data is read), then picked from the strata in turn,
+        so that small modes of the data distribution are represented. If the
+        index does not cover the clients, they are sampled uniformly.
+    """
+    def sample_clustering_clients(self, clients, k):
+        if self.index_sampling == False or k >= len(clients):
+            return random.sample(clients, k=k)
+        index = self.client_index
+        if not index.covers([c.id for c in clients]):
+            print('Warning: the client index does not cover the clients, sampling them uniformly')
+            return random.sample(clients, k=k)
+        descriptors = index.descriptors(index.rows_of([c.id for c in clients]))
+        n_strata = min(self.num_group, len(clients))
+        strata = KMeans(n_clusters=n_strata, n_init=10, random_state=self.sklearn_seed).fit_predict(descriptors)
+        members = [[c for c, s in zip(clients, strata) if s == i] for i in range(n_strata)]
+        for m in members: random.shuffle(m)
+        selected = []
+        while len(selected) < k:
+            for m in members:
+                if len(m) > 0 and len(selected) < k:
+                    selected.append(m.pop())
+        return selected
+
     def reassign_warm_clients(self):
         warm_clients = [c for c in self.clients if c.is_cold() == False]
         for c in warm_clients:
             c.group = None
-            self.client_cold_start(c, self.run_mode)
+        self.clients_cold_start(warm_clients, self.run_mode)
         return
 
+    def create_clustering_backend(self, n_clusters, max_iter=20):
+        measure = self.clustering_measure or ('MADC' if self.MADC == True else 'EDC')
+        algorithm = self.clustering_algorithm or ('agglomerative' if measure == 'MADC' else 'kmeans')
+        return ClusteringBackend(n_clusters, measure, algorithm,
+            n_components=self.num_group, sketch_size=self.sketch_size if self.sketch_svd == True else None,
+            madc_budget=int(self.madc_budget * 2**20), madc_workers=self.madc_workers,
+            seed=self.sklearn_seed, max_iter=max_iter)
+
     """ Clustering clients by Clustering Algorithm """
-    def clustering_clients(self, clients, n_clusters=None, max_iter=20):
+    def clustering_clients(self, clients, n_clusters=None, max_iter=20, init_groups=None):
+        """ The clustering is a measure x an algorithm (see utils/clustering.py),
+            with init_groups, kmeans on EDC (mini-batch) starts from the updates
+            of these groups (cluster i from init_groups[i]), the labels of the
+            other backends are arbitrary
+        """
         if n_clusters is None: n_clusters = self.num_group
         # Pre-train these clients first
-        csolns, cupdates = {}, {}
         
         # The updates for clustering must be calculated upon a same model
         # We use the global auxiliary(AVG) model as start point
         self.client_model.set_params(self.latest_model)
 
+        # Only the measure of the clustering backend is computed, the updates are
+        # written to its disk-backed store (and sketched) while the clients are
+        # pre-trained, no client update is kept in memory
+        backend = self.create_clustering_backend(n_clusters, max_iter)
+        backend.start(self.latest_model.size, len(clients))
+
         # Record the execution time
         start_time = time.time()
+        reused = 0
         for c in clients:
-            csolns[c], cupdates[c] = self.pre_train_client(c)
+            if self.incremental_recluster == True:
+                _, update, hit = self.pre_train_cached(c)
+                reused += hit
+            else:
+                _, update = self.pre_train_client(c)
+            backend.add(process_grad(update))
         print("Pre-training takes {}s seconds".format(time.time()-start_time))
+        if self.incremental_recluster == True:
+            print("Reused {} cached updates of {} clients".format(reused, len(clients)))
 
-        update_array = [process_grad(update) for update in cupdates.values()]
-        delta_w = np.vstack(update_array) # shape=(n_clients, n_params)
-        
-        # Record the execution time
-        start_time = time.time()
-        # Decomposed the directions of updates to num_group of directional vectors
-        svd = TruncatedSVD(n_components=self.num_group, random_state=self.sklearn_seed)
-        decomp_updates = svd.fit_transform(delta_w.T) # shape=(n_params, n_groups)
-        print("SVD takes {}s seconds".format(time.time()-start_time))
-        n_components = decomp_updates.shape[-1]
-
-        # Record the execution time of EDC calculation
-        start_time = time.time()
-        decomposed_cossim_matrix = cosine_similarity(delta_w, decomp_updates.T) # shape=(n_clients, n_clients)
-
-        ''' There is no need to normalize the data-driven measure because it is a dissimilarity measure
-        # Normialize it to dissimilarity [0,1]
-        decomposed_dissim_matrix = (1.0 - decomposed_cossim_matrix) / 2.0
-        EDC = decomposed_dissim_matrix
-        '''
-        #EDC = self._calculate_data_driven_measure(decomposed_cossim_matrix, correction=False)
-        print("EDC Matrix calculation takes {}s seconds".format(time.time()-start_time))
-        
-        # Test the excution time of full cosine dissimilarity
-        start_time = time.time()
-        full_cossim_matrix = cosine_similarity(delta_w) # shape=(n_clients, n_clients)
-        '''
-        # Normialize cossim to [0,1]
-        full_dissim_matrix = (1.0 - full_cossim_matrix) / 2.0
-        '''
-        MADC = self._calculate_data_driven_measure(full_cossim_matrix, correction=True) # shape=(n_clients, n_clients)
-        #MADC = full_dissim_matrix
-        print("MADC Matrix calculation takes {}s seconds".format(time.time()-start_time))
-
-        '''Apply RBF kernel to EDC or MADC
-        gamma=0.2
-        if self.MADC == True:
-            affinity_matrix = np.exp(- MADC ** 2 / (2. * gamma ** 2))
-        else: # Use EDC as default
-            affinity_matrix = np.exp(- EDC ** 2 / (2. * gamma ** 2))
-        '''
-        # Record the execution time
-        start_time = time.time()
-        if self.MADC == True:
-            affinity_matrix = MADC
-            #affinity_matrix = (1.0 - full_cossim_matrix) / 2.0
-            #result = AgglomerativeClustering(n_clusters, affinity='euclidean', linkage='ward').fit(full_cossim_matrix)
-            result = AgglomerativeClustering(n_clusters, affinity='precomputed', linkage='complete').fit(affinity_matrix)
-        else: # Use EDC as default
-            affinity_matrix = decomposed_cossim_matrix
-            #result = AgglomerativeClustering(n_clusters, affinity='euclidean', linkage='ward').fit(decomposed_cossim_matrix)
-            #result = AgglomerativeClustering(n_clusters, affinity='precomputed', linkage='average').fit(EDC)
-            result = KMeans(n_clusters, random_state=self.sklearn_seed, max_iter=max_iter).fit(affinity_matrix)
-        #print('EDC', EDC[0][:10], '\nMADC', MADC[0][:10], '\naffinity', affinity_matrix[0][:10])
-        #result = SpectralClustering(n_clusters, random_state=self.sklearn_seed, n_init=max_iter, affinity='precomputed').fit(affinity_matrix)
-
-        print("Clustering takes {}s seconds".format(time.time()-start_time))
-        print('Clustering Results:', Counter(result.labels_))
-        #print('Clustering Inertia:', result.inertia_)
+        init_updates = None
+        if init_groups is not None:
+            init_updates = [process_grad(g.latest_update) for g in init_groups]
+        labels = backend.fit(init_updates)
+        for step, seconds in backend.timings:
+            print("{} takes {}s seconds".format(step, seconds))
+        print('Clustering Results:', Counter(labels))
 
         cluster = {} # {Cluster ID: (avg_soln, avg_update, [c1, c2, ...])}
         cluster2clients = [[] for _ in range(n_clusters)] # [[c1, c2,...], [c3, c4,...], ...]
-        for idx, cluster_id in enumerate(result.labels_):
+        cluster2rows = [[] for _ in range(n_clusters)] # Rows of the clients in the backend
+        for idx, cluster_id in enumerate(labels):
             #print(idx, cluster_id, len(cluster2clients), n_clusters) # debug
             cluster2clients[cluster_id].append(clients[idx])
+            cluster2rows[cluster_id].append(idx)
+        shapes = self.latest_model.shapes
         for cluster_id, client_list in enumerate(cluster2clients):
             # calculate the means of cluster
-            # All client have equal weight
-            average_csolns = [(1, csolns[c]) for c in client_list]
-            average_updates = [(1, cupdates[c]) for c in client_list]
-            if average_csolns:
-                # Update the cluster means
-                cluster[cluster_id] = (self.aggregate(average_csolns), self.aggregate(average_updates), client_list)
+            # All client have equal weight, the updates are read back one at a time
+            if client_list:
+                # Update the cluster means, the mean solution is the start
+                # model plus the mean update (soln = latest_model + update)
+                average_update = self.aggregate((1, ParamVector(backend.update(idx), shapes)) for idx in cluster2rows[cluster_id])
+                cluster[cluster_id] = (self.latest_model + average_update, average_update, client_list)
             else:
                 print("Error, cluster is empty")
+        backend.close()
 
         return cluster
 
@@ -401,6 +552,47 @@ class Server(BaseFedarated):
         
         return average_diffs
 
+    """ Pre-train the client, or reuse its cached update if the global AVG model
+        moved less than recluster_tolerance since, the cached update is then
+        applied to the current global model. Returns (ws, updates, reused)
+    """
+    def pre_train_cached(self, client):
+        if client in self.update_cache:
+            cached_base, updates = self.update_cache[client]
+            if self.base_moved(cached_base) < self.recluster_tolerance:
+                self.update_cache.move_to_end(client)
+                return self.latest_model + updates, updates, True
+        ws, updates = self.pre_train_client(client)
+        self.cache_update(client, updates)
+        return ws, updates, False
+
+    """ Cache the sketch of the update of the client pre-trained on the global
+        AVG model, and with full, the update itself (the least recently used
+        full updates are dropped beyond recluster_cache). The base is the
+        global model itself, which is replaced and never modified in place.
+    """
+    def cache_update(self, client, updates, full=True):
+        if full == True:
+            self.update_cache[client] = (self.latest_model, updates)
+            self.update_cache.move_to_end(client)
+            while len(self.update_cache) > self.recluster_cache:
+                self.update_cache.popitem(last=False)
+        w = process_grad(updates)
+        y = self.get_update_sketch().sketch(w).astype(np.float32)
+        self.sketch_cache[client] = (self.latest_model, y, np.linalg.norm(w.astype(np.float64)))
+
+    def get_update_sketch(self):
+        if self.update_sketch is None:
+            self.update_sketch = CountSketch(self.latest_model.size, self.sketch_size, seed=self.sklearn_seed)
+        return self.update_sketch
+
+    """ The distance of the global AVG model to base, relative to the norm of base """
+    def base_moved(self, base):
+        if base is self.latest_model:
+            return 0.
+        base = process_grad(base)
+        return np.linalg.norm(process_grad(self.latest_model) - base) / max(np.linalg.norm(base), 1e-12)
+
     """ Pre-train the client 1 epoch and return weights,
         Train the client upon the global AVG model.
     """
@@ -416,7 +608,7 @@ class Server(BaseFedarated):
         soln, stat = client.solve_iters(50)
 
         ws = soln[1] # weights of model
-        updates = [w1-w0 for w0, w1 in zip(self.latest_model, ws)]
+        updates = ws - self.latest_model
 
         self.client_model.set_params(start_model) # Recovery the model
         return ws, updates
@@ -476,9 +668,7 @@ class Server(BaseFedarated):
 
         # Clients cold start, pre-train all clients
         start_time = time.time()
-        for c in self.clients:
-                if c.is_cold() == True:
-                    self.client_cold_start(c, self.run_mode)
+        self.clients_cold_start([c for c in self.clients if c.is_cold() == True], self.run_mode)
         print("Cold start clients takes {}s seconds".format(time.time()-start_time))
 
         for i in range(self.num_rounds):
@@ -494,9 +684,7 @@ class Server(BaseFedarated):
             # Reshcedule selected clients to groups, add client to group's client list
             if self.run_mode == 'FedGroup':
                 # Cold start the newcomer
-                for c in selected_clients:
-                    if c.is_cold() == True:
-                        self.client_cold_start(c, self.run_mode)
+                self.clients_cold_start([c for c in selected_clients if c.is_cold() == True], self.run_mode)
                 # Reschedule the group
                 self.reschedule_groups(selected_clients, self.allow_empty, self.evenly, self.RAC)
             else: # IFCA and FeSEM need rescheduling client in each round
@@ -619,7 +807,7 @@ class Server(BaseFedarated):
         for g in groups:
             gsolns.append((1.0, g.latest_model)) # (n_k, soln)
         new_model = self.aggregate(gsolns)
-        self.latest_update = [w1-w0 for w0, w1 in zip(start_model, new_model)]
+        self.latest_update = new_model - start_model
         self.latest_model = new_model
 
         return
@@ -649,27 +837,20 @@ class Server(BaseFedarated):
                     print(f'Client {c.id} migrates from Group {old_group.id} to Group {c.group.id}!')
 
     def aggregate_groups(self, groups, agg_lr):
-        gsolns = [(sum(g.num_samples), g.latest_model) for g in groups]
-        group_num = len(gsolns)
+        group_num = len(groups)
         # Calculate the scale of group models
-        gscale = [0]*group_num
-        for i, (_, gsoln) in enumerate(gsolns):
-            for v in gsoln:
-                gscale[i] += np.sum(v.astype(np.float64)**2)
-            gscale[i] = gscale[i]**0.5
-        # Aggregate the models of each group separately
-        for idx, g in enumerate(groups):
-            base = [0]*len(gsolns[idx][1])
-            weights = [agg_lr*(1.0/scale) for scale in gscale]
-            weights[idx] = 1 # The weight of the main group is 1
-            total_weights = sum(weights)
-            for j, (_, gsoln) in enumerate(gsolns):
-                for k, v in enumerate(gsoln):
-                    base[k] += weights[j]*v.astype(np.float64)
-            averaged_soln = [v / total_weights for v in base]
+        gscale = np.array([np.sum(g.latest_model.flat.astype(np.float64)**2)**0.5 for g in groups])
+        # Weight matrix of inter-group aggregation, W[i, j] is the weight of group j for group i
+        weights = np.tile(agg_lr*(1.0/gscale), (group_num, 1))
+        np.fill_diagonal(weights, 1) # The weight of the main group is 1
+        # Aggregate the models of all groups in one matrix-weighted reduction
+        aggregator = Aggregator(num_outputs=group_num, precision=self.agg_precision)
+        for j, g in enumerate(groups):
+            aggregator.add(g.latest_model, weights[:, j])
+        for g, averaged_soln in zip(groups, aggregator.result()):
             # Note: The latest_update accumulated from last fedavg training
-            inter_aggregation_update = [w1-w0 for w0, w1 in zip(g.latest_model, averaged_soln)]
-            g.latest_update = [up0+up1 for up0, up1 in zip(g.latest_update, inter_aggregation_update)]
+            inter_aggregation_update = averaged_soln - g.latest_model
+            g.latest_update = g.latest_update + inter_aggregation_update
             g.latest_model = averaged_soln
 
         return
@@ -777,10 +958,112 @@ class Server(BaseFedarated):
 
     """ Reschedule function of IFCA, assign selected client according to training loss
     """
+    """ The training loss of every group model on every client,
+        shape=(n_clients, n_groups), each group model is loaded once
+    """
+    def IFCA_group_losses(self, clients):
+        batches = self.IFCA_batch_losses([(c, [None]) for c in clients])
+        return np.array([losses[0] for losses in batches])
+
+    """ The training loss of every group model on minibatches of clients,
+        requests: list of (client, [rows, ...]), rows=None for all the data
+        Return: list of arrays, shape=(n_batches, n_groups)
+    """
+    def IFCA_batch_losses(self, requests):
+        def _batch(data, rows):
+            return data if rows is None else {'x': data['x'][rows], 'y': data['y'][rows]}
+
+        if self.ifca_heads is not None:
+            # Load the group models that have changed into the heads
+            for idx, g in enumerate(self.group_list):
+                if self.ifca_loaded[idx] is not g.latest_model:
+                    self.ifca_heads.set_row(idx, g.latest_model)
+                    self.ifca_loaded[idx] = g.latest_model
+            results = []
+            for c, batches in requests:
+                data = c.train_data
+                results.append(np.array([self.ifca_heads.test_heads(_batch(data, rows)) for rows in batches]))
+            return results
+
+        # Models without create_loss(): one parameter load per group model
+        results = [np.zeros((len(batches), len(self.group_list)), dtype=np.float32) for _, batches in requests]
+        backup_params = self.client_model.get_params()
+        for idx, g in enumerate(self.group_list):
+            # Note: use group model for evaluation
+            self.client_model.set_params(g.latest_model)
+            for (c, batches), losses in zip(requests, results):
+                data = c.train_data
+                for bidx, rows in enumerate(batches):
+                    _, losses[bidx, idx] = c.model.test(_batch(data, rows))
+        # Restore paramters
+        self.client_model.set_params(backup_params)
+        return results
+
+    """ Estimate the IFCA losses on random minibatches of batch_size samples,
+        the number of minibatches doubles at every stage. The evaluation of a
+        client stops when, for every other group, the mean difference of the
+        minibatch losses to the best group exceeds its one-sided confidence
+        bound (Bonferroni over the groups, finite population corrected).
+        Return: the estimated losses (n_clients, n_groups), the samples used
+    """
+    def IFCA_estimate_losses(self, clients):
+        n_groups = len(self.group_list)
+        z = norm.ppf(1.0 - (1.0 - self.ifca_confidence) / max(n_groups - 1, 1))
+        orders = [self.ifca_rng.permutation(c.num_samples) for c in clients]
+        observed = [[] for _ in clients] # minibatch losses of each client
+        sizes = [[] for _ in clients] # minibatch sizes of each client
+        used = np.zeros(len(clients), dtype=np.int64)
+        undecided, n_batches = list(range(len(clients))), 1
+        while len(undecided) > 0:
+            requests = []
+            for cidx in undecided:
+                stop = min(used[cidx] + n_batches * self.batch_size, clients[cidx].num_samples)
+                rows = orders[cidx][used[cidx]:stop]
+                requests.append((clients[cidx], [rows[i:i+self.batch_size] for i in range(0, len(rows), self.batch_size)]))
+                used[cidx] = stop
+            for cidx, (_, batches), losses in zip(undecided, requests, self.IFCA_batch_losses(requests)):
+                observed[cidx].extend(losses)
+                sizes[cidx].extend([len(rows) for rows in batches])
+
+            still_undecided = []
+            for cidx in undecided:
+                n, losses = clients[cidx].num_samples, np.array(observed[cidx])
+                if used[cidx] >= n or len(losses) == 0:
+                    continue
+                if used[cidx] < self.ifca_min_samples or len(losses) < 2:
+                    still_undecided.append(cidx)
+                    continue
+                lead = np.argmin(losses.mean(axis=0))
+                diffs = np.delete(losses - losses[:, [lead]], lead, axis=1) # shape=(n_batches, n_groups-1)
+                fpc = np.sqrt(max(n - used[cidx], 0) / max(n - 1, 1))
+                bound = z * diffs.std(axis=0, ddof=1) / np.sqrt(len(losses)) * fpc
+                if np.any(diffs.mean(axis=0) <= bound):
+                    still_undecided.append(cidx)
+            undecided, n_batches = still_undecided, n_batches * 2
+
+        # Weighted by the minibatch sizes, the full training loss when all samples are used
+        estimates = np.array([np.average(losses, axis=0, weights=w) if len(losses) > 0 else np.zeros(n_groups)
+            for losses, w in zip(observed, sizes)])
+        return estimates, used
+
     def IFCA_reschedule_group(self, selected_clients):
-        for c in selected_clients:
+        if self.ifca_subsample == True:
+            losses, used = self.IFCA_estimate_losses(selected_clients)
+            total = sum([c.num_samples for c in selected_clients])
+            print('IFCA estimation uses {} of {} samples ({:.1%})'.format(used.sum(), total, used.sum() / max(total, 1)))
+            if self.ifca_audit > 0 and self.ifca_rounds % self.ifca_audit == 0:
+                full_losses = self.IFCA_group_losses(selected_clients)
+                disagree = np.sum(np.argmin(losses, axis=1) != np.argmin(full_losses, axis=1))
+                print('IFCA estimation disagrees with the full evaluation on {} of {} clients'.format(
+                    disagree, len(selected_clients)))
+            self.ifca_rounds += 1
+        else:
+            losses = self.IFCA_group_losses(selected_clients)
+
+        for c, loss in zip(selected_clients, losses):
             # IFCA assign client to group with minium training loss
-            diff_list, assign_group = self.get_assign_group(c, run_mode='IFCA')
+            diff_list = list(zip(self.group_list, loss))
+            assign_group = self.group_list[np.argmin(loss)]
             c.set_group(assign_group)
             c.update_difference(diff_list)
             # Add client to group's client list
@@ -789,10 +1072,30 @@ class Server(BaseFedarated):
 
     """ Similar to IFCA, get_assign_group() can handle well
     """
+    """ The squared Euclidean distances between the local models of clients
+        and the group models, shape=(n_clients, n_groups), from
+        ||a-b||^2 = ||a||^2 + ||b||^2 - 2a.b with one matmul
+    """
+    def FeSEM_distances(self, clients):
+        models = [g.latest_model for g in self.group_list]
+        if self.fesem_models is None or any(a is not b for a, b in zip(models, self.fesem_models)):
+            B = np.vstack([process_grad(m) for m in models]).astype(np.float32, copy=False) # shape=(n_groups, n_params)
+            # Centered on the mean group model, the norms stay small and the identity loses little precision
+            center = B.mean(axis=0)
+            B -= center
+            self.fesem_models, self.fesem_matrix = models, (B, center, np.einsum('ij,ij->i', B, B))
+        B, center, B_norms = self.fesem_matrix
+        A = np.vstack([process_grad(c.local_model) for c in clients]).astype(np.float32, copy=False) # shape=(n_clients, n_params)
+        A -= center
+        dists = np.einsum('ij,ij->i', A, A)[:, np.newaxis] + B_norms[np.newaxis, :] - 2 * A.dot(B.T)
+        return np.maximum(dists, 0)
+
     def FeSEM_reschedule_group(self, selected_clients):
-        for c in selected_clients:
-            # IFCA assign client to group with minium training loss
-            diff_list, assign_group = self.get_assign_group(c, run_mode='FeSEM')
+        dists = self.FeSEM_distances(selected_clients)
+        for c, dist in zip(selected_clients, dists):
+            # FeSEM assign client to group with minium distance
+            diff_list = list(zip(self.group_list, dist))
+            assign_group = self.group_list[np.argmin(dist)]
             c.set_group(assign_group)
             c.update_difference(diff_list)
             # Add client to group's client list
@@ -803,62 +1106,8 @@ class Server(BaseFedarated):
         ''' calculate the data-driven measure such as MADD'''
         # Input: pm-> proximity matrix; Output: dm-> data-driven distance matrix
         # pm.shape=(n_clients, n_dims), dm.shape=(n_clients, n_clients)
-        n_clients, n_dims = pm.shape[0], pm.shape[1]
-        dm = np.zeros(shape=(n_clients, n_clients))
-        
-        """ Too Slow, and misunderstanding MADD. Deprecated
-        for i in range(n_clients):
-            for j in range(i+1, n_clients):
-                for k in range(n_clients):
-                    if k !=i and k != j:
-                        dm[i,j] = dm[j,i] = abs(np.sum((pm[i]-pm[k])**2)**0.5 - \
-                            np.sum((pm[j]-pm[k])**2)**0.5)
-        """
-        # Fast version
-        '''1, Get the repeated proximity matrix.
-            We write Row1 = d11, d12, d13, ... ; and Row2 = d21, d22, d23, ...
-            [   Row1    ]   [   Row2    ]       [   Rown    ]
-            |   Row1    |   |   Row2    |       |   Rown    |
-            |   ...     |   |   ...     |       |   ...     |
-            [   Row1    ],  [   Row2    ], ..., [   Rown    ]
-        '''
-        row_pm_matrix = np.repeat(pm[:,np.newaxis,:], n_clients, axis=1)
-        #print('row_pm', row_pm_matrix[0][0][:5], row_pm_matrix[0][1][:5])
-
-        # Get the repeated colum proximity matrix
-        '''
-            [   Row1    ]   [   Row1    ]       [   Row1    ]
-            |   Row2    |   |   Row2    |       |   Row2    |
-            |   ...     |   |   ...     |       |   ...     |
-            [   Rown    ],  [   Rown    ], ..., [   Rown    ]
-        '''
-        col_pm_matrix = np.tile(pm, (n_clients, 1, 1))
-        #print('col_pm', col_pm_matrix[0][0][:5], col_pm_matrix[0][1][:5])
-        
-        # Calculate the absolute difference of two disstance matrix, It is 'abs(||u-z|| - ||v-z||)' in MADD.
-        # d(1,2) = ||w1-z|| - ||w2-z||, shape=(n_clients,); d(x,x) always equal 0
-        '''
-            [   d(1,1)  ]   [   d(1,2)  ]       [   d(1,n)  ]
-            |   d(2,1)  |   |   d(2,2)  |       |   d(2,n)  |
-            |   ...     |   |   ...     |       |   ...     |
-            [   d(n,1)  ],  [   d(n,2)  ], ..., [   d(n,n)  ]
-        '''
-        absdiff_pm_matrix = np.abs(col_pm_matrix - row_pm_matrix) # shape=(n_clients, n_clients, n_clients)
-        # Calculate the sum of absolute differences
-        if correction == True:
-            # We should mask these values like sim(1,2), sim(2,1) in d(1,2)
-            mask = np.zeros(shape=(n_clients, n_clients))
-            np.fill_diagonal(mask, 1) # Mask all diag
-            mask = np.repeat(mask[np.newaxis,:,:], n_clients, axis=0)
-            for idx in range(mask.shape[-1]):
-                #mask[idx,idx,:] = 1 # Mask all row d(1,1), d(2,2)...; Actually d(1,1)=d(2,2)=0
-                mask[idx,:,idx] = 1 # Mask all 0->n colum for 0->n diff matrix,
-            dm = np.sum(np.ma.array(absdiff_pm_matrix, mask=mask), axis=-1) / (n_dims-2.0)
-        else:
-            dm = np.sum(absdiff_pm_matrix, axis=-1) / (n_dims)
-        #print('absdiff_pm_matrix', absdiff_pm_matrix[0][0][:5])
-
-        return dm # shape=(n_clients, n_clients)
+        # Computed in blocks of rows, see flearn/utils/madc.py
+        return data_driven_measure(pm, correction, budget=int(self.madc_budget * 2**20), num_workers=self.madc_workers)
 
     def test_ternary_cosine_similariy(self, alpha=20):
         ''' compare the ternary similarity and cosine similarity '''
@@ -0,0 +1,101 @@
+import numpy as np
+
+from flearn.utils.param_vector import ParamVector, as_param_vector
+
+PRECISIONS = ['float64', 'kahan']
+
+
+class Aggregator(object):
+    '''Streaming matrix-weighted aggregation of model solutions
+
+    Solutions are folded one at a time into a preallocated accumulator, so
+    the peak memory is O(num_outputs * model) no matter how many solutions
+    are aggregated. Output k is
+
+        sum_j W[k, j] * soln_j / sum_j W[k, j]
+
+    where the column W[:, j] is the weight passed with the j-th solution.
+    Weighted FedAvg (W = n_k), uniform averaging (W = 1) and FedGroup's
+    inter-group aggregation (W = agg_lr / ||w_j||, diag = 1) are all
+    instances of this reduction.
+
+    precision:
+        'float64': accumulate in a float64 buffer (default, same as before)
+        'kahan': float32 buffers with Kahan compensated summation, half of
+            the accumulator memory with float64-like accuracy
+    '''
+
+    def __init__(self, num_outputs=1, precision='float64'):
+        if precision not in PRECISIONS:
+            raise ValueError('Unknown aggregation precision {}, should be one of {}'.format(precision, PRECISIONS))
+        self.num_outputs = num_outputs
+        self.precision = precision
+        self.total_weight = np.zeros(num_outputs, dtype=np.float64)
+        self.count = 0 # number of added solutions
+        self.shapes = None
+        self.acc, self.comp = None, None
+        self._buf, self._tmp = None, None
+
+    def _allocate(self, soln):
+        self.shapes = soln.shapes
+        if self.precision == 'float64':
+            self.acc = np.zeros((self.num_outputs, soln.size), dtype=np.float64)
+            self._buf = np.empty(soln.size, dtype=np.float64)
+        else:
+            self.acc = np.zeros((self.num_outputs, soln.size), dtype=np.float32)
+            self.comp = np.zeros((self.num_outputs, soln.size), dtype=np.float32)
+            self._buf = np.empty(soln.size, dtype=np.float32)
+            self._tmp = np.empty(soln.size, dtype=np.float32)
+
+    def add(self, soln, weight=1.0):
+        '''Folds one solution into the accumulator
+
+        Args:
+            soln: ParamVector (or list of per-layer arrays)
+            weight: scalar weight, or the column of weights (num_outputs,)
+        '''
+        soln = as_param_vector(soln)
+        if self.acc is None:
+            self._allocate(soln)
+        elif soln.size != self.acc.shape[1]:
+            raise ValueError('Solution size {} does not match accumulator size {}'.format(soln.size, self.acc.shape[1]))
+        weights = np.broadcast_to(np.asarray(weight, dtype=np.float64), (self.num_outputs,))
+
+        for k, w in enumerate(weights):
+            if w == 0:
+                continue
+            if self.precision == 'float64':
+                np.multiply(soln.flat, w, out=self._buf)
+                self.acc[k] += self._buf
+            else:
+                # Kahan summation: y = w*s - c; t = acc + y; c = (t - acc) - y; acc = t
+                y, t = self._buf, self._tmp
+                np.multiply(soln.flat, np.float32(w), out=y)
+                y -= self.comp[k]
+                np.add(self.acc[k], y, out=t)
+                np.subtract(t, self.acc[k], out=self.comp[k])
+                self.comp[k] -= y
+                self.acc[k] = t
+        self.total_weight += weights
+        self.count += 1
+
+    def result(self):
+        '''Returns the list of num_outputs averaged ParamVectors
+
+        The average is accumulated in float64 (or Kahan float32) but, as a
+        ParamVector, rounded once to float32. Before ParamVector the averaged
+        layers stayed float64 arrays, which were rounded to float32 only when
+        loaded into the (float32) model: numpy arithmetic on an average, e.g.
+        the discrepancy of a client model to it, now sees the rounded values.
+        '''
+        if self.acc is None:
+            raise ValueError('No solution has been added to the aggregator')
+        return [ParamVector(self.acc[k] / self.total_weight[k], self.shapes) for k in range(self.num_outputs)]
+
+
+def weighted_average(wsolns, precision='float64'):
+    '''Averages [(weight, soln), ...] into one ParamVector'''
+    agg = Aggregator(precision=precision)
+    for (w, soln) in wsolns:
+        agg.add(soln, w)
+    return agg.result()[0]
@@ -0,0 +1,72 @@
+import itertools
+from collections import OrderedDict
+
+
+class ClientDataCache(object):
+    '''Process-wide LRU cache of the clients' data arrays
+
+    Client keeps a handle to the source of its data (json lists or memory
+    maps of a dataset cache) and materializes the arrays through get() on
+    first use. When the arrays of the resident clients exceed budget bytes,
+    the least recently used are evicted and loaded again when needed.
+
+    budget: bytes, None for no limit (every touched client stays resident)
+    '''
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.entries = OrderedDict() # {key: (data, nbytes)}, least recently used first
+        self.nbytes = 0 # bytes of the resident entries
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self._keys = itertools.count()
+
+    def new_key(self):
+        '''Returns a key that is unique in the process'''
+        return next(self._keys)
+
+    def set_budget(self, budget=None):
+        self.budget = budget
+        self._evict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, load):
+        '''Returns the data of key, calling load() to materialize it on a miss
+
+        load() returns a dict of numpy arrays
+        '''
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.misses += 1
+        data = load()
+        nbytes = sum(v.nbytes for v in data.values())
+        self.entries[key] = (data, nbytes)
+        self.nbytes += nbytes
+        self._evict(keep=key)
+        return data
+
+    def discard(self, key):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+
+    def _evict(self, keep=None):
+        if self.budget is None:
+            return
+        while self.nbytes > self.budget and len(self.entries) > 0:
+            key = next(iter(self.entries))
+            if key == keep:
+                break # Never evict the data that is being returned
+            self.discard(key)
+            self.evictions += 1
+
+    def stats(self):
+        return {'resident': len(self.entries), 'bytes': self.nbytes,
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# The cache of all clients of the process
+DATA_CACHE = ClientDataCache()
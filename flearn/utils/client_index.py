@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+
+''' Per-client metadata index of a dataset, stored as index.npz next to the
+    dataset cache (see dataset_cache.py):
+    clients: client ids
+    num_train, num_test: number of samples of each client
+    labels: the distinct train labels, the columns of label_hist
+    label_hist: (num_clients, num_labels) train label counts
+    feature_mean: (num_clients, num_features) mean of the flattened train
+        features, only for numeric features
+    feature_var: (num_clients,) mean variance of the train features, only for
+        numeric features
+'''
+INDEX = 'index.npz'
+
+
+class ClientIndex(object):
+    '''Sizes, label histograms and feature moments of the clients, usable
+    without loading any client data
+    '''
+
+    def __init__(self, clients, num_train, num_test, labels, label_hist, feature_mean=None, feature_var=None):
+        self.clients = list(clients)
+        self.num_train = np.asarray(num_train, dtype=np.int64)
+        self.num_test = np.asarray(num_test, dtype=np.int64)
+        self.labels = np.asarray(labels)
+        self.label_hist = np.asarray(label_hist, dtype=np.int64).reshape(len(self.clients), len(self.labels))
+        self.feature_mean = feature_mean
+        self.feature_var = feature_var
+        self.rows = {c: i for i, c in enumerate(self.clients)}
+
+    def covers(self, clients):
+        '''Returns whether all the given client ids are in the index'''
+        return all(c in self.rows for c in clients)
+
+    def rows_of(self, clients):
+        '''Returns the rows of the given client ids, raises a ValueError naming
+        the ids that are not in the index (e.g. clients added after it was
+        built or removed by utils/remove_users.py)
+        '''
+        missing = [c for c in clients if c not in self.rows]
+        if missing:
+            raise ValueError('{} clients are not in the client index, rebuild it: {}'.format(len(missing),
+                ', '.join(str(c) for c in missing[:10]) + (', ...' if len(missing) > 10 else '')))
+        return np.array([self.rows[c] for c in clients], dtype=np.int64)
+
+    def label_distribution(self, rows=None):
+        '''Returns the label histograms normalized to sum to 1 (0 for clients without samples)'''
+        hist = self.label_hist if rows is None else self.label_hist[rows]
+        total = hist.sum(axis=1, keepdims=True)
+        return hist / np.maximum(total, 1)
+
+    def descriptors(self, rows=None):
+        '''Returns a vector per client for clustering heuristics: the label
+        distribution and, for numeric features, the standardized feature means
+        '''
+        desc = [self.label_distribution(rows)]
+        if self.feature_mean is not None:
+            mean = self.feature_mean if rows is None else self.feature_mean[rows]
+            std = self.feature_mean.std(axis=0)
+            desc.append((mean - self.feature_mean.mean(axis=0)) / np.where(std > 0, std, 1))
+        return np.hstack(desc)
+
+    def save(self, cache_dir):
+        arrays = {'clients': np.array(self.clients, dtype=str), 'num_train': self.num_train, 'num_test': self.num_test,
+            'labels': self.labels, 'label_hist': self.label_hist}
+        if self.feature_mean is not None:
+            arrays['feature_mean'] = self.feature_mean
+            arrays['feature_var'] = self.feature_var
+        path = os.path.join(cache_dir, INDEX)
+        with open(path + '.tmp', 'wb') as ouf:
+            np.savez(ouf, **arrays)
+        os.replace(path + '.tmp', path)
+
+
+def load_index(cache_dir):
+    '''Returns the ClientIndex of a cache directory, None if it has none'''
+    path = os.path.join(cache_dir, INDEX)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as index:
+        return ClientIndex(index['clients'].tolist(), index['num_train'], index['num_test'], index['labels'],
+            index['label_hist'], index['feature_mean'] if 'feature_mean' in index else None,
+            index['feature_var'] if 'feature_var' in index else None)
+
+
+class IndexBuilder(object):
+    '''Accumulates the metadata of the clients, a block of clients at a time'''
+
+    def __init__(self):
+        self.blocks = [] # (split, clients, counts, labels, label_hist, feature_mean, feature_var)
+        self.numeric = True
+
+    def add(self, split, client, x, y):
+        y = np.asarray(y)
+        self.add_many(split, [client], x, y, [len(y)])
+
+    def add_many(self, split, clients, x, y, counts):
+        '''Adds several clients, x and y are their samples concatenated in
+        the order of clients, counts the number of samples of each client
+        '''
+        x, y, counts = np.asarray(x), np.asarray(y), np.asarray(counts, dtype=np.int64)
+        labels, hist, mean, var = None, None, None, None
+        if split == 'train' and len(y) > 0:
+            rows = np.repeat(np.arange(len(clients)), counts)
+            labels, inverse = np.unique(y, return_inverse=True)
+            hist = np.bincount(rows * len(labels) + inverse.reshape(-1),
+                minlength=len(clients) * len(labels)).reshape(len(clients), len(labels))
+            if self.numeric and x.dtype.kind in 'biuf':
+                flat = x.reshape(len(x), -1).astype(np.float64)
+                nonempty = counts > 0
+                starts = (np.cumsum(counts) - counts)[nonempty]
+                n = counts[nonempty][:, None]
+                mean = np.zeros((len(clients), flat.shape[1]))
+                var = np.zeros(len(clients))
+                mean[nonempty] = np.add.reduceat(flat, starts, axis=0) / n
+                centered = flat - mean[rows]
+                var[nonempty] = (np.add.reduceat(centered * centered, starts, axis=0) / n).mean(axis=1)
+            else:
+                self.numeric = False
+        self.blocks.append((split, list(clients), counts, labels, hist, mean, var))
+
+    def extend(self, index):
+        '''Adds the clients of another ClientIndex'''
+        self.blocks.append(('train', index.clients, index.num_train, index.labels, index.label_hist,
+            index.feature_mean, index.feature_var))
+        self.blocks.append(('test', index.clients, index.num_test, None, None, None, None))
+        if index.feature_mean is None and index.num_train.sum() > 0:
+            self.numeric = False
+
+    def build(self, clients=None):
+        '''Returns the ClientIndex of clients (default: all clients added)'''
+        if clients is None:
+            clients = list(dict.fromkeys(c for block in self.blocks for c in block[1]))
+        rows = {c: i for i, c in enumerate(clients)}
+        counts = np.zeros((len(clients), 2), dtype=np.int64)
+        blocks = [b for b in self.blocks if b[4] is not None and b[4].size > 0]
+        labels = np.unique(np.concatenate([b[3] for b in blocks])) if len(blocks) > 0 else np.zeros(0, dtype=np.int64)
+        label_hist = np.zeros((len(clients), len(labels)), dtype=np.int64)
+        dims = {b[5].shape[1] for b in blocks if b[5] is not None}
+        feature_mean, feature_var = None, None
+        if self.numeric and len(dims) == 1:
+            feature_mean = np.zeros((len(clients), dims.pop()), dtype=np.float32)
+            feature_var = np.zeros(len(clients), dtype=np.float32)
+
+        for split, block_clients, block_counts, block_labels, hist, mean, var in self.blocks:
+            r = np.array([rows.get(c, -1) for c in block_clients], dtype=np.int64)
+            keep = r >= 0
+            np.add.at(counts[:, 0 if split == 'train' else 1], r[keep], block_counts[keep])
+            if hist is None or hist.size == 0:
+                continue
+            cols = np.searchsorted(labels, block_labels)
+            label_hist[np.ix_(r[keep], cols)] += hist[keep]
+            if feature_mean is not None and mean is not None:
+                keep = keep & (block_counts > 0)
+                feature_mean[r[keep]] = mean[keep]
+                feature_var[r[keep]] = var[keep]
+        return ClientIndex(clients, counts[:, 0], counts[:, 1], labels, label_hist, feature_mean, feature_var)
+
+
+def build_index(clients, train_data, test_data):
+    '''Computes the ClientIndex of a dataset in memory, e.g. read by read_data()'''
+    builder = IndexBuilder()
+    for c in clients:
+        for split, data in zip(['train', 'test'], [train_data, test_data]):
+            cdata = data.get(c, {'x': [], 'y': []})
+            builder.add(split, c, cdata['x'], cdata['y'])
+    return builder.build(clients)
@@ -0,0 +1,172 @@
+import multiprocessing as mp
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flearn.utils.param_vector import ParamVector
+
+''' A task sent to a worker process
+    model_version: version of the published start model
+    client_id: id of the client to train
+    num_epochs, batch_size: arguments of Client.solve_inner()
+    data_version: number of shuffles applied to the client's train_data before this task,
+        batch_data() shuffles with a fixed seed, so it seeds the data order of the task
+'''
+ClientTask = namedtuple('ClientTask', ['model_version', 'client_id', 'num_epochs', 'batch_size', 'data_version'])
+
+# The state of a worker process, set by _init_worker()
+_worker = {}
+
+
+def _init_worker(learner, model_params, prox, learning_rate, mu, seed, in_graph_loop, no_flops, flops_cache,
+        data_budget, batcher, train_data, shm_prefix):
+    import random
+    import tensorflow.compat.v1 as tf
+    tf.disable_v2_behavior()
+    tf.logging.set_verbosity(tf.logging.WARN)
+    from flearn.models.client import Client
+    from flearn.optimizer.pgd import PerturbedGradientDescent
+    from flearn.utils.tf_utils import set_flops_profiling
+    from flearn.utils.client_data import DATA_CACHE
+    from flearn.utils.model_utils import batch_seed
+
+    # Same seeds as main.py
+    random.seed(1 + seed)
+    np.random.seed(12 + seed)
+    tf.set_random_seed(123 + seed)
+
+    if prox == True:
+        inner_opt = PerturbedGradientDescent(learning_rate, mu)
+    else:
+        inner_opt = tf.train.GradientDescentOptimizer(learning_rate)
+    set_flops_profiling(not no_flops, flops_cache)
+    DATA_CACHE.set_budget(int(data_budget * 2**20) if data_budget > 0 else None)
+    tf.reset_default_graph()
+    model = learner(*model_params, inner_opt, seed)
+    if in_graph_loop:
+        model.build_epoch_loop(inner_opt)
+    empty_data = {'x': [], 'y': []}
+
+    _worker['model'] = model
+    _worker['inner_opt'] = inner_opt
+    _worker['prox'] = prox
+    _worker['shm_prefix'] = shm_prefix
+    _worker['version'], _worker['params'] = None, None
+    initial_params = model.get_params()
+    initial_params.flat.setflags(write=False)
+    _worker['clients'] = {cid: Client(cid, None, data, empty_data, model,
+        batch_seed(seed, cid) if batcher == 'buffered' else None, initial_params) for cid, data in train_data.items()}
+
+
+def _run_task(task):
+    model = _worker['model']
+    if task.model_version != _worker['version']:
+        # Fetch the new start model from shared memory
+        shm = shared_memory.SharedMemory(name='{}_{}'.format(_worker['shm_prefix'], task.model_version))
+        size = sum(model.param_sizes)
+        flat = np.ndarray((size,), dtype=np.float32, buffer=shm.buf).copy()
+        shm.close()
+        _worker['params'] = ParamVector(flat, model.param_shapes)
+        _worker['version'] = task.model_version
+        if _worker['prox'] == True:
+            # The proximal center is the start model, same as the sequential path
+            _worker['inner_opt'].set_params(_worker['params'], model)
+
+    c = _worker['clients'][task.client_id]
+    # Bring the local copy of train_data to the order the server expects
+    c.skip_inner(task.data_version - c.data_version)
+    c.set_params(_worker['params'])
+    return c.solve_inner(num_epochs=task.num_epochs, batch_size=task.batch_size)
+
+
+class ClientPool(object):
+    '''Trains clients in a pool of worker processes
+
+    Each worker builds its own Model graph and session once, and holds a
+    copy of the clients' training data. Start models are published to
+    shared memory under an integer version, a task only carries
+    (model_version, client_id, num_epochs, batch_size, data_version) and
+    the worker sends back the solution and stats of Client.solve_inner().
+
+    The results are bit-for-bit identical to the sequential path: the
+    server replays the data shuffles of every dispatched task on its own
+    copy (Client.skip_inner), so its data order and global numpy RNG stay
+    the same as if it had trained the client itself.
+    '''
+
+    def __init__(self, num_workers, learner, model_params, clients, prox, learning_rate, mu, seed, in_graph_loop=False,
+            no_flops=False, flops_cache=None, data_budget=0, batcher='inplace'):
+        self.shm_prefix = 'flearn_{}_{}'.format(mp.current_process().pid, id(self))
+        self.version = 0
+        self.shms = {} # {version: SharedMemory}
+        # The unshuffled sources, workers replay the shuffles of data_version
+        train_data = {c.id: c.train_source for c in clients}
+        ctx = mp.get_context('spawn') # TensorFlow is not fork-safe
+        self.pool = ctx.Pool(num_workers, initializer=_init_worker,
+            initargs=(learner, model_params, prox, learning_rate, mu, seed, in_graph_loop,
+                no_flops, flops_cache, data_budget, batcher, train_data, self.shm_prefix))
+
+    def publish(self, model):
+        '''Copies model to shared memory and returns its version'''
+        self.version += 1
+        shm = shared_memory.SharedMemory(name='{}_{}'.format(self.shm_prefix, self.version),
+            create=True, size=max(model.flat.nbytes, 1))
+        np.ndarray(model.flat.shape, dtype=np.float32, buffer=shm.buf)[:] = model.flat
+        self.shms[self.version] = shm
+        return self.version
+
+    def release(self, version):
+        shm = self.shms.pop(version)
+        shm.close()
+        shm.unlink()
+
+    def run(self, tasks):
+        '''Yields the (soln, stats) of tasks, in the order of tasks'''
+        return self.pool.imap(_run_task, tasks)
+
+    def solve(self, clients, model, get_epochs, batch_size):
+        '''Trains clients from model in the workers
+
+        Yields:
+            (client, soln, stats) in the order of clients
+        '''
+        version = self.publish(model)
+        tasks = []
+        for c in clients:
+            epochs = get_epochs(c)
+            tasks.append(ClientTask(version, c.id, epochs, batch_size, c.data_version))
+            c.skip_inner(epochs) # Replay the shuffles on the server copy
+        for c, (soln, stats) in zip(clients, self.run(tasks)):
+            yield c, soln, stats
+        self.release(version)
+
+    def close(self):
+        for version in list(self.shms.keys()):
+            self.release(version)
+        self.pool.terminate()
+
+
+def solve_clients(clients, model, num_epochs, batch_size, pool=None):
+    '''Trains each client from model, sequentially, in a ClientPool or
+    in a client-batched model
+
+    Args:
+        clients: list of Client
+        model: the start model (ParamVector)
+        num_epochs: int, or function of the client that returns an int
+        pool: ClientPool or BatchedModel, trains sequentially on the shared model if None
+    Yields:
+        (client, soln, stats) in the order of clients
+    '''
+    get_epochs = num_epochs if callable(num_epochs) else (lambda c: num_epochs)
+    if pool is None:
+        for c in clients:
+            # communicate the latest model
+            c.set_params(model)
+            soln, stats = c.solve_inner(num_epochs=get_epochs(c), batch_size=batch_size)
+            yield c, soln, stats
+        return
+
+    for c, soln, stats in pool.solve(clients, model, get_epochs, batch_size):
+        yield c, soln, stats
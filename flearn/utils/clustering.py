@@ -0,0 +1,182 @@
+import inspect
+import tempfile
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans, SpectralClustering, AgglomerativeClustering
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics.pairwise import cosine_similarity
+
+from flearn.utils.madc import data_driven_measure, BUDGET
+from flearn.utils.sketch import SketchedSVD
+
+''' Clustering of the client updates, a measure x an algorithm
+    measures:
+        EDC: cosine similarity between the updates and their top
+            n_components right singular vectors (TruncatedSVD of the stacked
+            updates, or SketchedSVD with a sketch_size), shape=(n_clients,
+            n_components), a feature matrix
+        MADC: mean absolute difference of the pairwise cosine similarities
+            (see madc.py), shape=(n_clients, n_clients), a distance matrix
+    algorithms:
+        kmeans: KMeans on the rows of the measure, MiniBatchKMeans when it
+            starts from given centers
+        agglomerative: ward linkage on a feature matrix, complete linkage on a
+            distance matrix
+        spectral: RBF affinity of the features, or of the distances
+            exp(-d^2 / (2 gamma^2))
+    Only the selected measure is computed. The updates are written to a
+    float32 memory map in a temporary file as they are added and read back
+    in chunks of CHUNK_BYTES, by the measures and by update() (e.g. for the
+    means of the clusters), the memory does not grow with n_clients *
+    n_params.
+'''
+MEASURES = ('EDC', 'MADC')
+ALGORITHMS = ('kmeans', 'agglomerative', 'spectral')
+GAMMA = 0.2 # Width of the RBF kernel of the spectral clustering of a distance matrix
+CHUNK_BYTES = 1 << 26 # Bytes of the updates read at a time
+
+
+def _agglomerative(n_clusters, metric, linkage):
+    # The affinity argument was renamed metric in scikit-learn 1.2
+    if 'metric' in inspect.signature(AgglomerativeClustering).parameters:
+        return AgglomerativeClustering(n_clusters, metric=metric, linkage=linkage)
+    return AgglomerativeClustering(n_clusters, affinity=metric, linkage=linkage)
+
+
+class ClusteringBackend(object):
+    '''Accumulates the flattened client updates, see add(), then fit(),
+    close() frees the stored updates
+    '''
+
+    def __init__(self, n_clusters, measure='EDC', algorithm='kmeans', n_components=None, sketch_size=None,
+            madc_budget=BUDGET, madc_workers=0, seed=None, max_iter=20):
+        if measure not in MEASURES:
+            raise ValueError('Unknown clustering measure {!r}, expected one of {}'.format(measure, MEASURES))
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown clustering algorithm {!r}, expected one of {}'.format(algorithm, ALGORITHMS))
+        self.n_clusters = n_clusters
+        self.measure, self.algorithm = measure, algorithm
+        self.n_components = n_components or n_clusters
+        self.sketch_size = sketch_size # None for TruncatedSVD
+        self.madc_budget, self.madc_workers = madc_budget, madc_workers
+        self.seed, self.max_iter = seed, max_iter
+        self.sketch, self.updates, self.file = None, None, None
+        self.count = 0 # number of updates added since start()
+        self.timings = [] # [(step, seconds), ...] of the last fit()
+
+    def start(self, n_params, n_clients):
+        '''Starts a new set of the updates of n_clients clients of n_params parameters'''
+        self.close()
+        self.file = tempfile.TemporaryFile()
+        self.updates = np.memmap(self.file, dtype=np.float32, mode='w+', shape=(max(n_clients, 1), n_params))
+        self.count = 0
+        if self.measure == 'EDC' and self.sketch_size is not None:
+            self.sketch = SketchedSVD(n_params, self.n_components, self.sketch_size, seed=self.seed)
+
+    def add(self, update):
+        '''Adds the flattened update of the next client'''
+        if self.count >= self.updates.shape[0]:
+            raise ValueError('More updates than the {} clients of start()'.format(self.updates.shape[0]))
+        self.updates[self.count] = update
+        self.count += 1
+        if self.sketch is not None:
+            self.sketch.add(update)
+
+    def update(self, idx):
+        '''Returns (a copy of) the update of the idx-th client added'''
+        return np.array(self.updates[idx])
+
+    def close(self):
+        self.sketch, self.updates = None, None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _row_blocks(self):
+        '''Yields the updates added, a block of rows at a time'''
+        rows = max(1, CHUNK_BYTES // (self.updates.shape[1] * self.updates.itemsize))
+        for start in range(0, self.count, rows):
+            yield self.updates[start:min(start + rows, self.count)]
+
+    def _timed(self, step, func, *args, **kwargs):
+        start_time = time.time()
+        result = func(*args, **kwargs)
+        self.timings.append((step, time.time() - start_time))
+        return result
+
+    def edc(self, init_updates=None):
+        '''Returns the EDC of the updates and of init_updates (None if not given)'''
+        init = None
+        if self.sketch is not None:
+            matrix = self._timed('EDC Matrix calculation', self.sketch.decomposed_cosine)
+            if init_updates is not None:
+                init = self.sketch.project_cosine(init_updates)
+            return matrix, init
+        delta_w = self.updates[:self.count] # shape=(n_clients, n_params), on disk
+        svd = TruncatedSVD(n_components=self.n_components, random_state=self.seed)
+        decomp_updates = self._timed('SVD', svd.fit_transform, delta_w.T) # shape=(n_params, n_components)
+        matrix = self._timed('EDC Matrix calculation', lambda: np.vstack(
+            [cosine_similarity(block, decomp_updates.T) for block in self._row_blocks()]))
+        if init_updates is not None:
+            init = cosine_similarity(np.vstack(init_updates), decomp_updates.T)
+        return matrix, init
+
+    def cosine(self):
+        '''Returns the pairwise cosine similarity of the updates, as
+        cosine_similarity() of the stacked updates, from their Gram matrix
+        accumulated over blocks of columns
+        '''
+        n_clients, n_params = self.count, self.updates.shape[1]
+        cols = max(1, CHUNK_BYTES // (max(n_clients, 1) * 8))
+        gram = np.zeros((n_clients, n_clients))
+        for start in range(0, n_params, cols):
+            block = np.asarray(self.updates[:n_clients, start:start+cols], dtype=np.float64)
+            gram += block.dot(block.T)
+        norms = np.sqrt(np.diag(gram))
+        norms[norms == 0] = 1
+        return (gram / norms[:, np.newaxis] / norms[np.newaxis, :]).astype(self.updates.dtype)
+
+    def madc(self):
+        '''Returns the MADC of the updates'''
+        def _madc():
+            pm = self.cosine() # shape=(n_clients, n_clients)
+            return data_driven_measure(pm, correction=True, budget=self.madc_budget, num_workers=self.madc_workers)
+        return self._timed('MADC Matrix calculation', _madc)
+
+    def fit(self, init_updates=None):
+        '''Clusters the updates added since start()
+
+        Args:
+            init_updates: flattened updates whose EDC are the initial centers of
+                kmeans (cluster i starts from init_updates[i]), ignored by the
+                other algorithms and by MADC
+        Return:
+            labels, shape=(n_clients,)
+        '''
+        self.timings = []
+        init = None
+        if self.measure == 'EDC':
+            matrix, init = self.edc(init_updates)
+        else:
+            matrix = self.madc()
+        precomputed = self.measure == 'MADC'
+
+        if self.algorithm == 'kmeans':
+            if init is not None:
+                model = MiniBatchKMeans(self.n_clusters, init=init, n_init=1, random_state=self.seed,
+                    max_iter=self.max_iter)
+            else:
+                model = KMeans(self.n_clusters, random_state=self.seed, max_iter=self.max_iter)
+        elif self.algorithm == 'agglomerative':
+            if precomputed:
+                model = _agglomerative(self.n_clusters, 'precomputed', 'complete')
+            else:
+                model = _agglomerative(self.n_clusters, 'euclidean', 'ward')
+        else:
+            if precomputed:
+                matrix = np.exp(- matrix ** 2 / (2. * GAMMA ** 2))
+                model = SpectralClustering(self.n_clusters, random_state=self.seed, affinity='precomputed')
+            else:
+                model = SpectralClustering(self.n_clusters, random_state=self.seed)
+        return self._timed('Clustering', model.fit, matrix).labels_
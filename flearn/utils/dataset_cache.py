@@ -0,0 +1,242 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from flearn.utils.leaf_json import read_meta, iter_user_data
+from flearn.utils.client_index import IndexBuilder, load_index, INDEX
+
+''' Layout of a dataset cache directory
+    manifest.json: clients, groups, the source json files and, for each split,
+        the [start, end) rows of every client
+    {train,test}_{x,y}.npy: the samples of all clients of a split, concatenated
+        in the order of clients
+    index.npz: the ClientIndex of the clients (see client_index.py)
+'''
+MANIFEST = 'manifest.json'
+SPLITS = ['train', 'test']
+CHUNK_BYTES = 1 << 22
+
+
+def _source_files(data_dir):
+    files = sorted(f for f in os.listdir(data_dir) if f.endswith('.json'))
+    return {f: os.path.getmtime(os.path.join(data_dir, f)) for f in files}
+
+
+class _ColumnWriter(object):
+    '''Appends arrays of the same row shape to a .npy file
+
+    The rows are written to a raw temporary file as they come, in runs of the
+    same dtype, and copied into the .npy file of the promoted dtype of all
+    runs (e.g. the longest string) by close(), one chunk at a time.
+    '''
+
+    def __init__(self, path, name):
+        self.path, self.name = path, name
+        self.tmp = open(path + '.tmp', 'wb')
+        self.runs = [] # [dtype, rows]
+        self.row_shape = None
+        self.rows = 0
+
+    def _add_run(self, dtype, shape):
+        if dtype == object:
+            raise ValueError('Can not cache {}, samples of ragged shape or mixed types'.format(self.name))
+        if self.row_shape is None:
+            self.row_shape = shape[1:]
+        elif shape[1:] != self.row_shape:
+            raise ValueError('Can not cache {}, samples of shape {} and {}'.format(self.name, self.row_shape, shape[1:]))
+        if len(self.runs) > 0 and self.runs[-1][0] == dtype:
+            self.runs[-1][1] += shape[0]
+        else:
+            self.runs.append([dtype, shape[0]])
+        self.rows += shape[0]
+
+    def append(self, arr):
+        if len(arr) == 0:
+            return
+        self._add_run(arr.dtype, arr.shape)
+        self.tmp.write(np.ascontiguousarray(arr))
+
+    def append_file(self, path):
+        '''Appends the rows of a .npy file, copied as bytes'''
+        with open(path, 'rb') as inf:
+            version = np.lib.format.read_magic(inf)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(inf)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(inf)
+            if shape[0] == 0:
+                return
+            self._add_run(dtype, shape)
+            shutil.copyfileobj(inf, self.tmp)
+
+    def close(self):
+        self.tmp.close()
+        if self.rows == 0:
+            np.save(self.path, np.zeros(0))
+        else:
+            dtype = np.result_type(*[dt for dt, _ in self.runs])
+            header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                'shape': (self.rows,) + self.row_shape}
+            row_size = int(np.prod(self.row_shape, dtype=np.int64))
+            chunk_rows = max(1, CHUNK_BYTES // (row_size * dtype.itemsize))
+            with open(self.path + '.tmp', 'rb') as inf, open(self.path, 'wb') as ouf:
+                np.lib.format.write_array_header_1_0(ouf, header)
+                for run_dtype, rows in self.runs:
+                    for i in range(0, rows, chunk_rows):
+                        n = min(chunk_rows, rows - i)
+                        ouf.write(np.fromfile(inf, dtype=run_dtype, count=n * row_size).astype(dtype, copy=False))
+        os.remove(self.path + '.tmp')
+
+
+class DatasetWriter(object):
+    '''Writes a cache directory (see load_dataset()) one client at a time
+
+    The memory does not grow with the number of clients, the samples of a
+    client are written to disk by add(). Usage:
+
+        writer = DatasetWriter(cache_dir)
+        writer.add('train', client, x, y)
+        ...
+        writer.close()
+    '''
+
+    def __init__(self, cache_dir, sources=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(os.path.join(cache_dir, MANIFEST)):
+            os.remove(os.path.join(cache_dir, MANIFEST))
+        self.cache_dir = cache_dir
+        self.sources = sources # None, the cache is not built from json files
+        self.offsets = {split: {} for split in SPLITS}
+        self.groups = {}
+        self.index = IndexBuilder()
+        self.columns = {(split, k): _ColumnWriter(os.path.join(cache_dir, '{}_{}.npy'.format(split, k)), split + ' ' + k)
+            for split in SPLITS for k in ['x', 'y']}
+
+    def add(self, split, client, x, y, group=None):
+        '''Appends the samples of client to split, x and y are converted with np.array()'''
+        x, y = np.array(x), np.array(y)
+        if client in self.offsets[split]:
+            raise ValueError('Client {} is already in the {} split'.format(client, split))
+        start = self.columns[(split, 'y')].rows
+        self.columns[(split, 'x')].append(x)
+        self.columns[(split, 'y')].append(y)
+        self.offsets[split][client] = [start, start + len(y)]
+        self.index.add(split, client, x, y)
+        if group is not None:
+            self.groups[client] = group
+
+    def add_many(self, split, clients, x, y, counts):
+        '''Appends the samples of several clients at once, x and y are their
+        samples concatenated in the order of clients, counts the number of
+        samples of each client
+        '''
+        x, y, counts = np.asarray(x), np.asarray(y), np.asarray(counts, dtype=np.int64)
+        if counts.sum() != len(y):
+            raise ValueError('{} samples for {} counted samples'.format(len(y), counts.sum()))
+        start = self.columns[(split, 'y')].rows
+        self.columns[(split, 'x')].append(x)
+        self.columns[(split, 'y')].append(y)
+        ends = start + np.cumsum(counts)
+        for c, s, e in zip(clients, (ends - counts).tolist(), ends.tolist()):
+            if c in self.offsets[split]:
+                raise ValueError('Client {} is already in the {} split'.format(c, split))
+            self.offsets[split][c] = [s, e]
+        self.index.add_many(split, clients, x, y, counts)
+
+    def extend(self, cache_dir):
+        '''Appends all clients of another cache directory, e.g. written by
+        another process, the samples are copied without decoding
+        '''
+        with open(os.path.join(cache_dir, MANIFEST), 'r') as inf:
+            manifest = json.load(inf)
+        for split in SPLITS:
+            start = self.columns[(split, 'y')].rows
+            for c, (s, e) in manifest[split].items():
+                if c in self.offsets[split]:
+                    raise ValueError('Client {} is already in the {} split'.format(c, split))
+                self.offsets[split][c] = [start + s, start + e]
+            for k in ['x', 'y']:
+                self.columns[(split, k)].append_file(os.path.join(cache_dir, '{}_{}.npy'.format(split, k)))
+        self.groups.update(zip(manifest['clients'], manifest['groups']))
+        self.index.extend(load_index(cache_dir))
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+        # Same clients and groups as read_data() of the json files
+        clients = sorted(self.offsets['train'])
+        groups = [self.groups[c] for c in clients] if all(c in self.groups for c in clients) else []
+        manifest = {'clients': clients, 'groups': groups, 'sources': self.sources}
+        for split in SPLITS:
+            end = self.columns[(split, 'y')].rows
+            offsets = {c: [end, end] for c in clients} # Clients without samples in split
+            offsets.update(self.offsets[split])
+            manifest[split] = offsets
+        self.index.build(clients).save(self.cache_dir)
+        # Written last, a cache without manifest is incomplete
+        with open(os.path.join(self.cache_dir, MANIFEST), 'w') as ouf:
+            json.dump(manifest, ouf)
+
+
+def convert_dataset(train_data_dir, test_data_dir, cache_dir):
+    '''Converts the json files of a LEAF-style dataset into a cache directory
+
+    Each client's data is converted with np.array(), as Client does, and
+    stored as rows of typed, contiguous arrays. The json files are streamed
+    one user at a time (see leaf_json.py) into a DatasetWriter, the memory
+    does not grow with the size of the dataset.
+    '''
+    sources = {'train': _source_files(train_data_dir), 'test': _source_files(test_data_dir)}
+    writer = DatasetWriter(cache_dir, sources)
+    for split, data_dir in zip(SPLITS, [train_data_dir, test_data_dir]):
+        for f in sources[split]:
+            path = os.path.join(data_dir, f)
+            groups = {}
+            if split == 'train':
+                meta = read_meta(path)
+                groups = dict(zip(meta['users'], meta.get('hierarchies', [])))
+            for c, cdata in iter_user_data(path):
+                writer.add(split, c, cdata['x'], cdata['y'], groups.get(c))
+    writer.close()
+
+
+def load_dataset(cache_dir, mmap=True):
+    '''Loads a cache directory written by convert_dataset()
+
+    With mmap, the arrays are read-only memory maps, the samples of a
+    client are read from disk when it loads its data (see Client).
+
+    Return:
+        same as read_data(), the data of each client are numpy arrays
+    '''
+    with open(os.path.join(cache_dir, MANIFEST), 'r') as inf:
+        manifest = json.load(inf)
+    mmap_mode = 'r' if mmap else None
+    datas = []
+    for split in SPLITS:
+        x = np.load(os.path.join(cache_dir, '{}_x.npy'.format(split)), mmap_mode=mmap_mode)
+        y = np.load(os.path.join(cache_dir, '{}_y.npy'.format(split)), mmap_mode=mmap_mode)
+        datas.append({c: {'x': x[start:end], 'y': y[start:end]} for c, (start, end) in manifest[split].items()})
+    return manifest['clients'], manifest['groups'], datas[0], datas[1]
+
+
+def read_data_cached(train_data_dir, test_data_dir, cache_dir, mmap=True):
+    '''read_data() through a cache directory
+
+    The cache is (re)built from the json files when it is missing or when
+    the json files have changed since it was built. A cache written without
+    json files (e.g. by utils/prepare_data.py) is used as is.
+    '''
+    manifest_file = os.path.join(cache_dir, MANIFEST)
+    stale = True
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as inf:
+            sources = json.load(inf)['sources']
+        stale = sources is not None and \
+            (sources != {'train': _source_files(train_data_dir), 'test': _source_files(test_data_dir)}
+            or not os.path.exists(os.path.join(cache_dir, INDEX))) # Built before the index existed
+    if stale:
+        convert_dataset(train_data_dir, test_data_dir, cache_dir)
+    return load_dataset(cache_dir, mmap)
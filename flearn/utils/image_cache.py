@@ -0,0 +1,102 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+from flearn.utils.model_utils import read_data, load_image
+
+''' Layout of an image cache directory
+    images.npy: uint8 array (num_images, 84, 84, 3), the decoded and resized images
+    index.json: the file name of each row of images.npy
+'''
+IMAGE_CACHE_DIR = os.path.join('data', 'celeba', 'data', 'image_cache')
+IMAGE_SIZE = 84
+
+_caches = {} # {cache_dir: ImageCache}, only the caches that have been built
+
+
+class ImageCache(object):
+    '''Read-only view of an image cache directory, see build_image_cache()'''
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, 'index.json'), 'r') as inf:
+            names = json.load(inf)
+        self.index = {name: row for row, name in enumerate(names)}
+        self.images = np.load(os.path.join(cache_dir, 'images.npy'), mmap_mode='r')
+
+    def rows(self, names):
+        '''Returns the rows of the given image file names'''
+        try:
+            return np.array([self.index[name] for name in names], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError('Image {} is not in the image cache, rebuild it with '
+                '`python -m flearn.utils.image_cache`'.format(e.args[0])) from None
+
+
+def load_image_cache(cache_dir=IMAGE_CACHE_DIR):
+    '''Returns the ImageCache of cache_dir, None if it has not been built (yet)'''
+    if cache_dir not in _caches:
+        if not os.path.exists(os.path.join(cache_dir, 'index.json')):
+            return None
+        _caches[cache_dir] = ImageCache(cache_dir)
+    return _caches[cache_dir]
+
+
+def _decode(names):
+    return np.array([load_image(name) for name in names], dtype=np.uint8)
+
+
+def build_image_cache(names, cache_dir=IMAGE_CACHE_DIR, num_workers=0, chunk_size=256):
+    '''Decodes and resizes the given images once into a cache directory
+
+    Args:
+        names: image file names (duplicates are stored once)
+        num_workers: number of decoding processes, 0 to decode in this process
+    '''
+    names = sorted(set(names))
+    _caches.pop(cache_dir, None)
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(os.path.join(cache_dir, 'index.json')):
+        os.remove(os.path.join(cache_dir, 'index.json'))
+    images = np.lib.format.open_memmap(os.path.join(cache_dir, 'images.npy'), mode='w+',
+        dtype=np.uint8, shape=(len(names), IMAGE_SIZE, IMAGE_SIZE, 3))
+    starts = range(0, len(names), chunk_size)
+    chunks = [names[i:i+chunk_size] for i in starts]
+    if num_workers > 0:
+        with mp.Pool(num_workers) as pool:
+            for i, batch in zip(starts, pool.imap(_decode, chunks)):
+                images[i:i+len(batch)] = batch
+    else:
+        for i, chunk in zip(starts, chunks):
+            images[i:i+len(chunk)] = _decode(chunk)
+    images.flush()
+    # Written last, a cache without index is incomplete
+    with open(os.path.join(cache_dir, 'index.json'), 'w') as ouf:
+        json.dump(names, ouf)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the image cache of the celeba clients')
+    parser.add_argument('--data_dir',
+                    help='directory of the train and test json files;',
+                    type=str,
+                    default=os.path.join('data', 'celeba', 'data'))
+    parser.add_argument('--cache_dir',
+                    help='directory of the image cache;',
+                    type=str,
+                    default=IMAGE_CACHE_DIR)
+    parser.add_argument('--num_workers',
+                    help='number of decoding processes;',
+                    type=int,
+                    default=0)
+    args = parser.parse_args()
+
+    _, _, train_data, test_data = read_data(os.path.join(args.data_dir, 'train'), os.path.join(args.data_dir, 'test'))
+    names = [name for data in (train_data, test_data) for cdata in data.values() for name in cdata['x']]
+    build_image_cache(names, args.cache_dir, args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 """Utils for language models."""
 
+import functools
+import json
+import os
 import re
 
+import numpy as np
+
 
 # ------------------------
 # utils for shakespeare dataset
@@ -25,6 +30,12 @@ def letter_to_vec(letter):
     return _one_hot(index, NUM_LETTERS)
 
 
+def letter_to_index(letter):
+    '''returns the index of the 1 in letter_to_vec(letter)
+    '''
+    return ALL_LETTERS.find(letter) % NUM_LETTERS
+
+
 def word_to_indices(word):
     '''returns a list of character indices
 
@@ -95,6 +106,29 @@ def line_to_indices(line, word2id, max_words=25):
     return indl
 
 
+@functools.lru_cache(maxsize=None)
+def load_word_embeddings(emb_dir):
+    '''loads the word embedding store written by sent140/get_embs.py
+
+    the table is memory-mapped, rows are only read from disk when they are
+    used (e.g. fed to the embedding variable of a model), and it is loaded
+    once per process
+
+    Args:
+        emb_dir: directory of embs.npy and embs_vocab.json
+
+    Return:
+        word2id: dictionary with string words as keys and int indices as values
+        emb_arr: read-only float32 array of shape (len(word2id)+1, dim), the
+            last row is the embedding of unknown words
+    '''
+    with open(os.path.join(emb_dir, 'embs_vocab.json'), 'r') as inf:
+        id2word = json.load(inf)
+    word2id = {w: i for i, w in enumerate(id2word)}
+    emb_arr = np.load(os.path.join(emb_dir, 'embs.npy'), mmap_mode='r')
+    return word2id, emb_arr
+
+
 def bag_of_words(line, vocab):
     '''returns bag of words representation of given phrase using given vocab
 
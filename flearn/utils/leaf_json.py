@@ -0,0 +1,155 @@
+import json
+
+''' Streaming reader of LEAF json files
+    {"users": [...], "hierarchies": [...], "num_samples": [...],
+     "user_data": {user: {"x": [...], "y": [...]}, ...}}
+
+    Only one value (the metadata lists or the data of one user) is decoded
+    at a time, the memory does not grow with the size of the file.
+'''
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _Stream(object):
+    '''Buffered character stream of a json file with incremental decoding'''
+
+    def __init__(self, inf):
+        self.inf = inf
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        '''Makes at least size characters available after pos, if the file has them'''
+        if self.pos > 0:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        while len(self.buf) < size and not self.eof:
+            chunk = self.inf.read(max(CHUNK_SIZE, size - len(self.buf)))
+            self.eof = len(chunk) == 0
+            self.buf += chunk
+
+    def peek(self):
+        '''Returns the next non-whitespace character, '' at the end of the file'''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos+1]
+            self._fill(1)
+
+    def expect(self, chars):
+        '''Consumes the next non-whitespace character, one of chars'''
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise ValueError('Expected one of {!r} at {!r}'.format(chars, self.buf[self.pos:self.pos+20]))
+        self.pos += 1
+        return c
+
+    def value(self):
+        '''Decodes the next json value'''
+        self.peek()
+        size = len(self.buf) - self.pos
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    # A number at the end of the buffer may continue in the file
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # The value continues past the buffer, read twice as much
+            size = max(2 * size, CHUNK_SIZE)
+            self._fill(size)
+
+
+def _iter_object(stream):
+    '''Yields the (key, stream) pairs of the object at the stream, the
+    caller consumes the value of each key before the next is read
+    '''
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.pos += 1
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        yield key, stream
+        if stream.expect(',}') == '}':
+            return
+
+
+def read_meta(path):
+    '''Returns the top-level values of a LEAF json file except user_data
+
+    Reading stops at user_data when users and num_samples have already been
+    read (the order in which LEAF writes its files), the data of the users
+    is skipped one user at a time otherwise.
+    '''
+    meta = {}
+    with open(path, 'r') as inf:
+        for key, stream in _iter_object(_Stream(inf)):
+            if key != 'user_data':
+                meta[key] = stream.value()
+            elif 'users' in meta and 'num_samples' in meta:
+                break
+            else:
+                for _, user_stream in _iter_object(stream):
+                    user_stream.value()
+    return meta
+
+
+def iter_user_data(path):
+    '''Yields the (user, {'x': [...], 'y': [...]}) pairs of a LEAF json
+    file, in the order of the file
+    '''
+    with open(path, 'r') as inf:
+        for key, stream in _iter_object(_Stream(inf)):
+            if key != 'user_data':
+                stream.value()
+                continue
+            for user, user_stream in _iter_object(stream):
+                yield user, user_stream.value()
+
+
+class LeafWriter(object):
+    '''Writes a LEAF json file one user at a time
+
+    The metadata is written first, the users are then appended by write():
+
+        with LeafWriter(path, users, num_samples) as writer:
+            for user, data in ...:
+                writer.write(user, data)
+    '''
+
+    def __init__(self, path, users, num_samples, hierarchies=None):
+        self.ouf = open(path, 'w')
+        self.ouf.write('{"users": ')
+        json.dump(users, self.ouf)
+        if hierarchies is not None:
+            self.ouf.write(', "hierarchies": ')
+            json.dump(hierarchies, self.ouf)
+        self.ouf.write(', "num_samples": ')
+        json.dump(num_samples, self.ouf)
+        self.ouf.write(', "user_data": {')
+        self.count = 0
+
+    def write(self, user, data):
+        self.ouf.write('{}{}: '.format(', ' if self.count > 0 else '', json.dumps(user)))
+        json.dump(data, self.ouf)
+        self.count += 1
+
+    def close(self):
+        self.ouf.write('}}')
+        self.ouf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,95 @@
+import multiprocessing as mp
+
+import numpy as np
+
+''' Data-driven distance of a proximity matrix pm, shape=(n_clients, n_dims)
+    dm[a, b] = sum_k |pm[a, k] - pm[b, k]| / n_dims
+    with correction (MADC, pm is the square cosine similarity matrix), the
+    entries k = a and k = b are left out:
+    dm[a, b] = sum_{k != a, b} |pm[a, k] - pm[b, k]| / (n_dims - 2)
+'''
+BUDGET = 256 * 2**20 # bytes of the (block_rows, n_clients, n_dims) differences
+
+_pm = None # The proximity matrix of a worker process
+
+
+def dense_measure(pm, correction=False):
+    '''Reference implementation, builds the (n_clients, n_clients, n_dims)
+    differences at once
+    '''
+    n_clients, n_dims = pm.shape[0], pm.shape[1]
+    row_pm_matrix = np.repeat(pm[:,np.newaxis,:], n_clients, axis=1)
+    col_pm_matrix = np.tile(pm, (n_clients, 1, 1))
+    absdiff_pm_matrix = np.abs(col_pm_matrix - row_pm_matrix) # shape=(n_clients, n_clients, n_dims)
+    if correction == True:
+        # Mask sim(a,b) and sim(b,a) in d(a,b)
+        mask = np.zeros(shape=(n_clients, n_clients))
+        np.fill_diagonal(mask, 1)
+        mask = np.repeat(mask[np.newaxis,:,:], n_clients, axis=0)
+        for idx in range(mask.shape[-1]):
+            mask[idx,:,idx] = 1
+        return np.sum(np.ma.array(absdiff_pm_matrix, mask=mask), axis=-1) / (n_dims-2.0)
+    return np.sum(absdiff_pm_matrix, axis=-1) / (n_dims)
+
+
+def _correction_divisor(n_dims):
+    '''n_dims - 2 as np.ma divides the masked sums of dense_measure() by it,
+    a 0-d float64 array: float32 sums stay float32 under numpy < 2 (value
+    based casting) and become float64 under numpy >= 2
+    '''
+    return np.asarray(n_dims - 2.0)
+
+
+def _block(pm, start, stop, correction, buf=None):
+    '''Returns the rows start:stop of the data-driven distance matrix'''
+    n_clients, n_dims = pm.shape[0], pm.shape[1]
+    diff = np.subtract(pm[np.newaxis,:,:], pm[start:stop,np.newaxis,:], out=buf)
+    np.abs(diff, out=diff)
+    if correction == True:
+        # Same result as the masked array of dense_measure(): the masked
+        # entries sum as 0 and the division is the one of np.ma
+        cols = np.arange(n_clients)
+        diff[:, cols, cols] = 0 # k = b
+        diff[np.arange(stop-start), :, np.arange(start, stop)] = 0 # k = a
+        return np.sum(diff, axis=-1) / _correction_divisor(n_dims)
+    return np.sum(diff, axis=-1) / (n_dims)
+
+
+def _init_worker(pm):
+    global _pm
+    _pm = pm
+
+
+def _worker_block(args):
+    return _block(_pm, *args)
+
+
+def data_driven_measure(pm, correction=False, budget=BUDGET, num_workers=0):
+    '''Computes the matrix of dense_measure() in blocks of rows
+
+    Args:
+        budget: bytes of the differences of a block, the memory grows with
+            n_clients * n_dims and not with n_clients^2 * n_dims
+        num_workers: number of processes computing the blocks, 0 to compute
+            them in this process (each worker holds its own block)
+    Return:
+        dm, shape=(n_clients, n_clients)
+    '''
+    pm = np.asarray(pm)
+    if pm.dtype.kind != 'f':
+        pm = pm.astype(np.float64)
+    n_clients, n_dims = pm.shape[0], pm.shape[1]
+    rows = int(max(1, min(n_clients, budget // max(1, n_clients * n_dims * pm.itemsize))))
+    blocks = [(start, min(start + rows, n_clients), correction) for start in range(0, n_clients, rows)]
+    dtype = np.result_type(pm.dtype, _correction_divisor(n_dims)) if correction == True else pm.dtype
+    dm = np.empty((n_clients, n_clients), dtype=dtype)
+    if num_workers > 0 and len(blocks) > 1:
+        ctx = mp.get_context('spawn') # TensorFlow is not fork-safe
+        with ctx.Pool(num_workers, initializer=_init_worker, initargs=(pm,)) as pool:
+            for (start, stop, _), block in zip(blocks, pool.imap(_worker_block, blocks)):
+                dm[start:stop] = block
+    else:
+        buf = np.empty((rows, n_clients, n_dims), dtype=pm.dtype)
+        for start, stop, _ in blocks:
+            dm[start:stop] = _block(pm, start, stop, correction, buf[:stop-start])
+    return dm
@@ -1,9 +1,49 @@
 import json
 import numpy as np
 import os
+import zlib
 from PIL import Image
 from math import ceil
 
+def shuffle_data(data):
+    '''
+    shuffles data['x'] and data['y'] in place with the fixed seed of batch_data,
+    calling it replays the shuffle of one training epoch
+    '''
+    np.random.seed(100)
+    rng_state = np.random.get_state()
+    np.random.shuffle(data['x'])
+    np.random.set_state(rng_state)
+    np.random.shuffle(data['y'])
+
+def epoch_orders(num_samples, num_epochs):
+    '''
+    returns the row orders of data after each of num_epochs shuffles of
+    batch_data, relative to the order before the first one
+    '''
+    perm = np.arange(num_samples)
+    np.random.RandomState(100).shuffle(perm) # Same permutation as shuffle_data()
+    order, orders = np.arange(num_samples), []
+    for _ in range(num_epochs):
+        order = order[perm]
+        orders.append(order)
+    return orders
+
+def shuffle_order(num_samples, num_shuffles):
+    '''
+    returns the row order of data after num_shuffles calls of shuffle_data,
+    without touching the global numpy RNG
+    '''
+    perm = np.arange(num_samples)
+    np.random.RandomState(100).shuffle(perm) # Same permutation as shuffle_data()
+    order = np.arange(num_samples)
+    while num_shuffles > 0: # perm^num_shuffles by squaring
+        if num_shuffles % 2 == 1:
+            order = order[perm]
+        perm = perm[perm]
+        num_shuffles //= 2
+    return order
+
 def batch_data(data, batch_size):
     '''
     data is a dict := {'x': [numpy array], 'y': [numpy array]} (on one client)
@@ -13,11 +53,7 @@ def batch_data(data, batch_size):
     data_y = data['y']
 
     # randomly shuffle data
-    np.random.seed(100)
-    rng_state = np.random.get_state()
-    np.random.shuffle(data_x)
-    np.random.set_state(rng_state)
-    np.random.shuffle(data_y)
+    shuffle_data(data)
 
     # loop through mini-batches
     for i in range(0, len(data_x), batch_size):
@@ -81,6 +117,83 @@ def batch_data_multiple_iters(data, batch_size, num_iters):
 
         yield (batched_x, batched_y)
 
+class Batcher(object):
+    '''
+    allocation-free minibatches of one client, a drop-in for batch_data and
+    batch_data_multiple_iters (same names and arguments)
+
+    the batches are drawn from a permutation of the client's own
+    np.random.Generator, gathered with np.take into buffers that are reused
+    from batch to batch; the client's arrays and the global numpy RNG are
+    never modified. A yielded batch is only valid until the next one.
+
+    draws: number of permutations drawn so far, the state of the batcher
+    only depends on seed and draws
+    '''
+
+    def __init__(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.draws = 0
+        self._perm = None
+        self._rows = None
+        self._buffers = {}
+
+    def _shuffle(self, num_samples):
+        if self._perm is None or len(self._perm) != num_samples:
+            self._perm = np.arange(num_samples)
+        self.rng.shuffle(self._perm)
+        self.draws += 1
+        return self._perm
+
+    def skip(self, num_draws, num_samples):
+        '''draws num_draws permutations without batching, see Client.skip_inner'''
+        for _ in range(num_draws):
+            self._shuffle(num_samples)
+
+    def _take(self, data, key, rows, batch_size):
+        arr = data[key]
+        buf = self._buffers.get(key)
+        if buf is None or len(buf) < batch_size or buf.shape[1:] != arr.shape[1:] or buf.dtype != arr.dtype:
+            buf = np.empty((batch_size,) + arr.shape[1:], dtype=arr.dtype)
+            self._buffers[key] = buf
+        out = buf[:len(rows)]
+        np.take(arr, rows, axis=0, out=out)
+        return out
+
+    def batch_data(self, data, batch_size):
+        '''one epoch in a fresh permutation, same batch sizes as batch_data'''
+        num_samples = len(data['y'])
+        perm = self._shuffle(num_samples)
+        for i in range(0, num_samples, batch_size):
+            rows = perm[i:i+batch_size]
+            yield (self._take(data, 'x', rows, batch_size), self._take(data, 'y', rows, batch_size))
+
+    def batch_data_multiple_iters(self, data, batch_size, num_iters):
+        '''num_iters full batches of consecutive rows of a stream of
+        permutations, a batch that crosses the end of an epoch continues
+        in the next permutation
+        '''
+        num_samples = len(data['y'])
+        if num_samples == 0:
+            return
+        if self._rows is None or len(self._rows) < batch_size:
+            self._rows = np.empty(batch_size, dtype=np.int64)
+        rows = self._rows[:batch_size]
+        perm, pos = self._shuffle(num_samples), 0
+        for _ in range(num_iters):
+            filled = 0
+            while filled < batch_size:
+                if pos == num_samples:
+                    perm, pos = self._shuffle(num_samples), 0
+                n = min(batch_size - filled, num_samples - pos)
+                rows[filled:filled+n] = perm[pos:pos+n]
+                filled, pos = filled + n, pos + n
+            yield (self._take(data, 'x', rows, batch_size), self._take(data, 'y', rows, batch_size))
+
+def batch_seed(seed, client_id):
+    '''returns the seed of the Batcher of a client in a run with seed'''
+    return [seed, zlib.crc32(str(client_id).encode())]
+
 def read_data(train_data_dir, test_data_dir):
     '''parses data in given train and test data directories
 
@@ -143,7 +256,12 @@ def gen_batch_celeba(data, batch_size, num_iter):
     data_x_name = data['x']
     data_y_name = data['y']
 
-    data_x = np.asarray(process_x(data_x_name))
+    if np.issubdtype(np.asarray(data_x_name).dtype, np.integer):
+        # Rows of the image cache, image_cache imports this module
+        from flearn.utils.image_cache import load_image_cache
+        data_x = load_image_cache().images[data_x_name]
+    else:
+        data_x = np.asarray(process_x(data_x_name))
     data_y = np.asarray(process_y(data_y_name))
 
     index = len(data_y)
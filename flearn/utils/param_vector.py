@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class ParamVector(object):
+    '''Model parameters stored in one contiguous float32 buffer
+
+    Iterating a ParamVector (or indexing it) yields zero-copy per-layer
+    views, so it can be passed wherever a list of per-layer arrays was
+    expected. Arithmetic works on the flat buffer, either with another
+    ParamVector of the same layout or with a scalar.
+    '''
+
+    def __init__(self, flat, shapes):
+        self.flat = np.ascontiguousarray(flat, dtype=np.float32)
+        self.shapes = [tuple(s) for s in shapes]
+        self.offsets = np.cumsum([0] + [int(np.prod(s)) for s in self.shapes])
+        if self.flat.ndim != 1 or self.flat.size != self.offsets[-1]:
+            raise ValueError('Buffer of size {} does not match layer shapes {}'.format(self.flat.size, self.shapes))
+
+    @classmethod
+    def from_layers(cls, layers):
+        '''Packs a list of per-layer arrays into a new ParamVector'''
+        shapes = [np.shape(v) for v in layers]
+        flat = np.concatenate([np.ravel(v) for v in layers]).astype(np.float32, copy=False)
+        return cls(flat, shapes)
+
+    @property
+    def size(self):
+        return self.flat.size
+
+    def layer(self, idx):
+        return self.flat[self.offsets[idx]:self.offsets[idx+1]].reshape(self.shapes[idx])
+
+    def layers(self):
+        return [self.layer(i) for i in range(len(self.shapes))]
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __iter__(self):
+        return iter(self.layers())
+
+    def __getitem__(self, idx):
+        return self.layer(idx)
+
+    def __repr__(self):
+        return 'ParamVector(size={}, layers={})'.format(self.size, self.shapes)
+
+    def copy(self):
+        return ParamVector(self.flat.copy(), self.shapes)
+
+    def zeros_like(self):
+        return ParamVector(np.zeros_like(self.flat), self.shapes)
+
+    def dot(self, other):
+        return np.dot(self.flat, self._operand(other))
+
+    def norm(self):
+        return np.linalg.norm(self.flat)
+
+    def _operand(self, other):
+        if isinstance(other, ParamVector):
+            if other.size != self.size:
+                raise ValueError('ParamVector size mismatch: {} vs {}'.format(self.size, other.size))
+            return other.flat
+        return other
+
+    def _new(self, flat):
+        return ParamVector(flat, self.shapes)
+
+    # Out-of-place arithmetic, always returns a new buffer
+    def __add__(self, other):
+        return self._new(self.flat + self._operand(other))
+
+    def __radd__(self, other):
+        return self._new(self._operand(other) + self.flat)
+
+    def __sub__(self, other):
+        return self._new(self.flat - self._operand(other))
+
+    def __rsub__(self, other):
+        return self._new(self._operand(other) - self.flat)
+
+    def __mul__(self, other):
+        return self._new(self.flat * self._operand(other))
+
+    def __rmul__(self, other):
+        return self._new(self._operand(other) * self.flat)
+
+    def __truediv__(self, other):
+        return self._new(self.flat / self._operand(other))
+
+    def __neg__(self):
+        return self._new(-self.flat)
+
+    # In-place arithmetic, reuses the buffer
+    def __iadd__(self, other):
+        self.flat += self._operand(other)
+        return self
+
+    def __isub__(self, other):
+        self.flat -= self._operand(other)
+        return self
+
+    def __imul__(self, other):
+        self.flat *= self._operand(other)
+        return self
+
+    def __itruediv__(self, other):
+        self.flat /= self._operand(other)
+        return self
+
+
+def as_param_vector(params):
+    '''Returns params as a ParamVector, without copying if it already is one'''
+    if isinstance(params, ParamVector):
+        return params
+    return ParamVector.from_layers(params)
@@ -0,0 +1,85 @@
+import numpy as np
+
+''' Single-pass randomized SVD of the stacked client updates
+    M = [w_1; w_2; ...; w_n], shape=(n_clients, n_params)
+
+    Each update is compressed as it is produced by a sparse random sign
+    embedding (CountSketch): y_i = w_i S, S has one random +-1 per row in
+    a random one of sketch_size columns, so y_i costs O(n_params) and
+    E[y_i . y_j] = w_i . w_j. Y = M S, shape=(n_clients, sketch_size),
+    spans the range of M and Y Y^T ~ M M^T, the left factor L Sigma of M
+    is read from the SVD of Y. M is never built, the memory is
+    n_params + n_clients * sketch_size.
+
+    This stands in for a Gaussian range finder (Y = M Omega with a dense
+    Gaussian Omega): a two-sided Gaussian sketch without power iterations
+    lost the top subspace of noisy client updates, whose tail energy is as
+    large as the signal, and a dense Omega costs O(n_params * sketch_size)
+    per update. Against TruncatedSVD of the stacked updates (see
+    benchmarks/edc.py, 100 clients, 5 groups, 1M params): 5.2 s and 69 MB
+    instead of 10.8 s and 1.2 GB, smallest principal-angle cosine 0.994 and
+    the same KMeans clustering; with noise 4, cosine 0.94 and ARI 0.85.
+'''
+SKETCH_SIZE = 4096
+
+
+class CountSketch(object):
+    '''The sparse random sign embedding S, see sketch()'''
+
+    def __init__(self, n_params, sketch_size=SKETCH_SIZE, seed=None):
+        self.sketch_size = sketch_size
+        rng = np.random.default_rng(seed)
+        self.buckets = rng.integers(sketch_size, size=n_params)
+        self.signs = rng.choice(np.array([-1., 1.], dtype=np.float32), size=n_params)
+
+    def sketch(self, update):
+        '''Returns the sketch w S of a flattened update'''
+        w = np.asarray(update).reshape(-1)
+        return np.bincount(self.buckets, weights=w * self.signs, minlength=self.sketch_size)
+
+
+class SketchedSVD(CountSketch):
+    '''Accumulates the client updates one at a time, see add()'''
+
+    def __init__(self, n_params, n_components, sketch_size=SKETCH_SIZE, seed=None):
+        super(SketchedSVD, self).__init__(n_params, sketch_size, seed)
+        self.n_components = n_components
+        self.Y, self.norms = [], []
+
+    def add(self, update):
+        '''Adds the flattened update of the next client'''
+        self.Y.append(self.sketch(update))
+        self.norms.append(np.linalg.norm(np.asarray(update, dtype=np.float64)))
+
+    def _svd(self):
+        U, S, Vt = np.linalg.svd(np.array(self.Y), full_matrices=False)
+        U, S, Vt = U[:, :self.n_components], S[:self.n_components], Vt[:self.n_components]
+        # Same signs as TruncatedSVD: the largest entry of each component is positive
+        signs = np.sign(U[np.argmax(np.abs(U), axis=0), np.arange(U.shape[1])])
+        signs = np.where(signs == 0, 1, signs)
+        return U * signs, S, Vt * signs[:, np.newaxis]
+
+    def left_factor(self):
+        '''Returns L Sigma, shape=(n_clients, n_components): the coordinates
+        of the clients on the top right singular vectors of M
+        '''
+        U, S, _ = self._svd()
+        return U * S
+
+    def decomposed_cosine(self):
+        '''Returns the cosine similarity between the client updates and the
+        top right singular vectors of M, shape=(n_clients, n_components),
+        as cosine_similarity(M, TruncatedSVD().fit_transform(M.T).T)
+        '''
+        norms = np.array(self.norms)
+        return self.left_factor() / np.where(norms > 0, norms, 1)[:, np.newaxis]
+
+    def project_cosine(self, updates):
+        '''Returns the cosine similarity between other flattened updates (e.g.
+        of groups) and the top right singular vectors of M, whose sketches
+        are the rows of V^T in the SVD of Y
+        '''
+        _, _, Vt = self._svd()
+        Y = np.array([self.sketch(w) for w in updates])
+        norms = np.array([np.linalg.norm(np.asarray(w, dtype=np.float64)) for w in updates])
+        return Y.dot(Vt.T) / np.where(norms > 0, norms, 1)[:, np.newaxis]
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from flearn.utils.dataset_cache import DatasetWriter
+
+''' Generator of synthetic(alpha, beta) federations (Shamir et al., FedProx)
+    written straight into a dataset cache (see dataset_cache.py), for any
+    number of clients:
+    synthetic: client k has its own model W_k ~ N(u_k, 1), b_k ~ N(u_k, 1)
+        with u_k ~ N(0, alpha), and features x ~ N(v_k, S), v_k ~ N(B_k, 1),
+        B_k ~ N(0, beta), S diagonal with S_jj = j^-1.2 (N(mean, standard
+        deviation) as in FedProx)
+    iid: one model W, b ~ N(0, 1) shared by all clients, x ~ N(0, S)
+    clustered: num_groups models W_g, b_g ~ N(0, 1), client k of group g
+        has W_g + N(0, alpha) and b_g + N(0, alpha), its features as in
+        synthetic; the group of each client is written to ground_truth.json
+    the labels are y = argmax(x W_k + b_k)
+'''
+GROUND_TRUTH = 'ground_truth.json'
+
+
+def _chunk_params(rng, size, num_features, num_classes, alpha, beta, iid, centers):
+    '''Draws the features means, models and groups of a chunk of clients'''
+    if iid:
+        W, b = centers[0][:1], centers[1][:1]
+        return np.zeros((size, num_features)), np.broadcast_to(W, (size,) + W.shape[1:]), \
+            np.broadcast_to(b, (size,) + b.shape[1:]), None
+    B = rng.normal(0, beta, size)
+    mean_x = rng.normal(B[:, None], 1, (size, num_features))
+    if centers is None:
+        u = rng.normal(0, alpha, size)
+        W = rng.normal(u[:, None, None], 1, (size, num_features, num_classes))
+        b = rng.normal(u[:, None], 1, (size, num_classes))
+        return mean_x, W, b, None
+    groups = rng.integers(len(centers[0]), size=size)
+    W = centers[0][groups] + rng.normal(0, alpha, (size, num_features, num_classes))
+    b = centers[1][groups] + rng.normal(0, alpha, (size, num_classes))
+    return mean_x, W, b, groups
+
+
+def generate(cache_dir, num_clients, alpha=1., beta=1., iid=False, num_groups=0, num_features=60, num_classes=10,
+        sample_mean=4., sample_sigma=2., min_samples=50, max_samples=None, frac=0.9, seed=0,
+        chunk_clients=1000, chunk_rows=8192):
+    '''Writes a synthetic federation into cache_dir
+
+    The clients are drawn chunk_clients at a time, the samples of a chunk
+    with a few array operations, the memory depends on the chunk and not on
+    num_clients. The output is determined by seed and chunk_clients.
+
+    Args:
+        num_groups: > 0 for the clustered variant
+        sample_mean, sample_sigma: client k has min_samples +
+            lognormal(sample_mean, sample_sigma) samples, at most max_samples
+        frac: fraction of each client's samples in the train split
+        chunk_rows: the labels are computed chunk_rows samples at a time
+    Return:
+        the ground-truth group of each client (None unless clustered)
+    '''
+    rng = np.random.default_rng(seed)
+    centers = None
+    if iid or num_groups > 0:
+        num_models = 1 if iid else num_groups
+        centers = (rng.normal(0, 1, (num_models, num_features, num_classes)), rng.normal(0, 1, (num_models, num_classes)))
+    scale = np.sqrt(np.power(np.arange(1, num_features + 1), -1.2)).astype(np.float32)
+    width = len(str(max(num_clients - 1, 0)))
+    writer = DatasetWriter(cache_dir)
+    truth = [] if num_groups > 0 and not iid else None
+
+    for chunk, first in enumerate(range(0, num_clients, chunk_clients)):
+        size = min(chunk_clients, num_clients - first)
+        rng = np.random.default_rng([seed, chunk])
+        clients = ['f_{:0{}d}'.format(first + i, width) for i in range(size)]
+        counts = rng.lognormal(sample_mean, sample_sigma, size).astype(np.int64) + min_samples
+        if max_samples is not None:
+            counts = np.minimum(counts, max_samples)
+        mean_x, W, b, groups = _chunk_params(rng, size, num_features, num_classes, alpha, beta, iid, centers)
+
+        owner = np.repeat(np.arange(size), counts)
+        x = rng.standard_normal((len(owner), num_features), dtype=np.float32)
+        x *= scale
+        x += mean_x[owner]
+        y = np.empty(len(owner), dtype=np.int64)
+        for s in range(0, len(owner), chunk_rows):
+            rows = owner[s:s+chunk_rows]
+            logits = np.einsum('nd,ndk->nk', x[s:s+chunk_rows], W[rows]) + b[rows]
+            y[s:s+chunk_rows] = logits.argmax(axis=1)
+
+        num_train = (frac * counts).astype(np.int64)
+        train = (np.arange(len(owner)) - (np.cumsum(counts) - counts)[owner]) < num_train[owner]
+        writer.add_many('train', clients, x[train], y[train], num_train)
+        writer.add_many('test', clients, x[~train], y[~train], counts - num_train)
+        if truth is not None:
+            truth.extend(groups.tolist())
+
+    writer.close()
+    if truth is not None:
+        with open(os.path.join(cache_dir, GROUND_TRUTH), 'w') as ouf:
+            json.dump(dict(zip(sorted(writer.offsets['train']), truth)), ouf)
+    return truth
+
+
+def load_ground_truth(cache_dir):
+    '''Returns {client: group} of a clustered synthetic cache, None if it has none'''
+    path = os.path.join(cache_dir, GROUND_TRUTH)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as inf:
+        return json.load(inf)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic federation into a dataset cache')
+    parser.add_argument('--name',
+                    help='name of the dataset, written to data/<name>/data/cache;',
+                    type=str,
+                    default='synthetic_clustered')
+    parser.add_argument('--num_clients',
+                    help='number of clients;',
+                    type=int,
+                    default=10000)
+    parser.add_argument('--alpha',
+                    help='heterogeneity of the models (within a group if clustered);',
+                    type=float,
+                    default=1.)
+    parser.add_argument('--beta',
+                    help='heterogeneity of the features;',
+                    type=float,
+                    default=1.)
+    parser.add_argument('--iid',
+                    help='same model and features for all clients;',
+                    action='store_true')
+    parser.add_argument('--num_groups',
+                    help='number of ground-truth groups, 0 for synthetic(alpha, beta);',
+                    type=int,
+                    default=0)
+    parser.add_argument('--sample_mean',
+                    help='mean of the log number of samples of a client;',
+                    type=float,
+                    default=4.)
+    parser.add_argument('--sample_sigma',
+                    help='standard deviation of the log number of samples of a client;',
+                    type=float,
+                    default=2.)
+    parser.add_argument('--min_samples',
+                    help='number of samples added to each client;',
+                    type=int,
+                    default=50)
+    parser.add_argument('--max_samples',
+                    help='maximum number of samples of a client;',
+                    type=int,
+                    default=None)
+    parser.add_argument('--seed',
+                    help='seed of the generator;',
+                    type=int,
+                    default=0)
+    parser.add_argument('--chunk_clients',
+                    help='number of clients generated at a time;',
+                    type=int,
+                    default=1000)
+    args = parser.parse_args()
+
+    cache_dir = os.path.join('data', args.name, 'data', 'cache')
+    generate(cache_dir, args.num_clients, args.alpha, args.beta, args.iid, args.num_groups,
+        sample_mean=args.sample_mean, sample_sigma=args.sample_sigma, min_samples=args.min_samples,
+        max_samples=args.max_samples, seed=args.seed, chunk_clients=args.chunk_clients)
+    print('writing %s' % cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,18 @@
+import hashlib
+import json
+import os
 import numpy as np
 
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 
+from flearn.utils.param_vector import ParamVector
+
+FLOPS_CACHE_DIR = os.path.join('out', 'flops_cache')
+
+# FLOP profiling of graph_flops(), set by set_flops_profiling()
+_flops_profiling = {'enabled': True, 'cache_dir': FLOPS_CACHE_DIR}
+
 def __num_elems(shape):
     '''Returns the number of elements in the given shape
 
@@ -40,6 +50,68 @@ def graph_size(graph):
             tot_size += var_size
     return tot_size
 
+def set_flops_profiling(enabled=True, cache_dir=FLOPS_CACHE_DIR):
+    '''Configures graph_flops() for the models built afterwards
+
+    Args:
+        enabled: count FLOPs, models report 0 FLOPs if False
+        cache_dir: directory of the profiling cache, None to always profile
+    '''
+    _flops_profiling['enabled'] = enabled
+    _flops_profiling['cache_dir'] = cache_dir
+
+def graph_fingerprint(graph):
+    '''Returns a hash of the ops, shapes and wiring of graph
+
+    Random seeds are left out, the same model built with another seed
+    has the same FLOPs.
+    '''
+    graph_def = graph.as_graph_def()
+    for node in graph_def.node:
+        for attr in ('seed', 'seed2'):
+            if attr in node.attr:
+                del node.attr[attr]
+    return hashlib.sha1(graph_def.SerializeToString(deterministic=True)).hexdigest()
+
+def graph_flops(graph, name):
+    '''Returns the FLOPs of the given graph, see set_flops_profiling()
+
+    tf.profiler walks the whole graph, which is slow for the LSTM/CNN models.
+    Its result is cached on disk under a key of the model name (its module),
+    the TensorFlow version and the graph fingerprint (which covers the
+    model_params and the optimizer), so later runs and worker processes
+    skip the profiler.
+
+    Args:
+        graph: TF graph
+        name: name of the model, e.g. its module
+    Return:
+        integer number of float operations, 0 if profiling is disabled
+    '''
+    if not _flops_profiling['enabled']:
+        return 0
+    cache_dir = _flops_profiling['cache_dir']
+    if cache_dir is not None:
+        key = hashlib.sha1('{}|{}|{}'.format(name, tf.__version__, graph_fingerprint(graph)).encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, '{}.json'.format(key))
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as inf:
+                return json.load(inf)['flops']
+
+    with graph.as_default():
+        metadata = tf.RunMetadata()
+        opts = tf.profiler.ProfileOptionBuilder.float_operation()
+        flops = tf.profiler.profile(graph, run_meta=metadata, cmd='scope', options=opts).total_float_ops
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write then rename, other processes may read the same entry
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'w') as ouf:
+            json.dump({'name': name, 'tf_version': tf.__version__, 'flops': flops}, ouf)
+        os.replace(tmp_file, cache_file)
+    return flops
+
 def process_sparse_grad(grads):
     '''
     Args:
@@ -69,10 +141,14 @@ def process_grad(grads):
         a flattened grad in numpy (1-D array)
     '''
 
-    client_grads = grads[0] # shape = (784, 10)
-    for i in range(1, len(grads)):
-        client_grads = np.append(client_grads, grads[i]) # output a flattened array
-        # (784, 10) append (10,)
+    if isinstance(grads, ParamVector):
+        # Already flat, a read-only view instead of a copy: writing into it
+        # would change the model or update it was taken from
+        flat = grads.flat.view()
+        flat.setflags(write=False)
+        return flat
+
+    client_grads = np.concatenate([np.ravel(g) for g in grads]) # output a flattened array
 
     return client_grads
 
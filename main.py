@@ -6,11 +6,14 @@ import os
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
 from flearn.utils.model_utils import read_data
+from flearn.utils.dataset_cache import read_data_cached
+from flearn.utils.client_data import DATA_CACHE
 
 # GLOBAL PARAMETERS
 OPTIMIZERS = ['fedavg', 'fedprox', 'feddane', 'fedddane', 'fedsgd', 'fedprox_origin', 'grouprox']
 DATASETS = ['sent140', 'nist', 'shakespeare', 'mnist', 
-'synthetic_iid', 'synthetic_0_0', 'synthetic_0.5_0.5', 'synthetic_1_1']  # NIST is EMNIST in the paepr
+'synthetic_iid', 'synthetic_0_0', 'synthetic_0.5_0.5', 'synthetic_1_1',
+'synthetic_clustered']  # NIST is EMNIST in the paepr
 
 
 MODEL_PARAMS = {
@@ -83,6 +86,43 @@ def read_options():
                         help='percentage of slow devices',
                         type=float,
                         default=0.1)
+    parser.add_argument('--agg_precision',
+                        help='accumulator of model aggregation;',
+                        type=str,
+                        choices=['float64', 'kahan'],
+                        default='float64')
+    parser.add_argument('--num_workers',
+                        help='number of processes that train clients, 0 for sequential training;',
+                        type=int,
+                        default=0)
+    parser.add_argument('--client_batched',
+                        help='train the selected clients together in one batched graph (linear models only, equal to the sequential training up to float rounding);',
+                        action='store_true')
+    parser.add_argument('--in_graph_loop',
+                        help='run all local epochs of a client in one session call;',
+                        action='store_true')
+    parser.add_argument('--no_flops',
+                        help='do not profile the FLOPs of the model, client computations are reported as 0;',
+                        action='store_true')
+    parser.add_argument('--flops_cache',
+                        help='directory of the FLOP profiling cache, empty to always profile;',
+                        type=str,
+                        default=os.path.join('out', 'flops_cache'))
+    parser.add_argument('--data_budget',
+                        help='memory budget (MB) of the clients data loaded at a time, 0 for no limit;',
+                        type=float,
+                        default=0)
+    parser.add_argument('--data_cache',
+                        help='load the dataset from memory-mapped binary arrays, converted from the json files on first use;',
+                        action='store_true')
+    parser.add_argument('--batcher',
+                        help='minibatches from in-place shuffles of the global RNG, or gathered into reused buffers by a seeded generator per client;',
+                        type=str,
+                        choices=['inplace', 'buffered'],
+                        default='inplace')
+    parser.add_argument('--weighted_selection',
+                        help='select clients with probability proportional to their number of samples;',
+                        action='store_true')
 
 
     try: parsed = vars(parser.parse_args())
@@ -129,11 +169,17 @@ def main():
     # read data
     train_path = os.path.join('data', options['dataset'], 'data', 'train')
     test_path = os.path.join('data', options['dataset'], 'data', 'test')
-    dataset = read_data(train_path, test_path)
+    if options['data_cache']:
+        cache_path = os.path.join('data', options['dataset'], 'data', 'cache')
+        dataset = read_data_cached(train_path, test_path, cache_path)
+        options['client_index_dir'] = cache_path # index.npz of the cache
+    else:
+        dataset = read_data(train_path, test_path)
 
     # call appropriate trainer
     t = optimizer(options, learner, dataset)
     t.train()
+    print('Client data cache: {}'.format(DATA_CACHE.stats()))
     
 if __name__ == '__main__':
     main()
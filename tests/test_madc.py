@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from flearn.utils.madc import data_driven_measure
+
+
+def _calculate_data_driven_measure(pm, correction=False):
+    ''' GroupProx._calculate_data_driven_measure before the blocked version '''
+    n_clients = pm.shape[0]
+    n_dims = pm.shape[1]
+    row_pm_matrix = np.repeat(pm[:,np.newaxis,:], n_clients, axis=1)
+    col_pm_matrix = np.tile(pm, (n_clients, 1, 1))
+    absdiff_pm_matrix = np.abs(col_pm_matrix - row_pm_matrix) # shape=(n_clients, n_clients, n_clients)
+    if correction == True:
+        mask = np.zeros(shape=(n_clients, n_clients))
+        np.fill_diagonal(mask, 1) # Mask all diag
+        mask = np.repeat(mask[np.newaxis,:,:], n_clients, axis=0)
+        for idx in range(mask.shape[-1]):
+            mask[idx,:,idx] = 1 # Mask all 0->n colum for 0->n diff matrix,
+        dm = np.sum(np.ma.array(absdiff_pm_matrix, mask=mask), axis=-1) / (n_dims-2.0)
+    else:
+        dm = np.sum(absdiff_pm_matrix, axis=-1) / (n_dims)
+    return dm
+
+
+def _proximity(n_clients, dtype, seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.randn(n_clients, 16)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return (x @ x.T).astype(dtype) # cosine similarities, like MADC
+
+
+def _budget(pm, rows):
+    return rows * pm.shape[0] * pm.shape[1] * pm.itemsize
+
+
+def _assert_same(dm, expected):
+    expected = np.ma.getdata(expected)
+    assert dm.shape == expected.shape
+    assert dm.dtype == expected.dtype
+    assert np.array_equal(dm, expected)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('correction', [False, True])
+@pytest.mark.parametrize('rows', [1, 5, 8, 37]) # 5 and 8 do not divide 37
+def test_blocks_match_dense(dtype, correction, rows):
+    pm = _proximity(37, dtype)
+    dm = data_driven_measure(pm, correction, budget=_budget(pm, rows))
+    _assert_same(dm, _calculate_data_driven_measure(pm, correction))
+
+
+@pytest.mark.parametrize('correction', [False, True])
+def test_workers_match_dense(correction):
+    pm = _proximity(23, np.float32, seed=1)
+    dm = data_driven_measure(pm, correction, budget=_budget(pm, 4), num_workers=2)
+    _assert_same(dm, _calculate_data_driven_measure(pm, correction))
+
+
+def test_rectangular_pm():
+    # EDC-like proximity, n_dims != n_clients
+    pm = np.random.RandomState(2).rand(11, 7)
+    dm = data_driven_measure(pm, budget=_budget(pm, 3))
+    _assert_same(dm, _calculate_data_driven_measure(pm))
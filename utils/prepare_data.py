@@ -0,0 +1,223 @@
+'''
+samples, removes users and splits the raw data in one streaming pass,
+writing the train and test sets straight into the binary dataset cache
+read by main.py --data_cache;
+
+same options as sample.py, remove_users.py and split_data.py; the files of
+all_data are processed in --num_workers processes, each user's data is
+decoded, transformed and written one user at a time (iid sampling holds
+the sampled data of one file)
+'''
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sys
+
+from utils import iid_divide
+
+parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_path)
+from flearn.utils.dataset_cache import DatasetWriter
+from flearn.utils.leaf_json import read_meta, iter_user_data
+
+
+def file_rng(seed, f, stage):
+    '''random.Random of one stage of one file, independent of the process that runs it'''
+    return random.Random('{}/{}/{}'.format(seed, f, stage)) if seed is not None else random.Random()
+
+
+def plan_file(f, meta, args, first_user):
+    '''decides the users of one file from its metadata
+
+    Return:
+        users: list of (user, hierarchy, number of samples kept)
+        iid: (the sampled indices of the file's samples in the order of the
+            new users, the names of the new users) if iid sampling, else None
+    '''
+    rng = file_rng(args.seed, f, 'plan')
+    num_samples = meta['num_samples']
+    hierarchies = meta.get('hierarchies', [None for _ in meta['users']])
+    users = list(zip(meta['users'], hierarchies, num_samples))
+    iid = None
+    if args.fraction is not None:
+        num_new_samples = int(args.fraction * sum(num_samples))
+        if args.iid:
+            num_new_users = max(1, int(round(args.u * len(users))))
+            selected = rng.sample(range(sum(num_samples)), num_new_samples)
+            names = [str(first_user + i) for i in range(num_new_users)]
+            sizes = [len(g) for g in iid_divide(selected, num_new_users)]
+            users = [(name, None, n) for name, n in zip(names, sizes)]
+            iid = (selected, names)
+        else:
+            rng.shuffle(users)
+            sampled, total = [], 0
+            for user, hier, ns in users:
+                if total >= num_new_samples:
+                    break
+                ns = min(ns, num_new_samples - total)
+                sampled.append((user, hier, ns))
+                total += ns
+            users = sampled
+    if args.min_samples is not None:
+        users = [t for t in users if t[2] > args.min_samples]
+    return users, iid
+
+
+def iid_user_data(path, selected, names):
+    '''yields the (user, data) of the new users of an iid sampled file'''
+    dest = {s: k for k, s in enumerate(selected)}
+    samples = [None for _ in selected]
+    start = 0
+    for _, data in iter_user_data(path):
+        for i in range(len(data['y'])):
+            k = dest.get(start + i)
+            if k is not None:
+                samples[k] = (data['x'][i], data['y'][i])
+        start += len(data['y'])
+    for user, group in zip(names, iid_divide(samples, len(names))):
+        yield user, {'x': [x for x, _ in group], 'y': [y for _, y in group]}
+
+
+def write_file(path, plan, args, writer, train_users=None):
+    '''streams the kept users of one file into writer'''
+    f = os.path.basename(path)
+    users, iid = plan
+    kept = {user: (hier, ns) for user, hier, ns in users}
+    rng = file_rng(args.seed, f, 'data')
+    if iid is not None:
+        user_data = iid_user_data(path, *iid)
+    else:
+        user_data = iter_user_data(path)
+    for user, data in user_data:
+        if user not in kept:
+            continue
+        hier, ns = kept[user]
+        x, y = data['x'], data['y']
+        if ns < len(y):
+            indices = rng.sample(range(len(y)), ns)
+            x, y = [x[i] for i in indices], [y[i] for i in indices]
+
+        if args.user:
+            split = 'train' if user in train_users else 'test'
+            writer.add(split, user, x, y, hier)
+            continue
+        if ns < 2:
+            continue # Both the train and test samples are >= 1
+        num_train_samples = max(1, int(args.frac * ns))
+        if ns == 2:
+            num_train_samples = 1
+        train_blist = [False for _ in range(ns)]
+        for j in rng.sample(range(ns), num_train_samples):
+            train_blist[j] = True
+        writer.add('train', user, [x[j] for j in range(ns) if train_blist[j]],
+            [y[j] for j in range(ns) if train_blist[j]], hier)
+        writer.add('test', user, [x[j] for j in range(ns) if not train_blist[j]],
+            [y[j] for j in range(ns) if not train_blist[j]], hier)
+
+
+def write_shard(path, plan, args, train_users, shard_dir):
+    writer = DatasetWriter(shard_dir)
+    write_file(path, plan, args, writer, train_users)
+    writer.close()
+    return shard_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--name',
+                    help='name of dataset to parse; default: sent140;',
+                    type=str,
+                    default='sent140')
+    parser.add_argument('--iid',
+                    help='sample iid;',
+                    action="store_true")
+    parser.add_argument('--niid',
+                    help="sample niid;",
+                    dest='iid', action='store_false')
+    parser.add_argument('--fraction',
+                    help='fraction of all data to sample; default: no sampling;',
+                    type=float,
+                    default=None)
+    parser.add_argument('--u',
+                    help=('number of users in iid data set; ignored in niid case;'
+                          'represented as fraction of original total number of users; '
+                          'default: 0.01;'),
+                    type=float,
+                    default=0.01)
+    parser.add_argument('--min_samples',
+                    help='users with less than x samples are discarded; default: keep all users;',
+                    type=int,
+                    default=None)
+    parser.add_argument('--by_user',
+                    help='divide users into training and test set groups;',
+                    dest='user', action='store_true')
+    parser.add_argument('--by_sample',
+                    help="divide each user's samples into training and test set groups;",
+                    dest='user', action='store_false')
+    parser.add_argument('--frac',
+                    help='fraction in training set; default: 0.8;',
+                    type=float,
+                    default=0.8)
+    parser.add_argument('--seed',
+                    help='seed of the sampling and splitting; default: unseeded;',
+                    type=int,
+                    default=None)
+    parser.add_argument('--num_workers',
+                    help='number of processes that convert the files, 0 to convert in this process;',
+                    type=int,
+                    default=0)
+    parser.set_defaults(iid=False, user=False)
+
+    args = parser.parse_args()
+
+    print('------------------------------')
+    print('preparing the binary dataset cache')
+
+    data_dir = os.path.join(parent_path, 'data', args.name, 'data')
+    subdir = os.path.join(data_dir, 'all_data')
+    cache_dir = os.path.join(data_dir, 'cache')
+    files = sorted(f for f in os.listdir(subdir) if f.endswith('.json'))
+    paths = [os.path.join(subdir, f) for f in files]
+
+    # The metadata (users, num_samples) precedes user_data in LEAF files
+    if args.num_workers > 0:
+        with mp.Pool(args.num_workers) as pool:
+            metas = pool.map(read_meta, paths)
+    else:
+        metas = [read_meta(path) for path in paths]
+    plans, new_user_count = [], 0 # new_user_count: for iid case
+    for f, meta in zip(files, metas):
+        users, iid = plan_file(f, meta, args, new_user_count)
+        plans.append((users, iid))
+        if iid is not None:
+            new_user_count += len(iid[1])
+
+    train_users = None
+    if args.user:
+        all_users = [user for users, _ in plans for user, _, _ in users]
+        rng = file_rng(args.seed, '', 'split')
+        train_users = set(rng.sample(all_users, int(args.frac * len(all_users))))
+
+    writer = DatasetWriter(cache_dir)
+    if args.num_workers > 0:
+        shard_dirs = [os.path.join(cache_dir, 'shards', str(i)) for i in range(len(files))]
+        with mp.Pool(args.num_workers) as pool:
+            shard_dirs = pool.starmap(write_shard,
+                [(path, plan, args, train_users, shard_dir) for path, plan, shard_dir in zip(paths, plans, shard_dirs)])
+        for shard_dir in shard_dirs:
+            writer.extend(shard_dir)
+        shutil.rmtree(os.path.join(cache_dir, 'shards'))
+    else:
+        for path, plan in zip(paths, plans):
+            print('converting %s' % os.path.basename(path))
+            write_file(path, plan, args, writer, train_users)
+    writer.close()
+    print('writing %s' % cache_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,12 @@ removes users with less than the given number of samples
 '''
 
 import argparse
-import json
 import os
+import sys
 
-import numpy as np
+parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_path)
+from flearn.utils.leaf_json import read_meta, iter_user_data, LeafWriter
 
 parser = argparse.ArgumentParser()
 
@@ -27,7 +29,6 @@ args = parser.parse_args()
 print('------------------------------')
 
 
-parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 dir = os.path.join(parent_path, 'data', args.name, 'data')
 subdir = os.path.join(dir, 'sampled_data')
 files = []
@@ -42,14 +43,11 @@ for f in files:
     users = []
     hierarchies = []
     num_samples = []
-    user_data = {}
-
-    min_number = 0
-    max_number = 0
 
+    # The users to keep are decided from the metadata, the data of the
+    # users is then copied one user at a time
     file_dir = os.path.join(subdir, f)
-    with open(file_dir, 'r') as inf:
-        data = json.load(inf)
+    data = read_meta(file_dir)
 
     num_users = len(data['users'])
     for i in range(num_users):
@@ -60,25 +58,21 @@ for f in files:
         curr_num_samples = data['num_samples'][i]
 
         if curr_num_samples > args.min_samples:
-            user_data[curr_user] = data['user_data'][curr_user]
             users.append(curr_user)
-            max_number += 1
             if curr_hierarchy is not None:
                 hierarchies.append(curr_hierarchy)
             num_samples.append(data['num_samples'][i])
 
-
-    all_data = {}
-    all_data['users'] = users
-    if len(hierarchies) == len(users):
-        all_data['hierarchies'] = hierarchies
-    all_data['num_samples'] = num_samples
-    all_data['user_data'] = user_data
+    if len(hierarchies) != len(users):
+        hierarchies = None
 
     file_name = '%s_keep_%d.json' % ((f[:-5]), args.min_samples)
     ouf_dir = os.path.join(dir, 'rem_user_data', file_name)
 
     print('writing %s' % file_name)
-    with open(ouf_dir, 'w') as outfile:
-        json.dump(all_data, outfile)
+    kept = set(users)
+    with LeafWriter(ouf_dir, users, num_samples, hierarchies) as writer:
+        for user, user_data in iter_user_data(file_dir):
+            if user in kept:
+                writer.write(user, user_data)
 
@@ -7,12 +7,16 @@ ordering of original data points is not preserved in sampled data
 '''
 
 import argparse
-import json
 import os
 import random
+import sys
 
 from utils import iid_divide
 
+parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_path)
+from flearn.utils.leaf_json import read_meta, iter_user_data, LeafWriter
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--name',
@@ -42,7 +46,6 @@ args = parser.parse_args()
 print('------------------------------')
 print('sampling data')
 
-parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 data_dir = os.path.join(parent_path, 'data', args.name, 'data')
 subdir = os.path.join(data_dir, 'all_data')
 files = os.listdir(subdir)
@@ -50,9 +53,10 @@ files = [f for f in files if f.endswith('.json')]
 
 new_user_count = 0 # for iid case
 for f in files:
+    # The sampling is decided from the metadata, the data of the users is
+    # then read one user at a time
     file_dir = os.path.join(subdir, f)
-    with open(file_dir, 'r') as inf:
-        data = json.load(inf)
+    data = read_meta(file_dir)
 
     num_users = len(data['users'])
 
@@ -63,12 +67,6 @@ for f in files:
     hierarchies = None
 
     if(args.iid):
-        raw_list = list(data['user_data'].values())
-        raw_x = [elem['x'] for elem in raw_list]
-        raw_y = [elem['y'] for elem in raw_list]
-        x_list = [item for sublist in raw_x for item in sublist] # flatten raw_x
-        y_list = [item for sublist in raw_y for item in sublist] # flatten raw_y
-
         num_new_users = int(round(args.u * num_users))
         if num_new_users == 0:
             num_new_users += 1
@@ -79,18 +77,25 @@ for f in files:
 
         users = [str(i+new_user_count) for i in range(num_new_users)]
 
-        user_data = {}
-        for user in users:
-            user_data[user] = {'x': [], 'y': []}
-        all_x_samples = [x_list[i] for i in new_indices]
-        all_y_samples = [y_list[i] for i in new_indices]
+        # Only the sampled samples are kept, in the order of new_indices
+        new_pos = {s: k for k, s in enumerate(new_indices)}
+        all_x_samples = [None for _ in new_indices]
+        all_y_samples = [None for _ in new_indices]
+        start = 0
+        for _, cdata in iter_user_data(file_dir):
+            for i in range(len(cdata['y'])):
+                k = new_pos.get(start + i)
+                if k is not None:
+                    all_x_samples[k], all_y_samples[k] = cdata['x'][i], cdata['y'][i]
+            start += len(cdata['y'])
         x_groups = iid_divide(all_x_samples, num_new_users)
         y_groups = iid_divide(all_y_samples, num_new_users)
+        user_data = {}
         for i in range(num_new_users):
-            user_data[users[i]]['x'] = x_groups[i]
-            user_data[users[i]]['y'] = y_groups[i]
+            user_data[users[i]] = {'x': x_groups[i], 'y': y_groups[i]}
         
         num_samples = [len(user_data[u]['y']) for u in users]
+        user_data = user_data.items()
 
         new_user_count += num_new_users
 
@@ -99,6 +104,7 @@ for f in files:
         ctot_num_samples = 0
 
         users = data['users']
+        num_samples_of = dict(zip(users, data['num_samples']))
         users_and_hiers = None
         if 'hierarchies' in data:
             users_and_hiers = list(zip(users, data['hierarchies']))
@@ -107,7 +113,7 @@ for f in files:
             random.shuffle(users)
         user_i = 0
         num_samples = []
-        user_data = {}
+        sampled = {} # {user: indices of the sampled samples, None for all}
 
         if 'hierarchies' in data:
             hierarchies = []
@@ -119,26 +125,18 @@ for f in files:
             else:
                 user = users[user_i]
 
-            cdata = data['user_data'][user]
-
-            cnum_samples = len(data['user_data'][user]['y'])
+            cnum_samples = num_samples_of[user]
+            sampled[user] = None
 
             if (ctot_num_samples + cnum_samples > num_new_samples):
                 cnum_samples = num_new_samples - ctot_num_samples
                 indices = [i for i in range(cnum_samples)]
-                new_indices = random.sample(indices, cnum_samples)
-                x = []
-                y = []
-                for i in new_indices:
-                    x.append(data['user_data'][user]['x'][i])
-                    y.append(data['user_data'][user]['y'][i])
-                cdata = {'x': x, 'y': y}
+                sampled[user] = random.sample(indices, cnum_samples)
             
             if 'hierarchies' in data:
                 hierarchies.append(hier)
 
             num_samples.append(cnum_samples)
-            user_data[user] = cdata
 
             ctot_num_samples += cnum_samples
             user_i += 1
@@ -148,16 +146,19 @@ for f in files:
         else:
             users = users[:user_i]
 
+        def sampled_user_data():
+            for user, cdata in iter_user_data(file_dir):
+                if user not in sampled:
+                    continue
+                if sampled[user] is not None:
+                    cdata = {'x': [cdata['x'][i] for i in sampled[user]],
+                        'y': [cdata['y'][i] for i in sampled[user]]}
+                yield user, cdata
+        user_data = sampled_user_data()
+
     # ------------
     # create .json file
 
-    all_data = {}
-    all_data['users'] = users
-    if hierarchies is not None:
-        all_data['hierarchies'] = hierarchies
-    all_data['num_samples'] = num_samples
-    all_data['user_data'] = user_data
-
     slabel = ''
     if(args.iid):
         slabel = 'iid'
@@ -175,5 +176,6 @@ for f in files:
     ouf_dir = os.path.join(data_dir, 'sampled_data', file_name)
 
     print('writing %s' % file_name)
-    with open(ouf_dir, 'w') as outfile:
-        json.dump(all_data, outfile)
+    with LeafWriter(ouf_dir, users, num_samples, hierarchies) as writer:
+        for user, cdata in user_data:
+            writer.write(user, cdata)
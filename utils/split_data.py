@@ -1,50 +1,38 @@
 '''
-splits data into train and test sets
+splits data into train and test sets;
+writes LEAF json files, see prepare_data.py to sample, remove users and
+split straight into the binary dataset cache
 '''
 
 import argparse
-import json
 import os
 import random
 import sys
 
-def create_jsons_for(user_files, which_set, max_users, include_hierarchy):
-    '''used in split-by-user case'''
-    user_count = 0
-    json_index = 0
-    users = []
-    if include_hierarchy:
-        hierarchies = []
-    else:
-        hierarchies = None
-    num_samples = []
-    user_data = {}
-    for (i, t) in enumerate(user_files):
-        if include_hierarchy:
-            (u, h, ns, f) = t
-        else:
-            (u, ns, f) = t
-
-        file_dir = os.path.join(subdir, f)
-        with open(file_dir, 'r') as inf:
-            data = json.load(inf)
-        
-        users.append(u)
-        if include_hierarchy:
-            hierarchies.append(h)
-        num_samples.append(ns)
-        user_data[u] = data['user_data'][u]
-        user_count += 1
-
-        if (user_count == max_users) or (i == len(user_files) - 1):
-
-            all_data = {}
-            all_data['users'] = users
+parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_path)
+from flearn.utils.leaf_json import read_meta, iter_user_data, LeafWriter
+
+def create_jsons_for(sets, max_users, include_hierarchy):
+    '''used in split-by-user case
+
+    sets: list of (which_set, user_files); the users of each set are
+    written into json files of max_users users, in the order of user_files;
+    every source file is read once, one user at a time
+    '''
+    outputs = {} # {(source file, user): output index}
+    remaining = [] # number of users still to write in each output
+    headers = [] # (which_set, file name, users, num_samples, hierarchies) of each output
+    for which_set, user_files in sets:
+        for json_index, start in enumerate(range(0, len(user_files), max_users)):
+            chunk = user_files[start:start+max_users]
             if include_hierarchy:
-                all_data['hierarchies'] = hierarchies
-            all_data['num_samples'] = num_samples
-            all_data['user_data'] = user_data
+                users, hierarchies, num_samples, fs = [list(t) for t in zip(*chunk)]
+            else:
+                users, num_samples, fs = [list(t) for t in zip(*chunk)]
+                hierarchies = None
 
+            f = fs[-1]
             data_i = f.find('data')
             num_i = data_i + 5
             num_to_end = f[num_i:]
@@ -54,19 +42,33 @@ def create_jsons_for(user_files, which_set, max_users, include_hierarchy):
                 param_to_end = num_to_end[param_i:]
             nf = '%s_%d%s' % (f[:(num_i-1)], json_index, param_to_end)
             file_name = '%s_%s_%s.json' % ((nf[:-5]), which_set, arg_label)
-            ouf_dir = os.path.join(dir, which_set, file_name)
 
-            print('writing %s' % file_name)
-            with open(ouf_dir, 'w') as outfile:
-                json.dump(all_data, outfile)
+            for u, f in zip(users, fs):
+                outputs[(f, u)] = len(headers)
+            remaining.append(len(users))
+            headers.append((which_set, file_name, users, num_samples, hierarchies))
 
-            user_count = 0
-            json_index += 1
-            users = []
-            if include_hierarchy:
-                hierarchies = []
-            num_samples = []
-            user_data = {}
+    writers = {} # the open outputs
+    for f in files:
+        for u, user_data in iter_user_data(os.path.join(subdir, f)):
+            i = outputs.pop((f, u), None)
+            if i is None:
+                continue
+            if i not in writers:
+                which_set, file_name, users, num_samples, hierarchies = headers[i]
+                print('writing %s' % file_name)
+                writers[i] = LeafWriter(os.path.join(dir, which_set, file_name), users, num_samples, hierarchies)
+            writers[i].write(u, user_data)
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                writers.pop(i).close()
+
+    # Users listed in the metadata but without user_data, the outputs still
+    # open are closed to valid (but incomplete) json files
+    for writer in writers.values():
+        writer.close()
+    if len(outputs) > 0:
+        raise ValueError('users without data: %s' % ', '.join('%s (%s)' % (u, f) for f, u in sorted(outputs)))
 
 parser = argparse.ArgumentParser()
 
@@ -91,7 +93,6 @@ args = parser.parse_args()
 print('------------------------------')
 print('generating training and test sets')
 
-parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 dir = os.path.join(parent_path, 'data', args.name, 'data')
 subdir = os.path.join(dir, 'rem_user_data')
 files = []
@@ -111,9 +112,7 @@ arg_label = arg_label[2:]
 
 # check if data contains information on hierarchies
 file_dir = os.path.join(subdir, files[0])
-with open(file_dir, 'r') as inf:
-    data = json.load(inf)
-include_hierarchy = 'hierarchies' in data
+include_hierarchy = 'hierarchies' in read_meta(file_dir)
 
 if (args.user):
     print('splitting data by user')
@@ -123,8 +122,7 @@ if (args.user):
     user_files = []
     for f in files:
         file_dir = os.path.join(subdir, f)
-        with open(file_dir, 'r') as inf:
-            data = json.load(inf)
+        data = read_meta(file_dir)
         if include_hierarchy:
             user_files.extend([(u, h, ns, f) for (u, h, ns) in 
                 zip(data['users'], data['hierarchies'], data['num_samples'])])
@@ -151,29 +149,24 @@ if (args.user):
     max_users = sys.maxsize
     if args.name == 'nist':
         max_users = 50 # max number of users per json file
-    create_jsons_for(train_user_files, 'train', max_users, include_hierarchy)
-    create_jsons_for(test_user_files, 'test', max_users, include_hierarchy)
+    create_jsons_for([('train', train_user_files), ('test', test_user_files)], max_users, include_hierarchy)
 
 else:
     print('splitting data by sample')
 
     for f in files:
+        # The users and the number of train samples are decided from the
+        # metadata, the samples are then split one user at a time
         file_dir = os.path.join(subdir, f)
-        with open(file_dir, 'r') as inf:
-            data = json.load(inf)
+        data = read_meta(file_dir)
 
         num_samples_train = []
-        user_data_train = {}
         num_samples_test = []
-        user_data_test = {}
 
         user_indices = [] # indices of users in data['users'] that are not deleted
 
         for i, u in enumerate(data['users']):
-            user_data_train[u] = {'x': [], 'y': []}
-            user_data_test[u] = {'x': [], 'y': []}
-
-            curr_num_samples = len(data['user_data'][u]['y'])
+            curr_num_samples = data['num_samples'][i]
             if curr_num_samples >= 2:
                 user_indices.append(i)
 
@@ -186,42 +179,42 @@ else:
                 num_samples_train.append(num_train_samples)
                 num_samples_test.append(num_test_samples)
 
-                indices = [j for j in range(curr_num_samples)]
-                train_indices = random.sample(indices, num_train_samples)
-                train_blist = [False for _ in range(curr_num_samples)]
-                for j in train_indices:
-                    train_blist[j] = True
-
-                for j in range(curr_num_samples):
-                    if (train_blist[j]):
-                        user_data_train[u]['x'].append(data['user_data'][u]['x'][j])
-                        user_data_train[u]['y'].append(data['user_data'][u]['y'][j])
-                    else:
-                        user_data_test[u]['x'].append(data['user_data'][u]['x'][j])
-                        user_data_test[u]['y'].append(data['user_data'][u]['y'][j])
-
         users = [data['users'][i] for i in user_indices]
-
-        all_data_train = {}
-        all_data_train['users'] = users
-        all_data_train['num_samples'] = num_samples_train
-        all_data_train['user_data'] = user_data_train
-        all_data_test = {}
-        all_data_test['users'] = users
-        all_data_test['num_samples'] = num_samples_test
-        all_data_test['user_data'] = user_data_test
-
-        if include_hierarchy:
-            all_data_train['hierarchies'] = data['hierarchies']
-            all_data_test['hierarchies'] = data['hierarchies']
+        num_train = dict(zip(users, num_samples_train))
+        hierarchies = data['hierarchies'] if include_hierarchy else None
 
         file_name_train = '%s_train_%s.json' % ((f[:-5]), arg_label)
         file_name_test = '%s_test_%s.json' % ((f[:-5]), arg_label)
         ouf_dir_train = os.path.join(dir, 'train', file_name_train)
         ouf_dir_test = os.path.join(dir, 'test', file_name_test)
         print('writing %s' % file_name_train)
-        with open(ouf_dir_train, 'w') as outfile:
-            json.dump(all_data_train, outfile)
         print('writing %s' % file_name_test)
-        with open(ouf_dir_test, 'w') as outfile:
-            json.dump(all_data_test, outfile)
+        written = set()
+        with LeafWriter(ouf_dir_train, users, num_samples_train, hierarchies) as train_writer, \
+                LeafWriter(ouf_dir_test, users, num_samples_test, hierarchies) as test_writer:
+            for u, user_data in iter_user_data(file_dir):
+                user_data_train = {'x': [], 'y': []}
+                user_data_test = {'x': [], 'y': []}
+
+                if u in num_train:
+                    curr_num_samples = len(user_data['y'])
+                    indices = [j for j in range(curr_num_samples)]
+                    train_indices = random.sample(indices, num_train[u])
+                    train_blist = [False for _ in range(curr_num_samples)]
+                    for j in train_indices:
+                        train_blist[j] = True
+
+                    for j in range(curr_num_samples):
+                        if (train_blist[j]):
+                            user_data_train['x'].append(user_data['x'][j])
+                            user_data_train['y'].append(user_data['y'][j])
+                        else:
+                            user_data_test['x'].append(user_data['x'][j])
+                            user_data_test['y'].append(user_data['y'][j])
+
+                train_writer.write(u, user_data_train)
+                test_writer.write(u, user_data_test)
+                written.add(u)
+        missing = [u for u in users if u not in written]
+        if len(missing) > 0:
+            raise ValueError('users without data in %s: %s' % (f, ', '.join(missing)))
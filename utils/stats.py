@@ -3,21 +3,29 @@ assumes that the user has already generated .json file(s) containing data
 '''
 
 import argparse
-import json
 import matplotlib.pyplot as plt
 import math
 import numpy as np
 import os
+import sys
 
 from scipy import io
 from scipy import stats
 
+parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(parent_path)
+from flearn.utils.client_index import load_index
+from flearn.utils.leaf_json import read_meta
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument('--name',
                 help='name of dataset to parse; default: sent140;',
                 type=str,
                 default='sent140')
+parser.add_argument('--index',
+                help='read the client index of the dataset cache (data/<name>/data/cache) instead of all_data;',
+                action='store_true')
 
 args = parser.parse_args()
 
@@ -27,8 +35,12 @@ def load_data(name):
     users = []
     num_samples = []
 
-    parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     data_dir = os.path.join(parent_path, 'data', name, 'data')
+    if args.index:
+        index = load_index(os.path.join(data_dir, 'cache'))
+        if index is None:
+            raise ValueError('{} has no client index, see utils/prepare_data.py'.format(name))
+        return index.clients, (index.num_train + index.num_test).tolist()
     subdir = os.path.join(data_dir, 'all_data')
 
     files = os.listdir(subdir)
@@ -36,9 +48,7 @@ def load_data(name):
 
     for f in files:
         file_dir = os.path.join(subdir, f)
-
-        with open(file_dir) as inf:
-            data = json.load(inf)
+        data = read_meta(file_dir) # The user data is not needed
 
         users.extend(data['users'])
         num_samples.extend(data['num_samples'])
@@ -69,9 +79,15 @@ def print_dataset_stats(name):
     for e, h in zip(edges, hist):
         print(e, "\t", h)
 
-    parent_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
     data_dir = os.path.join(parent_path, 'data', name, 'data')
 
+    if args.index:
+        index = load_index(os.path.join(data_dir, 'cache'))
+        labels_per_user = (index.label_hist > 0).sum(axis=1)
+        print('\n%d labels (total)' % len(index.labels))
+        print('%.2f labels per user (mean)' % np.mean(labels_per_user))
+        print('labels per user (std): %.2f' % np.std(labels_per_user))
+
     plt.hist(num_samples, bins = bins) 
     fig_name = "%s_hist_nolabel.png" % name
     fig_dir = os.path.join(data_dir, fig_name)